@@ -59,9 +59,44 @@ def logout():
     return redirect(url_for('admin.login'))
 
 import os # For file operations (exists, remove)
-import uuid # For generating unique invite codes
-from file_helpers import load_invites, save_invites # Import helpers for invites
+import csv
+import io
+from flask import Response
+from file_helpers import load_invites, create_invites # Import helpers for invites
 from datetime import datetime, timezone # For timestamps
+from deadlines import sla_classes
+
+INVITE_TYPES = ['image', 'video', 'batch']
+MAX_INVITES_PER_REQUEST = 5000 # Upper bound for one bulk-generate request
+INVITES_PER_PAGE_CHOICES = [25, 50, 100, 250]
+
+
+def _filtered_invites(args):
+    """
+    Applies the invite page filters from `args` (type, status, label, q) and returns
+    the matching invites, newest first.
+    """
+    invite_type = args.get('type', '')
+    status = args.get('status', '')
+    label = args.get('label', '').strip()
+    query = args.get('q', '').strip().lower()
+
+    invites = []
+    for invite in load_invites():
+        if invite_type and invite.type != invite_type:
+            continue
+        if status == 'used' and not invite.used:
+            continue
+        if status == 'unused' and invite.used:
+            continue
+        if label and invite.label != label:
+            continue
+        if query and query not in (invite.code or '').lower():
+            continue
+        invites.append(invite)
+    invites.sort(key=lambda invite: invite.created_at or '', reverse=True)
+    return invites
+
 
 # Placeholder routes for other admin functionalities
 @admin_bp.route('/invites', methods=['GET', 'POST'])
@@ -69,36 +104,85 @@ from datetime import datetime, timezone # For timestamps
 def manage_invites():
     if request.method == 'POST':
         invite_type = request.form.get('invite_type', 'image') # Default to 'image'
-        if invite_type not in ['image', 'video']:
+        label = request.form.get('label', '').strip() or None
+        sla = request.form.get('sla') or None
+        due_by_input = request.form.get('due_by', '').strip()
+        try:
+            count = int(request.form.get('count', 1))
+        except (ValueError, TypeError):
+            count = 0
+        try:
+            # The form's datetime-local value has no zone, it is entered in UTC
+            due_by = datetime.fromisoformat(due_by_input).replace(tzinfo=timezone.utc) if due_by_input else None
+        except ValueError:
+            due_by = False
+
+        if invite_type not in INVITE_TYPES:
             flash('Invalid invite type specified.', 'danger')
+        elif not 1 <= count <= MAX_INVITES_PER_REQUEST:
+            flash(f'Number of codes must be between 1 and {MAX_INVITES_PER_REQUEST}.', 'danger')
+        elif sla and sla not in sla_classes(load_config()):
+            flash('Invalid SLA class specified.', 'danger')
+        elif due_by is False:
+            flash('Invalid due-by time.', 'danger')
+        elif due_by and due_by <= datetime.now(timezone.utc):
+            flash('The due-by time must be in the future.', 'danger')
         else:
-            # Generate a unique invite code
-            new_code = str(uuid.uuid4()) # Using UUID4 for simplicity and uniqueness
-
-            invites = load_invites()
-            # Check for collision, though highly unlikely with UUIDs
-            while any(invite['code'] == new_code for invite in invites):
-                new_code = str(uuid.uuid4())
-
-            invites.append({
-                "code": new_code,
-                "type": invite_type, # 'image' or 'video'
-                "used": False,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
-            if save_invites(invites):
-                flash(f'New invite code generated: {new_code} (Type: {invite_type.capitalize()})', 'success')
+            # All codes are generated and saved in one write
+            new_codes = create_invites(invite_type, count, label=label, sla=sla,
+                                       due_by=due_by.isoformat() if due_by else None)
+            if new_codes is None:
+                flash('Failed to save new invite codes. Check server logs.', 'danger')
+            elif count == 1:
+                flash(f'New invite code generated: {new_codes[0]} (Type: {invite_type.capitalize()})', 'success')
             else:
-                flash('Failed to save new invite code. Check server logs.', 'danger')
+                flash(f'{count} new invite codes generated (Type: {invite_type.capitalize()}). Use "Export CSV" to download them.', 'success')
         return redirect(url_for('admin.manage_invites'))
 
-    current_invites = load_invites()
-    # Sort invites, e.g., by creation date (if available) or just as they are
-    return render_template('admin/manage_invites.html', invites=current_invites)
+    filters = {key: request.args.get(key, '') for key in ('type', 'status', 'label', 'q')}
+    invites = _filtered_invites(request.args)
+
+    per_page = request.args.get('per_page', 50, type=int)
+    if per_page not in INVITES_PER_PAGE_CHOICES:
+        per_page = 50
+    total = len(invites)
+    page_count = max(1, (total + per_page - 1) // per_page)
+    page = min(max(request.args.get('page', 1, type=int), 1), page_count)
+    page_invites = invites[(page - 1) * per_page:page * per_page]
+
+    return render_template('admin/manage_invites.html', invites=page_invites, filters=filters,
+                           page=page, page_count=page_count, per_page=per_page, total=total,
+                           per_page_choices=INVITES_PER_PAGE_CHOICES, sla_classes=sla_classes(load_config()))
 
 
-from file_helpers import load_tasks, save_tasks, get_task_by_id, update_task # Added get_task_by_id, update_task
+@admin_bp.route('/invites/export.csv')
+@admin_required
+def export_invites():
+    """Streams the invites matching the current filters as CSV, one row at a time."""
+    invites = _filtered_invites(request.args)
+
+    def generate():
+        line = io.StringIO()
+        writer = csv.writer(line)
+        writer.writerow(['code', 'type', 'used', 'label', 'sla', 'due_by', 'created_at'])
+        for invite in invites:
+            writer.writerow([invite.code, invite.type, 'yes' if invite.used else 'no',
+                             invite.label or '', invite.sla or '', invite.due_by or '', invite.created_at or ''])
+            if line.tell() > 64 * 1024: # Flush in ~64KB chunks rather than one write per row
+                yield line.getvalue()
+                line.seek(0)
+                line.truncate()
+        yield line.getvalue()
+
+    filename = f"invites_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(generate(), mimetype='text/csv',
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+from file_helpers import load_tasks, get_task_by_id, update_task, cancel_task, retry_task, delete_task # Single-task changes, see manage_queue
 import shutil # For deleting directories (task uploads/outputs)
+from tracing import task_timelines, stage_histograms, STAGE_NAMES # Task stage timelines
+from queue_manager import configured_policy, deadline_risks # Deadline projection for the queue page
 
 @admin_bp.route('/queue', methods=['GET', 'POST'])
 @admin_required
@@ -111,48 +195,47 @@ def manage_queue():
             flash('Task ID is missing.', 'danger')
             return redirect(url_for('admin.manage_queue'))
 
-        current_tasks = load_tasks()
-        task_index = -1
-        for i, t in enumerate(current_tasks):
-            if t['task_id'] == task_id:
-                task_index = i
-                break
-
-        if task_index == -1:
+        task = get_task_by_id(task_id)
+        if task is None:
             flash(f'Task with ID {task_id} not found.', 'danger')
             return redirect(url_for('admin.manage_queue'))
 
-        task_to_modify = current_tasks[task_index]
-
+        # Each action changes only this task, checked and written under the tasks.json lock
+        # (see file_helpers), so it can't undo a claim, ingest or completion that landed meanwhile.
         if action == 'update_priority':
             try:
                 new_priority = int(request.form.get('priority'))
-                task_to_modify['priority'] = new_priority
-                flash(f'Priority for task {task_id} updated to {new_priority}.', 'success')
             except (ValueError, TypeError):
                 flash('Invalid priority value.', 'danger')
+                return redirect(url_for('admin.manage_queue'))
+            if update_task(task_id, {"priority": new_priority}):
+                flash(f'Priority for task {task_id} updated to {new_priority}.', 'success')
+            else:
+                flash(f'Task with ID {task_id} not found.', 'danger')
+
+        elif action == 'cancel_task':
+            if cancel_task(task_id, "Cancelled by an administrator."):
+                flash(f'Task {task_id} has been cancelled.', 'success')
+            else:
+                flash(f'Task {task_id} cannot be cancelled as it has already finished.', 'warning')
 
         elif action == 'retry_task':
-            if task_to_modify['status'] == 'failed':
-                task_to_modify['status'] = 'queued'
-                task_to_modify.pop('error_message', None)
-                task_to_modify.pop('stdout', None)
-                task_to_modify.pop('stderr', None)
-                task_to_modify.pop('started_at', None)
-                task_to_modify.pop('completed_at', None)
-                # Should also clean up output_path if it was partially created or from a previous failed attempt
-                # For simplicity, we assume the worker will overwrite or handle this.
-                # If an old output_path exists, it might be shown incorrectly if retry fails before worker clears it.
-                task_to_modify['output_path'] = None
+            if retry_task(task_id):
                 flash(f'Task {task_id} has been re-queued.', 'success')
+            elif task.status == 'cancelled' and task.ingest:
+                flash(f'Task {task_id} was cancelled before its uploads were stored and cannot be retried.', 'warning')
             else:
-                flash(f'Task {task_id} cannot be retried as it is not in a "failed" state.', 'warning')
+                flash(f'Task {task_id} cannot be retried as it is not in a "failed" or "cancelled" state.', 'warning')
 
         elif action == 'delete_task':
+            deleted_task = delete_task(task_id)
+            if deleted_task is None:
+                flash(f'Task with ID {task_id} not found.', 'danger')
+                return redirect(url_for('admin.manage_queue'))
             # Delete associated files/folders
             # Source/Target files are in uploads/<invite_code>/
             # Output file is in outputs/<invite_code>/
-            invite_code = task_to_modify.get('invite_code')
+            invite_code = deleted_task.invite_code
             if invite_code:
                 upload_dir_for_invite = os.path.join(current_app.config['UPLOADS_DIR'], invite_code)
                 output_dir_for_invite = os.path.join(current_app.config['OUTPUTS_DIR'], invite_code)
@@ -162,29 +245,40 @@ def manage_queue():
                 # or that deleting the invite_code folder is acceptable if multiple tasks share it.
                 # A safer approach would be to delete specific files if their names are unique per task.
                 # Given current naming (source_uuid_name, target_uuid_name), files are unique.
-                # Output is named <invite_code>.<ext>, so it's shared if multiple tasks use same invite.
-                # Let's delete individual source/target files. Output dir might be shared.
+                # Outputs are named after the task (outputs/<invite_code>/<task_id>.<ext>, batches get
+                # outputs/<invite_code>/<task_id>/), so they are deleted one by one like the uploads.
 
-                if task_to_modify.get('source_path') and os.path.exists(task_to_modify['source_path']):
+                if deleted_task.source_path and os.path.exists(deleted_task.source_path):
                     try:
-                        os.remove(task_to_modify['source_path'])
+                        os.remove(deleted_task.source_path)
                         flash(f"Deleted source file for task {task_id}.", "info")
                     except OSError as e:
                         flash(f"Error deleting source file for task {task_id}: {e.strerror}", "danger")
 
-                if task_to_modify.get('target_path') and os.path.exists(task_to_modify['target_path']):
+                if deleted_task.target_path and os.path.exists(deleted_task.target_path):
                     try:
-                        os.remove(task_to_modify['target_path'])
+                        os.remove(deleted_task.target_path)
                         flash(f"Deleted target file for task {task_id}.", "info")
                     except OSError as e:
                         flash(f"Error deleting target file for task {task_id}: {e.strerror}", "danger")
 
+                # Batch tasks: each item has its own target, outputs live in a per-task folder
+                for item in deleted_task.items or []:
+                    for path_key in ('target_path', 'output_path'):
+                        if item.get(path_key) and os.path.isfile(item[path_key]):
+                            try:
+                                os.remove(item[path_key])
+                            except OSError as e:
+                                flash(f"Error deleting batch file for task {task_id}: {e.strerror}", "danger")
+                if deleted_task.items and deleted_task.output_path and os.path.isdir(deleted_task.output_path):
+                    shutil.rmtree(deleted_task.output_path, ignore_errors=True)
+
                 # For output, if the output_path is the invite_code dir, be very careful.
                 # If output_path points to a specific file, delete that file.
-                if task_to_modify.get('output_path') and os.path.exists(task_to_modify['output_path']):
-                     if os.path.isfile(task_to_modify['output_path']):
+                if deleted_task.output_path and os.path.exists(deleted_task.output_path):
+                     if os.path.isfile(deleted_task.output_path):
                         try:
-                            os.remove(task_to_modify['output_path'])
+                            os.remove(deleted_task.output_path)
                             flash(f"Deleted output file for task {task_id}.", "info")
                         except OSError as e:
                             flash(f"Error deleting output file for task {task_id}: {e.strerror}", "danger")
@@ -193,36 +287,63 @@ def manage_queue():
                 # This is more complex and needs care if multiple tasks could share an invite_code
                 # For now, leave the directories.
 
-            current_tasks.pop(task_index)
             flash(f'Task {task_id} and associated files (if found) have been deleted.', 'success')
 
         else:
             flash('Invalid action specified.', 'danger')
 
-        if not save_tasks(current_tasks):
-            flash('Failed to save changes to tasks. Check server logs.', 'danger')
-
         return redirect(url_for('admin.manage_queue'))
 
     all_tasks = load_tasks()
     # Sort tasks for display: e.g., by status, then priority, then creation time
     def get_status_priority(status):
-        order = {"processing": 0, "queued": 1, "completed": 2, "failed": 3}
-        return order.get(status, 4)
+        order = {"processing": 0, "queued": 1, "ingesting": 2, "completed": 3, "failed": 4, "cancelled": 5}
+        return order.get(status, 6)
 
     all_tasks.sort(key=lambda t: (
-        get_status_priority(t.get('status', 'unknown')),
-        t.get('priority', 99),
-        t.get('created_at', '')
+        get_status_priority(t.status or 'unknown'),
+        t.priority,
+        t.created_at or ''
     ))
-    return render_template('admin/manage_queue.html', tasks=all_tasks)
+    # Deadline risk is projected with the live policy, so switching to 'edf' shows its effect
+    risks = deadline_risks(all_tasks, configured_policy(load_config()))
+    deadline_counts = {
+        "met": sum(1 for t in all_tasks if t.deadline_met is True),
+        "missed": sum(1 for t in all_tasks if t.deadline_met is False),
+        "at_risk": sum(1 for risk in risks.values() if risk == 'at_risk'),
+        "overdue": sum(1 for risk in risks.values() if risk == 'overdue'),
+    }
+    return render_template('admin/manage_queue.html', tasks=all_tasks, risks=risks, deadline_counts=deadline_counts)
+
+
+TRACE_TASK_CHOICES = [25, 100, 500]
+
+@admin_bp.route('/trace')
+@admin_required
+def task_trace():
+    """Stage breakdown of recent tasks (or of one, with ?task_id=) plus stage histograms."""
+    task_id = request.args.get('task_id') or None
+    limit = request.args.get('limit', 100, type=int)
+    if limit not in TRACE_TASK_CHOICES:
+        limit = 100
+    timelines = task_timelines(limit=limit, task_id=task_id)
+    histograms = stage_histograms([t for t in timelines if t['outcome'] == 'completed'])
+    return render_template('admin/task_trace.html', timelines=timelines, histograms=histograms,
+                           stage_names=STAGE_NAMES, task_id=task_id, limit=limit,
+                           limit_choices=TRACE_TASK_CHOICES)
 
 
 from file_helpers import save_config # Already have load_config
+from renderers import renderer_status # Preflight of the Deep-Live-Cam install
 
 @admin_bp.route('/settings', methods=['GET', 'POST'])
 @admin_required
 def settings():
+    if request.method == 'POST' and request.form.get('action') == 'check_renderer':
+        renderer_status(load_config().get('deep_live_cam_path'), refresh=True, wait=False) # Runs in the background
+        flash('Renderer check started, reload this page in a moment for the result.', 'info')
+        return redirect(url_for('admin.settings'))
+
     if request.method == 'POST':
         old_password = request.form.get('old_password')
         new_password = request.form.get('new_password')
@@ -259,4 +380,7 @@ def settings():
 
         return redirect(url_for('admin.settings'))
 
-    return render_template('admin/settings.html')
+    config = load_config()
+    renderer, renderer_error = renderer_status(config.get('deep_live_cam_path'), wait=False)
+    return render_template('admin/settings.html', renderer=renderer, renderer_error=renderer_error,
+                           deep_live_cam_path=config.get('deep_live_cam_path'))
@@ -0,0 +1,126 @@
+"""
+Admission control for new submissions.
+
+render_page asks check_admission() before it touches the request body. When the
+queue for the invite's class is too deep, the estimated backlog too long, or
+UPLOADS_DIR is running out of space, the submission is refused with 503 and a
+Retry-After hint instead of spooling uploads that won't be rendered for hours.
+The same goes when nothing could render it: the local worker's Deep-Live-Cam
+install fails its preflight (see renderers.py) and no render nodes are configured.
+
+Limits live under the "admission" key of config.json and override
+DEFAULT_ADMISSION_LIMITS key by key. Per-class limits are dicts keyed by invite
+type ('image', 'video', 'batch'); a missing, null or 0 limit disables that check.
+"""
+import shutil
+
+import metrics
+from file_helpers import load_config, load_tasks
+from queue_manager import DEFAULT_TASK_PRIORITIES, average_task_durations, estimate_task_seconds
+from renderers import renderer_status
+
+DEFAULT_ADMISSION_LIMITS = {
+    "max_queued_tasks": {"image": 200, "video": 50, "batch": 20}, # Waiting tasks of the same class
+    "max_backlog_seconds": {"image": 4 * 3600, "video": 4 * 3600, "batch": 4 * 3600}, # Estimated wait before the new task starts
+    "min_free_disk_mb": 2048, # Free space that must remain in UPLOADS_DIR after the upload
+}
+
+MIN_RETRY_AFTER = 30
+MAX_RETRY_AFTER = 3600
+RENDERER_RETRY_AFTER = 600
+PENDING_STATUSES = ('ingesting', 'queued')
+
+metrics.describe('admission_accepted_total', 'Submissions admitted that became a task, by invite type (counted in render_page).')
+metrics.describe('admission_rejections_total', 'Submissions rejected by admission control, by invite type and reason.')
+
+
+class AdmissionDecision:
+    """Outcome of check_admission(); `reason` and `retry_after` are only set when rejected."""
+
+    def __init__(self, accepted, reason=None, message=None, retry_after=None):
+        self.accepted = accepted
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+def admission_limits(config=None):
+    config = config if config is not None else load_config()
+    limits = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_ADMISSION_LIMITS.items()}
+    for key, value in (config.get('admission') or {}).items():
+        if isinstance(value, dict) and isinstance(limits.get(key), dict):
+            limits[key].update(value)
+        else:
+            limits[key] = value
+    return limits
+
+
+def _class_limit(limits, key, invite_type):
+    value = limits.get(key)
+    if isinstance(value, dict):
+        value = value.get(invite_type)
+    return value or None
+
+
+def _clamp_retry_after(seconds):
+    return int(min(max(seconds, MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+
+def backlog_seconds_ahead(tasks, invite_type, averages):
+    """
+    Estimated seconds of work the worker will do before a new task of `invite_type`
+    starts: everything pending at the same or better priority, plus what is running.
+    """
+    own_priority = DEFAULT_TASK_PRIORITIES.get(invite_type, DEFAULT_TASK_PRIORITIES['image'])
+    backlog = 0
+    for task in tasks:
+        if task.status == 'processing' or (task.status in PENDING_STATUSES and task.priority <= own_priority):
+            backlog += estimate_task_seconds(task, averages)
+    return backlog
+
+
+def check_admission(invite_type, content_length, uploads_dir, config=None):
+    """
+    Decides whether a submission for an invite of `invite_type` may be accepted.
+    Only cheap state is used (task list, disk usage, the request's Content-Length),
+    so this runs before the upload body is read.
+    """
+    config = config if config is not None else load_config()
+    limits = admission_limits(config)
+    tasks = load_tasks()
+    averages = average_task_durations(tasks)
+    decision = AdmissionDecision(True)
+
+    if config.get('run_local_worker', True) and not config.get('worker_tokens'):
+        _, renderer_error = renderer_status(config.get('deep_live_cam_path'), wait=False) # Cached, never probes here
+        if renderer_error:
+            decision = AdmissionDecision(False, 'renderer_unavailable',
+                                         'Rendering is unavailable right now. Please try again later.', RENDERER_RETRY_AFTER)
+
+    max_queued = _class_limit(limits, 'max_queued_tasks', invite_type)
+    # Classes follow the task type; a video invite used for an image lands in the image class.
+    queued_same_class = [t for t in tasks if t.status in PENDING_STATUSES and (t.task_type or 'image') == invite_type]
+    max_backlog = _class_limit(limits, 'max_backlog_seconds', invite_type)
+    min_free_mb = limits.get('min_free_disk_mb')
+
+    if decision.accepted and max_queued and len(queued_same_class) >= max_queued:
+        excess = len(queued_same_class) - max_queued + 1
+        per_task = sum(estimate_task_seconds(t, averages) for t in queued_same_class) / len(queued_same_class)
+        decision = AdmissionDecision(False, 'queue_full', 'The queue is full right now. Please try again later.',
+                                     _clamp_retry_after(excess * per_task))
+
+    if decision.accepted and max_backlog:
+        backlog = backlog_seconds_ahead(tasks, invite_type, averages)
+        if backlog > max_backlog:
+            decision = AdmissionDecision(False, 'backlog_too_long', 'The queue is too long right now. Please try again later.',
+                                         _clamp_retry_after(backlog - max_backlog))
+
+    if decision.accepted and min_free_mb:
+        free_bytes = shutil.disk_usage(uploads_dir).free
+        if free_bytes - (content_length or 0) < min_free_mb * 1024 * 1024:
+            decision = AdmissionDecision(False, 'disk_full', 'The server is low on storage right now. Please try again later.',
+                                         MAX_RETRY_AFTER // 6)
+
+    if not decision.accepted:
+        metrics.inc_counter('admission_rejections_total', invite_type=invite_type, reason=decision.reason)
+    return decision
@@ -1,5 +1,5 @@
 import os
-from flask import Flask
+from flask import Flask, Response, jsonify
 from werkzeug.security import generate_password_hash
 
 # Import blueprints
@@ -7,11 +7,15 @@ from werkzeug.security import generate_password_hash
 # from user_routes import user_bp
 
 import secrets
+import metrics
 from file_helpers import load_config, save_config # Import helpers
 
 # Import blueprints
 from admin_routes import admin_bp
 from user_routes import user_bp
+from ingest import SpoolingRequest, start_ingest_thread
+from worker_api import worker_api_bp
+from renderers import renderer_status
 
 # Define the path for the data directory, uploads, and outputs
 # These are relative to the app.py file location
@@ -36,20 +40,43 @@ if 'secret_key' not in app_config or app_config['secret_key'] == 'please_change_
 
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest # Uploads are spooled straight into uploads/.ingest, see ingest.py
 app.config['SECRET_KEY'] = app_config['secret_key']
 app.config['DATA_DIR'] = DATA_DIR
 app.config['UPLOADS_DIR'] = UPLOADS_DIR
 app.config['OUTPUTS_DIR'] = OUTPUTS_DIR
 app.config['DEEP_LIVE_CAM_PATH'] = app_config.get('deep_live_cam_path', "C:\\ai\\fake_webcam\\Deep-Live-Cam-2.1") # Fallback just in case
 
+# Validate the Deep-Live-Cam install once at startup, so a bad path shows up now
+# rather than as failed tasks (see renderers.py). Render nodes check their own.
+if app_config.get('run_local_worker', True):
+    renderer_status(app_config.get('deep_live_cam_path'))
+
 # Register blueprints
 app.register_blueprint(admin_bp, url_prefix='/admin')
 app.register_blueprint(user_bp)
+app.register_blueprint(worker_api_bp, url_prefix='/api/worker') # Remote render nodes, see render_worker.py
 
 @app.route('/health')
 def health_check():
     return "OK", 200
 
+@app.route('/health/renderer')
+def renderer_health_check():
+    """Preflight for the local renderer: 200 with the install's details, 503 saying what is wrong."""
+    config = load_config()
+    if not config.get('run_local_worker', True):
+        return jsonify({"status": "ok", "local_worker": False}), 200 # Rendering is left to the render nodes
+    renderer, error = renderer_status(config.get('deep_live_cam_path'), wait=False) # The probe runs in the background
+    if renderer is None:
+        return jsonify({"status": "error", "local_worker": True, "error": error or "Renderer check in progress."}), 503
+    return jsonify({"status": "ok", "local_worker": True, **renderer.describe()}), 200
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text format, e.g. admission_rejections_total{invite_type="video",reason="queue_full"}
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     # Create a default config if it doesn't exist
     # This is also a good place to initialize the admin password if not set
@@ -57,7 +84,9 @@ if __name__ == '__main__':
 
     # Start the queue worker thread
     from queue_manager import start_worker_thread
-    start_worker_thread()
+    if app_config.get('run_local_worker', True): # False when render nodes do all the work
+        start_worker_thread()
+    start_ingest_thread() # Also resumes tasks left in 'ingesting' by a previous run
 
     app.run(debug=True) # debug=False for production, typically. Use_reloader=False if debug=True causes worker to start twice.
     # When using Flask's reloader (debug=True by default), be aware that it might start the worker thread twice.
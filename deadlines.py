@@ -0,0 +1,87 @@
+"""
+Task deadlines from invite SLAs.
+
+An invite may carry an absolute `due_by` time and/or an `sla` class, a named
+turnaround such as "express" (one hour from submission). When a task is
+submitted with the invite, task_deadline() turns them into the task's
+`deadline` (UTC ISO string); with both set the earlier one wins. The 'edf'
+scheduling policy in queue_manager.py orders tasks by it, and the admin queue
+flags tasks whose projected finish lies past it.
+
+When a task completes or fails, file_helpers.update_task stores
+`deadline_met` on it (a failure counts as missed) and counts the outcome in
+the task_deadlines_total metric.
+
+SLA classes live under the "sla_classes" key of config.json ({name: seconds})
+and extend or override DEFAULT_SLA_CLASSES. Like tracing.py this module doesn't
+import the app's store.
+"""
+from datetime import datetime, timezone
+
+import metrics
+
+DEFAULT_SLA_CLASSES = {
+    "express": 3600, # Results within the hour, e.g. at a live event
+    "standard": 24 * 3600,
+}
+
+metrics.describe('task_deadlines_total', 'Tasks with a deadline that finished, by task type and outcome (met/missed).')
+
+
+def sla_classes(config=None):
+    """{class name: turnaround seconds}, the defaults updated with config.json's "sla_classes"."""
+    classes = dict(DEFAULT_SLA_CLASSES)
+    for name, seconds in ((config or {}).get('sla_classes') or {}).items():
+        try:
+            classes[name] = float(seconds)
+        except (TypeError, ValueError):
+            print(f"WARNING: Ignoring SLA class {name!r}, {seconds!r} is not a number of seconds.")
+    return classes
+
+
+def parse_time(value):
+    """Aware datetime from an ISO string (naive ones are taken as UTC), None if empty or malformed."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def deadline_timestamp(task):
+    """The task's deadline as a unix timestamp, None if it has none."""
+    deadline = parse_time(task.deadline)
+    return deadline.timestamp() if deadline else None
+
+
+def task_deadline(invite, submitted_at, config=None):
+    """Deadline (UTC ISO string) of a task submitted at `submitted_at` with `invite`, or None."""
+    candidates = []
+    due_by = parse_time(invite.due_by)
+    if due_by:
+        candidates.append(due_by)
+    if invite.sla:
+        seconds = sla_classes(config).get(invite.sla)
+        if seconds is None:
+            print(f"WARNING: Invite {invite.code} has unknown SLA class {invite.sla!r}, ignored.")
+        else:
+            candidates.append(datetime.fromtimestamp(submitted_at.timestamp() + seconds, timezone.utc))
+    return min(candidates).astimezone(timezone.utc).isoformat() if candidates else None
+
+
+def deadline_outcome(task, status, finished_at=None):
+    """
+    True if `task` finishing with `status` now (or at `finished_at`) meets its
+    deadline, False if it misses it, None if it has no deadline.
+    """
+    deadline = deadline_timestamp(task)
+    if deadline is None:
+        return None
+    finished_at = finished_at or datetime.now(timezone.utc)
+    return status == 'completed' and finished_at.timestamp() <= deadline
+
+
+def count_outcome(task, met):
+    metrics.inc_counter('task_deadlines_total', task_type=task.task_type or 'unknown', outcome='met' if met else 'missed')
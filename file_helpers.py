@@ -1,158 +1,853 @@
 import json
 import os
-import fcntl # For file locking on POSIX systems
-import msvcrt # For file locking on Windows
 import time
 import platform
+import tempfile
+import atexit
+import uuid
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Condition, Event, Thread
+import metrics
+from tracing import record_event
+from deadlines import deadline_outcome, count_outcome
+from models import Task, Invite, dumps, loads, document_records, make_document
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
 INVITES_FILE = os.path.join(DATA_DIR, 'invites.json')
 TASKS_FILE = os.path.join(DATA_DIR, 'tasks.json')
+TASK_DETAILS_DIR = os.path.join(DATA_DIR, 'task_details') # Heavy task fields, one file per task
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
+os.makedirs(TASK_DETAILS_DIR, exist_ok=True)
 
 # --- File Locking ---
-# This provides basic cross-platform file locking.
-# For more robust scenarios, especially with higher concurrency,
-# a proper database or a more sophisticated locking mechanism might be needed.
-
-def _lock_file(f):
-    if platform.system() == "Windows":
-        msvcrt.locking(f.fileno(), msvcrt.LK_RLCK, 1) # Lock 1 byte for testing
-    else:
-        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+# Readers take a shared lock and writers an exclusive one, so status polls and
+# admin pages don't serialize against each other, only against writes.
+# Each backend is imported on its own OS only.
+SLOW_LOCK_WAIT_SECONDS = 1.0 # Waits longer than this are logged
+
+if platform.system() == "Windows":
+    import msvcrt # For file locking on Windows
+
+    def _lock_file(f, shared=False):
+        # msvcrt has no shared locks, readers take the exclusive lock too. They still
+        # have to lock: Windows can't rename over a file another process has open.
+        f.seek(0) # msvcrt locks from the current position
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass # LK_LOCK gives up after ~10 seconds, keep waiting like flock does
 
-def _unlock_file(f):
-    if platform.system() == "Windows":
+    def _unlock_file(f):
+        f.seek(0)
         msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
-    else:
+else:
+    import fcntl # For file locking on POSIX systems
+
+    def _lock_file(f, shared=False):
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def _unlock_file(f):
         fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
+metrics.describe('store_lock_wait_seconds_total', 'Time spent waiting for data file locks, by file and mode.')
+metrics.describe('store_lock_acquisitions_total', 'Data file locks taken, by file and mode.')
+
+def _lock_label(file_path):
+    # One label for all task details files, a label per task would grow without bound
+    if os.path.dirname(file_path) == TASK_DETAILS_DIR:
+        return 'task_details'
+    return os.path.basename(file_path)
+
 
 # --- Generic Read/Write with Locking ---
+# Data files are never written in place: a new version goes to a temp file in the
+# same directory, is fsynced and then renamed over the old one (atomic on POSIX
+# and Windows). Readers therefore see either the old or the new content, never a
+# half-written file, even after a crash. The lock is taken on a separate
+# "<file>.lock" file, because the data file itself is replaced on every write.
+def _default_data_for(file_path):
+    return [] if file_path in (TASKS_FILE, INVITES_FILE) else {}
+
+def _lock_path(file_path):
+    return file_path + '.lock'
+
+@contextmanager
+def _locked(file_path, shared=False):
+    mode = 'shared' if shared else 'exclusive'
+    with open(_lock_path(file_path), 'a+') as lock_f:
+        started = time.perf_counter()
+        _lock_file(lock_f, shared)
+        waited = time.perf_counter() - started
+        label = _lock_label(file_path)
+        metrics.inc_counter('store_lock_wait_seconds_total', waited, file=label, mode=mode)
+        metrics.inc_counter('store_lock_acquisitions_total', file=label, mode=mode)
+        if waited > SLOW_LOCK_WAIT_SECONDS:
+            print(f"[{datetime.now()}] Waited {waited:.2f}s for {mode} lock on {file_path}")
+        try:
+            yield
+        finally:
+            _unlock_file(lock_f)
+
+def _fsync_dir(directory):
+    if platform.system() == "Windows":
+        return # Directories can't be opened for fsync on Windows, the rename is durable enough
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _atomic_write(file_path, data):
+    """Writes `data` to a temp file, fsyncs it and renames it over `file_path`. Caller holds the lock."""
+    directory = os.path.dirname(file_path) or '.'
+    # config.json is edited by hand and stays indented, the data files are written compactly
+    content = dumps(data, pretty=(file_path == CONFIG_FILE))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        _bump_version(file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+def _read_json(file_path, default_data):
+    """Reads and parses `file_path`; caller holds the lock. Returns (data, exists)."""
+    try:
+        with open(file_path, 'r') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return default_data, False
+    if not content.strip():
+        # Can't be produced by our own writes any more. Don't "repair" it by writing the
+        # default back, that used to wipe the queue; the next real save replaces it.
+        print(f"Warning: {file_path} is empty. Using default data.")
+        return default_data, True
+    try:
+        return loads(content), True
+    except json.JSONDecodeError:
+        print(f"Warning: JSONDecodeError in {file_path}. Using default data, the file is left as is.")
+        return default_data, True
+
 def load_json_with_lock(file_path, default_data=None):
     if default_data is None:
-        default_data = [] if 'tasks' in file_path or 'invites' in file_path else {}
+        default_data = _default_data_for(file_path)
 
-    try:
-        # Use 'r+' for reading and potentially creating if it doesn't exist,
-        # but we'll handle creation more explicitly if needed.
-        # For reading, 'r' is sufficient if we ensure files are pre-created.
-        with open(file_path, 'r+') as f: # Open in r+ to allow locking
-            _lock_file(f)
-            try:
-                # Check if file is empty
-                f.seek(0, os.SEEK_END)
-                if f.tell() == 0:
-                    # File is empty, write default data and return it
-                    f.seek(0)
-                    json.dump(default_data, f, indent=4)
-                    f.truncate() # Ensure no old data remains if file existed but was empty
-                    data = default_data
-                else:
-                    # File is not empty, rewind and load
-                    f.seek(0)
-                    data = json.load(f)
-            except json.JSONDecodeError:
-                # File exists but is corrupted or not valid JSON.
-                # Overwrite with default data.
-                print(f"Warning: JSONDecodeError in {file_path}. Initializing with default.")
-                f.seek(0) # Go to the beginning of the file
-                f.truncate() # Clear the file content
-                json.dump(default_data, f, indent=4)
-                data = default_data
-            finally:
-                _unlock_file(f)
+    with _locked(file_path, shared=True):
+        data, exists = _read_json(file_path, default_data)
+    if exists:
         return data
-    except FileNotFoundError:
-        # File doesn't exist, create it with default data
-        print(f"Warning: File {file_path} not found. Creating with default data.")
-        with open(file_path, 'w') as f:
-            _lock_file(f) # Lock before writing
-            json.dump(default_data, f, indent=4)
-            _unlock_file(f) # Unlock after writing
-        return default_data
+
+    with _locked(file_path): # Creating it is a write, retake the lock exclusively and check again
+        data, exists = _read_json(file_path, default_data)
+        if not exists:
+            # File doesn't exist, create it with default data
+            print(f"Warning: File {file_path} not found. Creating with default data.")
+            try:
+                _atomic_write(file_path, default_data)
+            except OSError as e:
+                print(f"Error creating {file_path}: {e}")
+    return data
 
 def save_json_with_lock(file_path, data):
     try:
-        with open(file_path, 'w') as f: # Open in 'w' to overwrite/create
-            _lock_file(f)
-            json.dump(data, f, indent=4)
-            _unlock_file(f)
+        with _locked(file_path):
+            _atomic_write(file_path, data)
         return True
-    except IOError as e:
+    except (IOError, OSError) as e:
         print(f"Error saving JSON to {file_path}: {e}")
         return False
 
+
+class AbortTransaction(Exception):
+    """Raised inside a json_transaction block to leave every file untouched."""
+
+
+@contextmanager
+def json_transaction(*file_paths):
+    """
+    Locks every file in `file_paths` and yields their parsed contents as a list
+    (in the order given). Entries may be mutated in place or replaced by
+    assigning to the list. When the block exits normally all of them are written
+    back (atomically, see _atomic_write) before any lock is released, so readers
+    never see one file updated without the others. Raising AbortTransaction
+    inside the block skips the write. Locks are always taken in sorted path
+    order so two transactions can't deadlock each other.
+    """
+    with ExitStack() as stack:
+        for path in sorted(set(file_paths)):
+            stack.enter_context(_locked(path))
+
+        data = [_read_json(path, _default_data_for(path))[0] for path in file_paths]
+
+        try:
+            yield data
+        except AbortTransaction:
+            return
+
+        for path, value in zip(file_paths, data):
+            _atomic_write(path, value)
+
+# --- Read Cache ---
+# Parsed config, invites and tasks are kept per process and reused for as long as the
+# file is unchanged, so repeated reads cost one os.stat and no parse. Writes from this
+# process bump the file's version in _atomic_write; writes from other processes
+# replace the file, which changes its stat stamp (mtime, size and inode). Cached
+# values are shared, callers always get copies.
+metrics.describe('store_cache_hits_total', 'Reads served from the in-process cache, by file.')
+metrics.describe('store_cache_misses_total', 'Reads that had to load and parse the file, by file.')
+
+_file_versions = {}
+
+def _bump_version(file_path):
+    _file_versions[file_path] = _file_versions.get(file_path, 0) + 1
+
+def _file_stamp(file_path):
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _copy_json(value):
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+class _CachedFile:
+    """The result of build() for one file, rebuilt when the file's version or stamp changes."""
+
+    def __init__(self, file_path, build):
+        self.file_path = file_path
+        self._build = build
+        self._lock = Lock()
+        self._key = None
+        self._value = None
+
+    def get(self):
+        label = os.path.basename(self.file_path)
+        with self._lock:
+            # Key taken before loading, so a write racing with the load forces another reload
+            key = (_file_versions.get(self.file_path, 0), _file_stamp(self.file_path))
+            if key[1] is None or key != self._key:
+                self._value = self._build()
+                self._key = key
+                metrics.inc_counter('store_cache_misses_total', file=label)
+            else:
+                metrics.inc_counter('store_cache_hits_total', file=label)
+            return self._value
+
 # --- Config File Helpers ---
+DEFAULT_CONFIG = {
+    "admin_password": "pbkdf2:sha256:600000$VfOpL0Xr1g5g0kZm$c71df531654deaba5036787b00e428f57066801c98f7782dd588d60d4089f17b",  # Default for "admin"
+    "deep_live_cam_path": "C:\\ai\\fake_webcam\\Deep-Live-Cam-2.1",
+    "secret_key": "please_change_this_secret_key"
+}
+
+_config_cache = _CachedFile(CONFIG_FILE, lambda: load_json_with_lock(CONFIG_FILE, _copy_json(DEFAULT_CONFIG)))
+
 def load_config():
-    return load_json_with_lock(CONFIG_FILE, {
-        "admin_password": "pbkdf2:sha256:600000$VfOpL0Xr1g5g0kZm$c71df531654deaba5036787b00e428f57066801c98f7782dd588d60d4089f17b",  # Default for "admin"
-        "deep_live_cam_path": "C:\\ai\\fake_webcam\\Deep-Live-Cam-2.1",
-        "secret_key": "please_change_this_secret_key"
-    })
+    """Returns the current config. Cheap enough to call per request or per worker loop, see _CachedFile."""
+    return _copy_json(_config_cache.get())
 
 def save_config(config_data):
     return save_json_with_lock(CONFIG_FILE, config_data)
 
 # --- Invites File Helpers ---
+def _build_invite_cache():
+    invites = [Invite.from_dict(record) for record in document_records(load_json_with_lock(INVITES_FILE, []), 'invites')]
+    return invites, {invite.code: invite for invite in invites} # Code -> invite index, so lookups don't scan the list
+
+_invite_cache = _CachedFile(INVITES_FILE, _build_invite_cache)
+
 def load_invites():
-    return load_json_with_lock(INVITES_FILE, [])
+    return [invite.copy() for invite in _invite_cache.get()[0]]
 
 def save_invites(invites_data):
-    return save_json_with_lock(INVITES_FILE, invites_data)
+    return save_json_with_lock(INVITES_FILE, make_document('invites', [invite.to_record() for invite in invites_data]))
 
 def get_invite_by_code(invite_code):
-    invites = load_invites()
-    for invite in invites:
-        if invite.get('code') == invite_code:
-            return invite
-    return None
+    invite = _invite_cache.get()[1].get(invite_code)
+    return invite.copy() if invite is not None else None # Copy, the index entry is shared
+
+def create_invites(invite_type, count, label=None, sla=None, due_by=None):
+    """
+    Generates `count` new unused invite codes of `invite_type` and stores them with a
+    single write. `label` optionally tags them (e.g. with an event name) for filtering,
+    `sla` and `due_by` give their tasks a deadline (see deadlines.py).
+    Returns the list of new codes, or None if saving failed.
+    """
+    created_at = datetime.now(timezone.utc).isoformat()
+    new_codes = []
+    try:
+        with json_transaction(INVITES_FILE) as documents:
+            records = document_records(documents[0], 'invites')
+            existing_codes = {record.get('code') for record in records}
+            while len(new_codes) < count:
+                new_code = str(uuid.uuid4()) # Using UUID4 for simplicity and uniqueness
+                if new_code in existing_codes: # Collision check, though highly unlikely with UUIDs
+                    continue
+                existing_codes.add(new_code)
+                new_codes.append(new_code)
+                records.append(Invite(new_code, invite_type, False, created_at, label, sla, due_by).to_record())
+            documents[0] = make_document('invites', records)
+    except IOError as e:
+        print(f"Error creating invites: {e}")
+        return None
+    return new_codes
 
 def update_invite_status(invite_code, used_status):
-    invites = load_invites()
     updated = False
-    for invite in invites:
-        if invite.get('code') == invite_code:
-            invite['used'] = used_status
+    try:
+        with json_transaction(INVITES_FILE) as documents:
+            records = document_records(documents[0], 'invites')
+            record = next((r for r in records if r.get('code') == invite_code), None)
+            if record is None:
+                raise AbortTransaction()
+            record['used'] = used_status
+            documents[0] = make_document('invites', records)
             updated = True
-            break
-    if updated:
-        return save_invites(invites)
-    return False
+    except IOError as e:
+        print(f"Error updating invite {invite_code}: {e}")
+        return False
+    return updated
+
+# --- Task Details (heavy fields) ---
+# options, stdout and stderr live in one small file per task, see models.py.
+def _task_details_path(task_id):
+    return os.path.join(TASK_DETAILS_DIR, f"{task_id}.json")
+
+def load_task_details(task_id):
+    path = _task_details_path(task_id)
+    if not os.path.exists(path):
+        return {}
+    return load_json_with_lock(path, {})
+
+def save_task_details(task_id, details):
+    return save_json_with_lock(_task_details_path(task_id), details)
+
+def update_task_details(task_id, updates):
+    if not os.path.exists(_task_details_path(task_id)):
+        return save_task_details(task_id, updates)
+    try:
+        with json_transaction(_task_details_path(task_id)) as documents:
+            documents[0].update(updates)
+    except IOError as e:
+        print(f"Error updating details of task {task_id}: {e}")
+        return False
+    return True
+
+def delete_task_details(task_id):
+    path = _task_details_path(task_id)
+    for leftover in (path, _lock_path(path)):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+def _save_dirty_details(tasks):
+    for task in tasks:
+        details = task.pop_dirty_details()
+        if details is not None:
+            save_task_details(task.task_id, details)
 
 # --- Tasks File Helpers ---
+def _build_task_cache():
+    records = document_records(load_json_with_lock(TASKS_FILE, []), 'tasks')
+    return records, {record.get('task_id'): record for record in records}
+
+_task_cache = _CachedFile(TASKS_FILE, _build_task_cache)
+
+def _task_from_cache(record, pending):
+    fields = dict(_with_pending(record, pending))
+    for key in Task.NESTED_FIELDS: # Would otherwise be shared with the cache
+        if fields.get(key):
+            fields[key] = _copy_json(fields[key])
+    return Task(fields.pop('task_id'), **fields)
+
 def load_tasks():
-    return load_json_with_lock(TASKS_FILE, [])
+    pending = _task_commits.snapshot() # Taken before reading, see _TaskCommitter.snapshot
+    return [_task_from_cache(record, pending) for record in _task_cache.get()[0]]
 
 def save_tasks(tasks_data):
-    return save_json_with_lock(TASKS_FILE, tasks_data)
+    _task_commits.flush() # Queued updates are already reflected in tasks_data, don't replay them on top
+    _save_dirty_details(tasks_data) # Heavy fields first, so a saved task always has its details
+    return save_json_with_lock(TASKS_FILE, make_document('tasks', [task.to_record() for task in tasks_data]))
 
 def get_task_by_id(task_id):
-    tasks = load_tasks()
-    for task in tasks:
-        if task.get('task_id') == task_id:
-            return task
-    return None
+    pending = _task_commits.snapshot()
+    record = _task_cache.get()[1].get(task_id)
+    return _task_from_cache(record, pending) if record is not None else None
+
+def create_task_for_invite(new_task, invite_code):
+    """
+    Adds `new_task` (a Task) and marks `invite_code` as used in one transaction over
+    tasks.json and invites.json, instead of two independent rewrites.
+    Also closes the double-submit race: the invite is re-checked under the lock.
+    Returns False if the invite is unknown, already used, or the write failed.
+    """
+    created = False
+    try:
+        with json_transaction(TASKS_FILE, INVITES_FILE) as documents:
+            task_records = document_records(documents[0], 'tasks')
+            invite_records = document_records(documents[1], 'invites')
+            invite = next((r for r in invite_records if r.get('code') == invite_code), None)
+            if invite is None or invite.get('used'):
+                raise AbortTransaction()
+            _save_dirty_details([new_task])
+            task_records.append(new_task.to_record())
+            invite['used'] = True
+            documents[0] = make_document('tasks', task_records)
+            documents[1] = make_document('invites', invite_records)
+            created = True
+    except IOError as e:
+        print(f"Error creating task for invite {invite_code}: {e}")
+        return False
+    return created
+
+def _move_inline_heavy(task_id, record):
+    """
+    Version 1 records still carry heavy fields inline, they are moved to the details
+    file on first touch. Values already in the details file are newer and win.
+    """
+    inline_heavy = {key: record.pop(key) for key in Task.HEAVY_FIELDS if key in record}
+    if inline_heavy:
+        save_task_details(task_id, {**inline_heavy, **load_task_details(task_id)})
+
+def _apply_light_updates(record, updates):
+    for key, value in updates.items():
+        if value is None:
+            record.pop(key, None)
+        else:
+            record[key] = value
+
+def _with_pending(record, pending):
+    updates = pending.get(record.get('task_id'))
+    if updates:
+        record = dict(record)
+        _apply_light_updates(record, updates)
+    return record
+
+def _commit_task_updates(batch):
+    """
+    Applies {task_id: light_updates} to tasks.json in a single transaction.
+    Returns the set of task ids that were found.
+    """
+    found = set()
+    with json_transaction(TASKS_FILE) as documents:
+        records = document_records(documents[0], 'tasks')
+        by_id = {record.get('task_id'): record for record in records}
+        for task_id, updates in batch.items():
+            record = by_id.get(task_id)
+            if record is None:
+                continue # Deleted meanwhile
+            found.add(task_id)
+            _move_inline_heavy(task_id, record)
+            _apply_light_updates(record, updates)
+        if not found:
+            raise AbortTransaction()
+        documents[0] = make_document('tasks', records)
+    return found
+
+
+DEFAULT_FLUSH_INTERVAL_MS = 50
+
+class _CommitTicket:
+    __slots__ = ('task_id', 'event', 'found')
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.event = Event()
+        self.found = False
+
+
+class _TaskCommitter:
+    """
+    Group commit for update_task(). Updates are merged per task and written by a
+    background thread in one tasks.json rewrite per flush interval
+    ("store_flush_interval_ms" in config.json, 0 writes every update straight away).
+    Callers that pass wait=True block until their batch is on disk; wait=False
+    callers (progress updates) return immediately. Readers in this process see
+    queued updates through snapshot(), so they never read an older state than
+    they wrote.
+    """
 
-def update_task(task_id, updates):
+    def __init__(self):
+        self._cond = Condition()
+        self._flush_lock = Lock() # One writer at a time: the thread or an explicit flush()
+        self._pending = {} # task_id -> merged light updates, not picked up yet
+        self._inflight = {} # Batch currently being written
+        self._tickets = []
+        self._batch_started = None
+        self._thread = None
+
+    def _flush_interval(self):
+        try:
+            interval_ms = float(load_config().get('store_flush_interval_ms', DEFAULT_FLUSH_INTERVAL_MS))
+        except (TypeError, ValueError):
+            interval_ms = DEFAULT_FLUSH_INTERVAL_MS
+        return max(interval_ms, 0) / 1000.0
+
+    def submit(self, task_id, updates, wait=True):
+        interval = self._flush_interval()
+        with self._cond:
+            self._pending.setdefault(task_id, {}).update(updates)
+            ticket = _CommitTicket(task_id) if wait or interval == 0 else None
+            if ticket is not None:
+                self._tickets.append(ticket)
+            if interval > 0:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                if self._batch_started is None:
+                    self._batch_started = time.monotonic()
+                    self._cond.notify()
+        if ticket is None:
+            return True
+        if interval == 0:
+            self.flush()
+        ticket.event.wait()
+        return ticket.found
+
+    def snapshot(self):
+        """Queued and in-flight updates, merged per task. Take it *before* reading the file:
+        anything committed in between is then both on disk and in the snapshot, which is harmless."""
+        with self._cond:
+            merged = {task_id: dict(updates) for task_id, updates in self._inflight.items()}
+            for task_id, updates in self._pending.items():
+                merged.setdefault(task_id, {}).update(updates)
+        return merged
+
+    def flush(self):
+        """Writes everything queued so far and wakes its waiters."""
+        with self._flush_lock:
+            with self._cond:
+                batch, tickets = self._pending, self._tickets
+                self._pending, self._tickets, self._batch_started = {}, [], None
+                self._inflight = batch
+            found = set()
+            try:
+                if batch:
+                    found = _commit_task_updates(batch)
+            except (IOError, OSError) as e:
+                print(f"Error committing updates for {len(batch)} task(s): {e}")
+            finally:
+                with self._cond:
+                    self._inflight = {}
+                for ticket in tickets:
+                    ticket.found = ticket.task_id in found
+                    ticket.event.set()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._batch_started is None:
+                    self._cond.wait()
+                started = self._batch_started
+            delay = started + self._flush_interval() - time.monotonic()
+            if delay > 0:
+                time.sleep(delay) # Let more updates join this batch
+            self.flush()
+
+
+_task_commits = _TaskCommitter()
+atexit.register(_task_commits.flush) # Don't lose wait=False updates on a clean shutdown
+
+def flush_task_updates():
+    _task_commits.flush()
+
+TRACED_STATUSES = ('queued', 'completed', 'failed') # Status changes that are timeline events, see tracing.py
+DEADLINE_STATUSES = ('completed', 'failed') # Status changes that settle whether a deadline was met
+
+def update_task(task_id, updates, wait=True):
     """
     Updates specific fields of a task.
-    `updates` is a dictionary of fields to change.
+    `updates` is a dictionary of fields to change; a value of None removes the field.
+    Heavy fields (options, stdout, stderr) go to the task's details file.
+    Updates are group-committed (see _TaskCommitter). With wait=False the call
+    returns before the update is on disk; use it for frequent progress updates
+    whose loss in a crash is harmless.
     """
-    tasks = load_tasks()
-    task_found = False
-    for task in tasks:
-        if task.get('task_id') == task_id:
-            task.update(updates)
-            task_found = True
-            break
+    heavy_updates = {key: updates[key] for key in Task.HEAVY_FIELDS if key in updates}
+    light_updates = {key: value for key, value in updates.items() if key not in Task.HEAVY_FIELDS}
+    if not light_updates:
+        if get_task_by_id(task_id) is None:
+            return False
+        return update_task_details(task_id, heavy_updates)
+    # Heavy fields first, so whoever sees the new status also sees e.g. the final stdout
+    if heavy_updates and not update_task_details(task_id, heavy_updates):
+        return False
+    finished_task = get_task_by_id(task_id) if light_updates.get('status') in DEADLINE_STATUSES else None
+    _settle_deadline(finished_task, light_updates)
+    task_found = _task_commits.submit(task_id, light_updates, wait=wait)
+    if not task_found and heavy_updates:
+        delete_task_details(task_id) # Task was deleted meanwhile, don't leave its details behind
     if task_found:
-        return save_tasks(tasks)
-    return False
+        _status_updated(task_id, finished_task, light_updates)
+    return task_found
+
+def _settle_deadline(task, light_updates):
+    """Adds deadline_met to an update that finishes `task`, if the task has a deadline."""
+    if task is None or light_updates.get('status') not in DEADLINE_STATUSES or 'deadline_met' in light_updates:
+        return
+    met = deadline_outcome(task, light_updates['status'])
+    if met is not None:
+        light_updates['deadline_met'] = met
+
+def _status_updated(task_id, task, light_updates):
+    """Timeline event and deadline metric for an applied update."""
+    if light_updates.get('status') in TRACED_STATUSES:
+        record_event(task_id, light_updates['status'], deadline_met=light_updates.get('deadline_met'))
+    if task is not None and light_updates.get('deadline_met') is not None:
+        count_outcome(task, light_updates['deadline_met'])
+
+def update_task_if(task_id, updates, condition):
+    """
+    Like update_task, but only applied if condition(record) holds for the task's
+    stored record; the check and the write happen in one transaction, so nothing
+    can change the task in between. Heavy fields are written once the update was
+    applied. Returns True if it was.
+    """
+    heavy_updates = {key: updates[key] for key in Task.HEAVY_FIELDS if key in updates}
+    light_updates = {key: value for key, value in updates.items() if key not in Task.HEAVY_FIELDS}
+    applied = []
+
+    def apply(record):
+        if not condition(record):
+            raise AbortTransaction()
+        task = Task.from_dict(record)
+        _settle_deadline(task, light_updates)
+        _apply_light_updates(record, light_updates)
+        applied.append(task)
+
+    if _modify_task_record(task_id, apply) is None:
+        return False
+    if heavy_updates:
+        update_task_details(task_id, heavy_updates)
+    _status_updated(task_id, applied[0], light_updates)
+    return True
+
 
+def _modify_task_record(task_id, change):
+    """
+    Applies change(record) to the stored record of one task in a single transaction,
+    so the check and the write both see the current state. `change` raises
+    AbortTransaction to leave the file untouched. Queued updates are flushed first.
+    Returns a copy of the changed record, or None if the task is unknown or the change was aborted.
+    """
+    _task_commits.flush() # The transaction below reads the file, queued updates must be in it
+    changed = None
+    with json_transaction(TASKS_FILE) as documents:
+        records = document_records(documents[0], 'tasks')
+        record = next((r for r in records if r.get('task_id') == task_id), None)
+        if record is None:
+            raise AbortTransaction()
+        _move_inline_heavy(task_id, record) # Heavy updates written after this go to the details file, they must not be shadowed
+        change(record)
+        documents[0] = make_document('tasks', records)
+        changed = dict(record)
+    return changed
+
+
+CANCELLABLE_STATUSES = ('ingesting', 'queued', 'processing')
+
+def cancel_task(task_id, reason="Cancelled."):
+    """
+    Marks a waiting or running task 'cancelled'. A worker rendering it notices on
+    its next poll and stops (see workspace.run_monitored); render nodes get 409.
+    Returns False if the task is unknown or already finished.
+    """
+    def cancel(record):
+        if record.get('status') not in CANCELLABLE_STATUSES:
+            raise AbortTransaction()
+        record.update({"status": "cancelled", "error_message": reason, "completed_at": datetime.now().isoformat()})
+        record.pop('lease_expires_at', None)
+        record.pop('progress', None)
+
+    cancelled = _modify_task_record(task_id, cancel) is not None
+    if cancelled:
+        record_event(task_id, 'cancelled')
+    return cancelled
+
+
+RETRYABLE_STATUSES = ('failed', 'cancelled')
+RETRY_CLEARED_FIELDS = ('error_message', 'started_at', 'completed_at', 'lease_owner', 'lease_expires_at',
+                        'progress', 'deadline_met')
+
+def retry_task(task_id):
+    """
+    Puts a failed or cancelled task, or a completed batch with failed targets, back
+    into the queue. Batch tasks only re-run the targets that didn't complete.
+    Returns False if the task is unknown or can't be retried, e.g. because it was
+    cancelled before its uploads were stored (it still has its 'ingest' entries).
+    """
+    def requeue(record):
+        if record.get('ingest'):
+            raise AbortTransaction() # Its files were discarded, there is nothing to render
+        items = record.get('items') or []
+        partially_failed_batch = record.get('status') == 'completed' and \
+            any(item.get('status') == 'failed' for item in items)
+        if record.get('status') not in RETRYABLE_STATUSES and not partially_failed_batch:
+            raise AbortTransaction()
+        for item in items:
+            if item.get('status') != 'completed':
+                item.update({"status": "queued", "error_message": None})
+        record['status'] = 'queued'
+        for key in RETRY_CLEARED_FIELDS:
+            record.pop(key, None)
+        if not items:
+            record.pop('output_path', None) # Batch tasks keep their output folder, completed targets are in it
+
+    if _modify_task_record(task_id, requeue) is None:
+        return False
+    update_task_details(task_id, {"stdout": None, "stderr": None})
+    record_event(task_id, 'queued', reason='retry')
+    return True
+
+
+def delete_task(task_id):
+    """
+    Removes a task from tasks.json, and its details file. Returns the removed Task
+    (its files are left to the caller), or None if there was no such task.
+    """
+    _task_commits.flush()
+    removed = None
+    with json_transaction(TASKS_FILE) as documents:
+        records = document_records(documents[0], 'tasks')
+        index = next((i for i, r in enumerate(records) if r.get('task_id') == task_id), None)
+        if index is None:
+            raise AbortTransaction()
+        removed = Task.from_dict(records.pop(index))
+        documents[0] = make_document('tasks', records)
+    if removed is not None:
+        delete_task_details(task_id)
+    return removed
+
+# --- Task Claims and Leases ---
+# Workers (the local queue worker and remote render nodes, see worker_api.py) take
+# tasks with claim_next_task(), so two of them can never start the same task.
+# Remote claims carry a lease: the node has to renew it while it works, otherwise
+# the task is put back into the queue by the next claim.
+def _parse_utc(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def lease_expired(task, now=None):
+    expires_at = _parse_utc(task.lease_expires_at)
+    return expires_at is not None and expires_at < (now or datetime.now(timezone.utc))
+
+def _requeue_expired_leases(records, now):
+    requeued = []
+    for record in records:
+        if record.get('status') != 'processing':
+            continue
+        expires_at = _parse_utc(record.get('lease_expires_at'))
+        if expires_at is None or expires_at >= now:
+            continue
+        print(f"[{datetime.now()}] Lease of task {record.get('task_id')} held by {record.get('lease_owner')} expired, requeueing.")
+        record['status'] = 'queued'
+        for key in ('lease_owner', 'lease_expires_at', 'started_at', 'progress'):
+            record.pop(key, None)
+        requeued.append(record.get('task_id'))
+    return requeued
+
+def claim_next_task(worker_id, choose, lease_seconds=None):
+    """
+    Atomically picks the next task and marks it 'processing' for `worker_id`.
+    `choose` gets the list of queued Tasks and returns one of them (or None).
+    With `lease_seconds` the claim expires unless renewed with renew_task_lease().
+    Expired leases are requeued first. Returns the claimed Task, or None.
+    """
+    _task_commits.flush() # The transaction below reads the file, queued updates must be in it
+    now = datetime.now(timezone.utc)
+    claimed = None
+    with json_transaction(TASKS_FILE) as documents:
+        records = document_records(documents[0], 'tasks')
+        requeued = _requeue_expired_leases(records, now)
+        queued = [Task.from_dict(record) for record in records if record.get('status') == 'queued']
+        choice = choose(queued) if queued else None
+        if choice is None:
+            if not requeued:
+                raise AbortTransaction()
+        else:
+            record = next(r for r in records if r.get('task_id') == choice.task_id)
+            record['status'] = 'processing'
+            record['started_at'] = datetime.now().isoformat()
+            record['lease_owner'] = worker_id
+            if lease_seconds:
+                record['lease_expires_at'] = (now + timedelta(seconds=lease_seconds)).isoformat()
+            else:
+                record.pop('lease_expires_at', None) # In-process worker, no expiry
+            claimed = Task.from_dict(record)
+        documents[0] = make_document('tasks', records)
+    for task_id in requeued:
+        record_event(task_id, 'queued', reason='lease_expired')
+    if claimed is not None:
+        record_event(claimed.task_id, 'claimed', worker=worker_id)
+    return claimed
+
+def holds_lease(record, worker_id, now=None):
+    """Whether the stored task `record` is being processed under an unexpired lease of `worker_id`."""
+    if record.get('status') != 'processing' or record.get('lease_owner') != worker_id:
+        return False
+    expires_at = _parse_utc(record.get('lease_expires_at'))
+    return expires_at is None or expires_at >= (now or datetime.now(timezone.utc))
+
+def update_leased_task(task_id, worker_id, updates):
+    """
+    update_task for a task leased to `worker_id`, checked against the stored record
+    in the same transaction (see update_task_if). A node whose lease expired and was
+    taken over can't overwrite the new owner's result. Returns False if the lease is lost.
+    """
+    return update_task_if(task_id, updates, lambda record: holds_lease(record, worker_id))
+
+def run_if_leased(task_id, worker_id, action):
+    """
+    Calls action() under the tasks.json lock if the task is still leased to
+    `worker_id` (see holds_lease), so the lease can't be taken over and the task
+    can't be cancelled while it runs. Keep action short, e.g. a rename. Nothing
+    is written. Returns False if the lease is lost.
+    """
+    _task_commits.flush() # The transaction below reads the file, queued updates must be in it
+    ran = False
+    with json_transaction(TASKS_FILE) as documents:
+        record = next((r for r in document_records(documents[0], 'tasks') if r.get('task_id') == task_id), None)
+        if record is not None and holds_lease(record, worker_id):
+            action()
+            ran = True
+        raise AbortTransaction()
+    return ran
+
+def renew_task_lease(task_id, worker_id, lease_seconds, updates=None):
+    """
+    Extends the lease of a task held by `worker_id`, optionally applying progress
+    `updates` too; the lease is checked in the same transaction (see update_task_if).
+    Returns the Task, or None if the task is gone or no longer leased to `worker_id`.
+    """
+    expires_at = (datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)).isoformat()
+    if not update_task_if(task_id, {**(updates or {}), "lease_expires_at": expires_at},
+                          lambda record: holds_lease(record, worker_id)):
+        return None
+    return get_task_by_id(task_id)
 
 if __name__ == '__main__':
     # Test functions
@@ -180,7 +875,7 @@ if __name__ == '__main__':
     initial_invites = load_invites()
     print(f"Initial invites: {initial_invites}")
 
-    new_invite = {"code": "test12345", "type": "image", "used": False}
+    new_invite = Invite("test12345", "image", False)
     initial_invites.append(new_invite)
     if save_invites(initial_invites):
         print("Invites saved.")
@@ -190,13 +885,13 @@ if __name__ == '__main__':
 
         retrieved_invite = get_invite_by_code("test12345")
         print(f"Retrieved invite 'test12345': {retrieved_invite}")
-        assert retrieved_invite is not None and not retrieved_invite['used']
+        assert retrieved_invite is not None and not retrieved_invite.used
 
         if update_invite_status("test12345", True):
             print("Invite status updated.")
             updated_invite = get_invite_by_code("test12345")
             print(f"Updated invite 'test12345': {updated_invite}")
-            assert updated_invite and updated_invite['used']
+            assert updated_invite and updated_invite.used
 
     # Tasks
     print("\n--- Tasks Test ---")
@@ -204,7 +899,7 @@ if __name__ == '__main__':
     initial_tasks = load_tasks()
     print(f"Initial tasks: {initial_tasks}")
 
-    new_task = {"task_id": "task-abcde", "status": "queued", "data": "dummy"}
+    new_task = Task("task-abcde", status="queued", options={"keep_fps": True})
     initial_tasks.append(new_task)
     if save_tasks(initial_tasks):
         print("Tasks saved.")
@@ -214,22 +909,20 @@ if __name__ == '__main__':
 
         retrieved_task = get_task_by_id("task-abcde")
         print(f"Retrieved task 'task-abcde': {retrieved_task}")
-        assert retrieved_task is not None and retrieved_task['status'] == 'queued'
+        assert retrieved_task is not None and retrieved_task.status == 'queued'
+        assert retrieved_task.options == {"keep_fps": True} # Lazily loaded from the details file
 
-        if update_task("task-abcde", {"status": "processing", "progress": "50%"}):
+        if update_task("task-abcde", {"status": "processing", "stdout": "50%"}):
             print("Task updated.")
             updated_task_info = get_task_by_id("task-abcde")
             print(f"Updated task 'task-abcde': {updated_task_info}")
-            assert updated_task_info and updated_task_info['status'] == 'processing' and updated_task_info['progress'] == '50%'
+            assert updated_task_info and updated_task_info.status == 'processing' and updated_task_info.stdout == '50%'
+        delete_task_details("task-abcde")
 
     print("\nFile helper tests complete.")
     # Clean up by removing test files or resetting them
     # For simplicity, we'll just re-save them empty or with defaults
-    save_config(load_json_with_lock(CONFIG_FILE, default_data={
-        "admin_password": "pbkdf2:sha256:600000$VfOpL0Xr1g5g0kZm$c71df531654deaba5036787b00e428f57066801c98f7782dd588d60d4089f17b",
-        "deep_live_cam_path": "C:\\ai\\fake_webcam\\Deep-Live-Cam-2.1",
-        "secret_key": "please_change_this_secret_key"
-    }))
+    save_config(load_json_with_lock(CONFIG_FILE, default_data=DEFAULT_CONFIG))
     save_invites([])
     save_tasks([])
     print("Test data cleaned up.")
@@ -0,0 +1,225 @@
+"""
+Background ingest of uploaded media.
+
+Submitting a task used to save both uploads, rewrite tasks.json and then
+rewrite invites.json inside the request. Now the request only *accepts* the
+upload:
+
+1. SpoolingRequest makes the multipart parser write each uploaded file straight
+   into a spool file under INGEST_DIR while the body is being read, so there is
+   no second copy to make afterwards.
+2. render_page claims the spool files, reserves the task with status
+   'ingesting' (see file_helpers.create_task_for_invite) and returns.
+3. The ingest thread moves the spool files to their final upload paths
+   (a rename, INGEST_DIR lives inside UPLOADS_DIR), checks that the content
+   really is the media it claims to be and flips the task to 'queued'.
+
+The pending moves are stored on the task itself ('ingest' field), so tasks
+left in 'ingesting' by a restart are picked up again when the thread starts.
+"""
+import os
+import queue
+import tempfile
+import time
+from datetime import datetime, timezone
+from threading import Thread, Lock
+
+from flask import Request
+
+from file_helpers import load_tasks, get_task_by_id, update_task_if
+from tracing import record_event
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOADS_DIR = os.path.join(BASE_DIR, 'uploads')
+INGEST_DIR = os.path.join(UPLOADS_DIR, '.ingest')
+os.makedirs(INGEST_DIR, exist_ok=True)
+
+SPOOL_PREFIX = 'spool_'
+STALE_SPOOL_SECONDS = 3600 # Spool files older than this belong to requests that died mid-way
+
+
+class SpoolingRequest(Request):
+    """
+    Request class that spools every uploaded file into a named file in
+    INGEST_DIR. Spool files that are not claimed with claim_upload() by the
+    time the request is closed (validation errors, aborted submits) are removed.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = tempfile.NamedTemporaryFile('wb+', dir=INGEST_DIR, prefix=SPOOL_PREFIX, suffix='.part', delete=False)
+        self.__dict__.setdefault('_unclaimed_spools', set()).add(spool.name)
+        return spool
+
+    def claim_upload(self, file_storage):
+        """
+        Takes ownership of the spool file behind `file_storage` and returns its path.
+        The stream is closed here; the file itself is kept for the ingest thread.
+        """
+        stream = file_storage.stream
+        spool_path = getattr(stream, 'name', None)
+        unclaimed = self.__dict__.get('_unclaimed_spools', set())
+        if not isinstance(spool_path, str) or spool_path not in unclaimed:
+            # Not one of our spool files (e.g. a test client passing a BytesIO), spool it now.
+            with tempfile.NamedTemporaryFile('wb', dir=INGEST_DIR, prefix=SPOOL_PREFIX, suffix='.part', delete=False) as spool:
+                file_storage.save(spool)
+            return spool.name
+        stream.flush()
+        stream.close()
+        unclaimed.discard(spool_path)
+        return spool_path
+
+    def close(self):
+        super().close()
+        for spool_path in self.__dict__.pop('_unclaimed_spools', set()):
+            try:
+                os.remove(spool_path)
+            except OSError:
+                pass
+
+
+# --- Media sniffing ---
+# Only the container signatures we accept in ALLOWED_*_EXTENSIONS are recognised.
+def sniff_media_kind(file_path):
+    """Returns 'image', 'video' or None by looking at the first bytes of the file."""
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(16)
+    except OSError:
+        return None
+    if head.startswith(b'\xff\xd8\xff') or head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image'
+    if head[4:8] == b'ftyp': # mp4 / mov
+        return 'video'
+    if head.startswith(b'\x1a\x45\xdf\xa3'): # webm (Matroska/EBML)
+        return 'video'
+    return None
+
+
+# --- Ingest Worker ---
+_ingest_queue = queue.Queue()
+_ingest_thread = None
+_ingest_thread_lock = Lock()
+
+
+def _discard_files(entries):
+    for entry in entries:
+        for path in (entry['spool'], entry['dest']):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def _finish_ingest(task_id, updates):
+    """
+    Applies the final update of an ingest, but only while the task is still
+    'ingesting': it may have been cancelled while its files were being moved,
+    and that must stick. Returns False if it wasn't applied.
+    """
+    return update_task_if(task_id, updates, lambda record: record.get('status') == 'ingesting')
+
+
+def _fail_ingest(task_id, error_message, entries):
+    _discard_files(entries)
+    _finish_ingest(task_id, {"status": "failed", "error_message": error_message,
+                             "completed_at": datetime.now(timezone.utc).isoformat(), "ingest": None})
+
+
+def ingest_task(task_id, entries):
+    """
+    Finalizes the uploads of one task. `entries` is a list of dicts with
+    'spool' (spool file path), 'dest' (final absolute path), 'role' (for error
+    messages) and 'kinds' (media kinds accepted for this file).
+    """
+    task = get_task_by_id(task_id)
+    if not task or task.status != 'ingesting':
+        return False # Deleted meanwhile, or already ingested (e.g. resumed twice)
+
+    for entry in entries:
+        if os.path.exists(entry['spool']):
+            os.makedirs(os.path.dirname(entry['dest']), exist_ok=True)
+            try:
+                os.replace(entry['spool'], entry['dest'])
+            except OSError as e:
+                print(f"[{datetime.now()}] Ingest of task {task_id} failed to move {entry['spool']}: {e}")
+                _fail_ingest(task_id, f"Could not store uploaded {entry['role']} file.", entries)
+                return False
+        elif not os.path.exists(entry['dest']):
+            # Neither the spool nor the final file exists, nothing left to ingest.
+            _fail_ingest(task_id, f"Uploaded {entry['role']} file was lost before processing.", entries)
+            return False
+
+        if os.path.getsize(entry['dest']) == 0:
+            _fail_ingest(task_id, f"Uploaded {entry['role']} file is empty.", entries)
+            return False
+        if sniff_media_kind(entry['dest']) not in entry['kinds']:
+            _fail_ingest(task_id, f"Uploaded {entry['role']} file is not a valid {' or '.join(entry['kinds'])}.", entries)
+            return False
+
+    record_event(task_id, 'files_saved', files=len(entries))
+    if not _finish_ingest(task_id, {"status": "queued", "queued_at": datetime.now(timezone.utc).isoformat(), "ingest": None}):
+        # Cancelled (or deleted) meanwhile, nothing will ever render these files
+        print(f"[{datetime.now()}] Task {task_id} was cancelled during ingest, discarding its uploads.")
+        _discard_files(entries)
+        return False
+    return True
+
+
+def _sweep_stale_spools():
+    cutoff = time.time() - STALE_SPOOL_SECONDS
+    pending = set()
+    for task in load_tasks():
+        if task.status != 'ingesting':
+            continue # E.g. cancelled before its ingest ran, its spools are garbage now
+        for entry in task.ingest or []:
+            pending.add(entry['spool'])
+    for name in os.listdir(INGEST_DIR):
+        path = os.path.join(INGEST_DIR, name)
+        if name.startswith(SPOOL_PREFIX) and path not in pending:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def ingest_worker():
+    print(f"[{datetime.now()}] Ingest worker started.")
+    # Resume tasks whose ingest was interrupted by a restart.
+    for task in load_tasks():
+        if task.status == 'ingesting' and task.ingest:
+            _ingest_queue.put((task.task_id, task.ingest))
+
+    last_sweep = 0
+    while True:
+        try:
+            task_id, entries = _ingest_queue.get(timeout=60)
+        except queue.Empty:
+            task_id = None
+        if task_id:
+            try:
+                ingest_task(task_id, entries)
+            except Exception as e:
+                print(f"[{datetime.now()}] Unexpected error ingesting task {task_id}: {e}")
+                _fail_ingest(task_id, f"An unexpected error occurred while ingesting: {str(e)}", entries)
+        if time.time() - last_sweep > STALE_SPOOL_SECONDS:
+            _sweep_stale_spools()
+            last_sweep = time.time()
+
+
+def start_ingest_thread():
+    """Starts the ingest worker thread once per process."""
+    global _ingest_thread
+    with _ingest_thread_lock:
+        if _ingest_thread is None or not _ingest_thread.is_alive():
+            _ingest_thread = Thread(target=ingest_worker, daemon=True)
+            _ingest_thread.start()
+
+
+def enqueue_ingest(task_id, entries):
+    """Hands a freshly reserved task to the ingest thread, starting it if needed."""
+    start_ingest_thread()
+    _ingest_queue.put((task_id, entries))
@@ -0,0 +1,72 @@
+"""
+Process-local metrics.
+
+Counters and gauges are kept in memory per process and rendered in the
+Prometheus text format by the /metrics route in app.py. Each metric is
+identified by name plus a dict of labels, e.g.
+inc_counter('admission_rejections_total', invite_type='video', reason='queue_full').
+"""
+from threading import Lock
+
+_lock = Lock()
+_counters = {}
+_gauges = {}
+_help = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def describe(name, help_text):
+    """Registers the HELP line shown for `name`."""
+    _help[name] = help_text
+
+
+def inc_counter(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get_counter(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def counter_totals(name):
+    """Returns {labels_tuple: value} for every label combination of counter `name`."""
+    with _lock:
+        return {labels: value for (metric, labels), value in _counters.items() if metric == name}
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in labels) + '}'
+
+
+def render_prometheus():
+    """Renders every metric in the Prometheus text exposition format."""
+    with _lock:
+        series = [(name, labels, value, 'counter') for (name, labels), value in _counters.items()]
+        series += [(name, labels, value, 'gauge') for (name, labels), value in _gauges.items()]
+    lines = []
+    seen = set()
+    for name, labels, value, metric_type in sorted(series, key=lambda s: (s[0], s[1])):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
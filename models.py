@@ -0,0 +1,176 @@
+"""
+Typed records for tasks and invites, plus the JSON backend used by the store.
+
+Task and Invite use __slots__ and are stored compactly: fields that are None are
+left out, documents are written without indentation and carry a schema version:
+
+    {"schema_version": 2, "tasks": [...]}    (tasks.json)
+    {"schema_version": 2, "invites": [...]}  (invites.json)
+
+Version 1 files (a bare JSON list) are still read and are rewritten in the new
+format on their next save.
+
+The heavy task fields (options, stdout, stderr) are not kept in tasks.json. They
+live in data/task_details/<task_id>.json and are only read when one of them is
+accessed, so hot paths like the scheduler and the status API never load them.
+
+orjson is used for (de)serialization when it is installed, the stdlib json otherwise.
+"""
+import json
+
+try:
+    import orjson # Optional fast JSON backend
+except ImportError:
+    orjson = None
+
+SCHEMA_VERSION = 2
+
+
+def dumps(data, pretty=False):
+    """Serializes `data` to a str. `pretty` keeps the indented layout for hand-edited files."""
+    if pretty:
+        return json.dumps(data, indent=4)
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data, separators=(',', ':'))
+
+
+def loads(text):
+    """Parses JSON text. Raises json.JSONDecodeError (orjson's error subclasses it)."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def document_records(document, key):
+    """Returns the record list of a tasks/invites document, whatever its schema version."""
+    if isinstance(document, list): # Version 1: the file is the bare list
+        return document
+    if isinstance(document, dict):
+        return document.get(key) or []
+    return []
+
+
+def make_document(key, records):
+    return {"schema_version": SCHEMA_VERSION, key: records}
+
+
+def _heavy_field(name, default=None):
+    def getter(self):
+        value = self._load_details().get(name)
+        return default() if value is None and default is not None else value
+
+    def setter(self, value):
+        self._load_details()[name] = value
+        self._details_dirty = True
+
+    return property(getter, setter)
+
+
+class Task:
+    """
+    One render task. Unknown fields found in a stored record are kept in `extra`
+    so they survive a load/save round trip.
+    """
+
+    FIELDS = ('task_id', 'invite_code', 'task_type', 'status', 'priority', 'created_at', 'queued_at',
+              'started_at', 'completed_at', 'source_path', 'target_path', 'output_path', 'error_message',
+              'items', 'ingest', 'lease_owner', 'lease_expires_at', 'progress', 'preview_frames',
+              'deadline', 'deadline_met')
+    NESTED_FIELDS = ('items', 'ingest') # Hold lists of dicts, deep-copied when handed out from the read cache
+    HEAVY_FIELDS = ('options', 'stdout', 'stderr')
+    DEFAULTS = {'priority': 99}
+
+    __slots__ = FIELDS + ('extra', '_details', '_details_dirty')
+
+    def __init__(self, task_id, **fields):
+        for name in self.FIELDS[1:]:
+            setattr(self, name, fields.pop(name, self.DEFAULTS.get(name)))
+        self.task_id = task_id
+        self._details = None
+        self._details_dirty = False
+        heavy = {name: fields.pop(name) for name in self.HEAVY_FIELDS if name in fields}
+        if heavy:
+            # Given inline (new task, or a version 1 record): keep in memory, stored separately on save
+            self._details = heavy
+            self._details_dirty = True
+        self.extra = fields
+
+    options = _heavy_field('options', dict)
+    stdout = _heavy_field('stdout')
+    stderr = _heavy_field('stderr')
+
+    def _load_details(self):
+        if self._details is None:
+            from file_helpers import load_task_details # Imported here, file_helpers imports this module
+            self._details = load_task_details(self.task_id)
+        return self._details
+
+    @property
+    def details_dirty(self):
+        return self._details_dirty
+
+    def pop_dirty_details(self):
+        """Returns the heavy fields if they were changed since loading (clearing the flag), else None."""
+        if not self._details_dirty:
+            return None
+        self._details_dirty = False
+        return dict(self._details)
+
+    @classmethod
+    def from_dict(cls, record):
+        fields = dict(record)
+        return cls(fields.pop('task_id'), **fields)
+
+    def to_record(self):
+        """Compact storage form: light fields only, None values left out."""
+        record = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        record.update(self.extra)
+        return record
+
+    def to_dict(self, include_heavy=False):
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        data.update(self.extra)
+        if include_heavy:
+            for name in self.HEAVY_FIELDS:
+                data[name] = getattr(self, name)
+        return data
+
+    def __repr__(self):
+        return f"Task({self.task_id!r}, status={self.status!r}, task_type={self.task_type!r})"
+
+
+class Invite:
+    """
+    One invite code. `type` is 'image', 'video' or 'batch'. `sla` (an SLA class
+    name) and `due_by` (UTC ISO time) optionally give its task a deadline, see deadlines.py.
+    """
+
+    FIELDS = ('code', 'type', 'used', 'created_at', 'label', 'sla', 'due_by')
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, code, type='image', used=False, created_at=None, label=None, sla=None, due_by=None, **extra):
+        self.code = code
+        self.type = type
+        self.used = used
+        self.created_at = created_at
+        self.label = label
+        self.sla = sla
+        self.due_by = due_by
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(**record)
+
+    def to_record(self):
+        record = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        record.update(self.extra)
+        return record
+
+    def copy(self):
+        return Invite(self.code, self.type, self.used, self.created_at, self.label, self.sla, self.due_by, **self.extra)
+
+    def __repr__(self):
+        return f"Invite({self.code!r}, type={self.type!r}, used={self.used!r})"
@@ -0,0 +1,170 @@
+"""
+Preview frames of videos that are still rendering.
+
+Deep-Live-Cam extracts a video's frames into temp/<target name>/ next to the
+target (inside the task's workspace, see workspace.py) and then swaps faces
+frame by frame, writing each result over the extracted frame. PreviewSampler
+looks at that directory every PREVIEW_INTERVAL_SECONDS while run.py runs:
+
+- frames rewritten since the extraction finished are processed; as frames are
+  processed roughly in order, a binary search over the sorted names gives the
+  processed fraction with a handful of stat() calls;
+- of PREVIEW_MAX_FRAMES evenly spaced frames, those already processed are
+  copied to PREVIEWS_DIR/<task_id>/ once, downscaled to a small JPEG when
+  Pillow is installed.
+
+So a task never has more than PREVIEW_MAX_FRAMES previews and the status page
+never reads more than those small files. The worker removes them when the
+render ends; the final output replaces them.
+
+Like workspace.py this module doesn't import the app's store.
+"""
+import os
+import shutil
+import time
+
+try:
+    from PIL import Image # Optional, previews are downscaled when it is installed
+except ImportError:
+    Image = None
+
+PREVIEWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'previews')
+PREVIEW_MAX_FRAMES = 12
+PREVIEW_INTERVAL_SECONDS = 15.0
+PREVIEW_MAX_WIDTH = 480
+PREVIEW_MAX_FRAME_BYTES = 2 * 1024 * 1024 # Without Pillow frames are copied as they are, bigger ones are skipped
+FRAME_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def preview_dir(task_id):
+    return os.path.join(PREVIEWS_DIR, task_id)
+
+
+def list_previews(task_id):
+    """File names of the task's previews in frame order (at most PREVIEW_MAX_FRAMES)."""
+    try:
+        return sorted(name for name in os.listdir(preview_dir(task_id)) if name.endswith(FRAME_EXTENSIONS))
+    except OSError:
+        return []
+
+
+def remove_previews(task_id):
+    shutil.rmtree(preview_dir(task_id), ignore_errors=True)
+
+
+def sweep_previews(keep=()):
+    """Removes previews left behind by a crash or restart, except those of task ids in `keep`."""
+    if not os.path.isdir(PREVIEWS_DIR):
+        return
+    for name in os.listdir(PREVIEWS_DIR):
+        if name not in keep:
+            shutil.rmtree(os.path.join(PREVIEWS_DIR, name), ignore_errors=True)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _save_preview(frame_path, dest_base):
+    """Writes a preview of `frame_path` to dest_base + extension. Returns False if skipped."""
+    if Image is not None:
+        try:
+            with Image.open(frame_path) as frame:
+                frame.thumbnail((PREVIEW_MAX_WIDTH, PREVIEW_MAX_WIDTH))
+                tmp_path = dest_base + '.part'
+                frame.convert('RGB').save(tmp_path, 'JPEG', quality=80)
+            os.replace(tmp_path, dest_base + '.jpg')
+            return True
+        except OSError:
+            return False # Half-written by run.py, next round
+    try:
+        if os.path.getsize(frame_path) > PREVIEW_MAX_FRAME_BYTES:
+            return False
+        tmp_path = dest_base + '.part'
+        shutil.copyfile(frame_path, tmp_path)
+        os.replace(tmp_path, dest_base + os.path.splitext(frame_path)[1].lower())
+        return True
+    except OSError:
+        return False # Removed by run.py meanwhile, or no space left for previews
+
+
+class PreviewSampler:
+    """
+    Samples processed frames of one render, see the module docstring. Call
+    sample() regularly (it can be passed as run_monitored's on_poll); it returns
+    True when new previews were written or `processed_fraction`, the estimate
+    of how much of the video has been swapped so far, moved.
+    """
+
+    def __init__(self, task_id, frames_dir, max_frames=PREVIEW_MAX_FRAMES, interval=PREVIEW_INTERVAL_SECONDS):
+        self.task_id = task_id
+        self.frames_dir = frames_dir
+        self.max_frames = max_frames
+        self.interval = interval
+        self.processed_fraction = 0.0
+        self.preview_count = 0
+        self._last_sample = None
+        self._frame_count = None
+        self._extracted_mtime = None # mtime of the last extracted frame, frames newer than that are processed
+        self._captured = set()
+
+    @classmethod
+    def for_target(cls, task_id, workspace_target_path, **kwargs):
+        """Sampler for a render of the target at `workspace_target_path` (Deep-Live-Cam's temp/<name>/ layout)."""
+        directory, name = os.path.split(workspace_target_path)
+        return cls(task_id, os.path.join(directory, 'temp', os.path.splitext(name)[0]), **kwargs)
+
+    def _frames(self):
+        try:
+            return sorted(entry.name for entry in os.scandir(self.frames_dir) if entry.name.endswith(FRAME_EXTENSIONS))
+        except OSError:
+            return []
+
+    def _processed(self, name):
+        mtime = _mtime(os.path.join(self.frames_dir, name))
+        return mtime is not None and mtime > self._extracted_mtime
+
+    def _processed_count(self, frames):
+        low, high = 0, len(frames) # First frame that isn't processed yet
+        while low < high:
+            middle = (low + high) // 2
+            if self._processed(frames[middle]):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def sample(self, elapsed=None, workspace=None):
+        now = time.monotonic()
+        if self._last_sample is not None and now - self._last_sample < self.interval:
+            return False
+        self._last_sample = now
+        frames = self._frames()
+        if not frames:
+            return False
+        if self._extracted_mtime is None:
+            # Extraction is done once the frame count stops changing between two samples
+            if len(frames) != self._frame_count:
+                self._frame_count = len(frames)
+                return False
+            self._extracted_mtime = _mtime(os.path.join(self.frames_dir, frames[-1]))
+            if self._extracted_mtime is None:
+                return False
+
+        fraction = self._processed_count(frames) / len(frames)
+        changed = fraction != self.processed_fraction
+        self.processed_fraction = fraction
+        os.makedirs(preview_dir(self.task_id), exist_ok=True)
+        for slot in range(self.max_frames):
+            index = int((slot + 0.5) * len(frames) / self.max_frames)
+            if index in self._captured or not self._processed(frames[index]):
+                continue
+            if _save_preview(os.path.join(self.frames_dir, frames[index]),
+                             os.path.join(preview_dir(self.task_id), f"frame_{index:06d}")):
+                self._captured.add(index)
+                changed = True
+        self.preview_count = len(self._captured)
+        return changed
@@ -1,9 +1,15 @@
+import heapq
 import os
 import subprocess
 import time
 from threading import Thread
-from file_helpers import load_config, load_tasks, update_task # Using centralized file helpers
-from datetime import datetime # For sorting by creation date
+from file_helpers import load_config, load_tasks, get_task_by_id, update_task, claim_next_task, update_leased_task # Using centralized file helpers
+from renderers import renderer_status
+from workspace import TaskWorkspace, QuotaExceeded, TaskCancelled, run_monitored, sweep_workspaces
+from tracing import record_event
+from previews import PreviewSampler, remove_previews, sweep_previews
+from deadlines import deadline_timestamp
+from datetime import datetime, timezone # For sorting by creation date
 
 # Define base directory for output files, can be made configurable if needed
 # This assumes queue_manager.py is at the root of the project.
@@ -12,108 +18,435 @@ from datetime import datetime # For sorting by creation date
 BASE_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outputs')
 os.makedirs(BASE_OUTPUT_DIR, exist_ok=True)
 
+# Default priority per task type. Lower number is higher priority, videos go ahead of images.
+DEFAULT_TASK_PRIORITIES = {'video': 10, 'image': 20, 'batch': 20}
 
-def process_task(task_details, app_config):
+# Run time guesses (seconds) used until there is enough task history to learn from.
+DEFAULT_TASK_SECONDS = {'video': 300, 'image': 20}
+DURATION_HISTORY_SIZE = 50 # Completed tasks per media kind used for the running average
+
+LOCAL_WORKER_ID = 'local' # lease_owner of tasks run by the in-process worker
+RENDER_TIMEOUT_SECONDS = 1800 # 30 mins per run.py invocation
+
+
+def _run_seconds(task):
+    try:
+        started = datetime.fromisoformat(task.started_at)
+        completed = datetime.fromisoformat(task.completed_at)
+        return (completed - started).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+def average_task_durations(tasks):
     """
-    Processes a single task: activates venv and runs the run.py script.
-    task_details: A dictionary representing the task from tasks.json.
-    app_config: A dictionary with application configuration (e.g., path to Deep-Live-Cam).
+    Average run time in seconds per media kind ('image', 'video') over the most recent
+    completed tasks, falling back to DEFAULT_TASK_SECONDS. Batch tasks count as one
+    image sample per target.
     """
-    task_id = task_details['task_id']
-    print(f"[{datetime.now()}] Processing task: {task_id}")
+    samples = {'image': [], 'video': []}
+    completed = [t for t in tasks if t.status == 'completed' and t.completed_at]
+    completed.sort(key=lambda t: t.completed_at, reverse=True)
+    for task in completed:
+        seconds = _run_seconds(task)
+        if seconds is None or seconds < 0:
+            continue
+        if task.task_type == 'batch':
+            item_count = len(task.items or []) or 1
+            kind, seconds = 'image', seconds / item_count
+        else:
+            kind = 'video' if task.task_type == 'video' else 'image'
+        if len(samples[kind]) < DURATION_HISTORY_SIZE:
+            samples[kind].append(seconds)
+    return {kind: (sum(values) / len(values) if values else DEFAULT_TASK_SECONDS[kind])
+            for kind, values in samples.items()}
 
-    update_task(task_id, {"status": "processing", "started_at": datetime.now().isoformat()})
 
-    deep_live_cam_base_path = app_config.get("deep_live_cam_path")
-    if not deep_live_cam_base_path:
-        print(f"ERROR: deep_live_cam_path not configured for task {task_id}.")
-        update_task(task_id, {"status": "failed", "error_message": "Deep-Live-Cam path not configured."})
-        return
+def estimate_task_seconds(task, averages):
+    """Estimated run time of `task` in seconds, given average_task_durations() output."""
+    if task.task_type == 'batch':
+        remaining = [item for item in task.items or [] if item.get('status') != 'completed']
+        return averages['image'] * max(len(remaining), 1)
+    return averages['video'] if task.task_type == 'video' else averages['image']
 
-    run_py_script_path = os.path.join(deep_live_cam_base_path, "run.py")
 
-    # Determine python executable (venv or system)
-    # This logic can be enhanced, e.g. check if venv path is valid
-    venv_python_executable = os.path.join(deep_live_cam_base_path, "venv", "Scripts", "python.exe")
-    if not os.path.exists(venv_python_executable): # Fallback or error
-        print(f"WARNING: Venv python not found at {venv_python_executable} for task {task_id}. Trying system python.")
-        # Potentially try global 'python' or specific version, or error out
-        # For now, let's assume it must exist, or fail the task.
-        update_task(task_id, {"status": "failed", "error_message": f"Venv Python not found at {venv_python_executable}"})
-        return
+def finish_local_task(task_id, updates):
+    """
+    Writes a status change of a task the local worker claimed, but only while it is
+    still 'processing' under LOCAL_WORKER_ID (checked in the same transaction, like
+    render node results in worker_api.py): a cancel or delete that landed meanwhile
+    wins. Returns False if the update was refused.
+    """
+    if update_leased_task(task_id, LOCAL_WORKER_ID, updates):
+        return True
+    print(f"[{datetime.now()}] Task {task_id} was cancelled or removed meanwhile, its result is discarded.")
+    return False
+
+
+def _discard_outputs(file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+def resolve_renderer(task_id, app_config):
+    """
+    Resolves the Deep-Live-Cam install for a task from the renderer registry (validated
+    once, see renderers.py). Returns a RendererInstall, or None after marking the task as failed.
+    """
+    renderer, error = renderer_status(app_config.get("deep_live_cam_path"))
+    if error:
+        print(f"ERROR: No usable renderer for task {task_id}: {error}")
+        finish_local_task(task_id, {"status": "failed", "error_message": error, "completed_at": datetime.now().isoformat()})
+        return None
+    return renderer
 
-    # Ensure the output directory for this specific invite code exists
-    output_dir_for_task = os.path.join(BASE_OUTPUT_DIR, task_details['invite_code'])
-    os.makedirs(output_dir_for_task, exist_ok=True)
 
-    # Determine output filename and path
+def task_output_path(task):
+    """Final output path of a single image/video task."""
     # The task_type ('image' or 'video') should be reliable from when the task was created.
-    file_extension = '.mp4' if task_details.get('task_type') == 'video' else '.jpg'
-    output_filename = f"{task_details['invite_code']}{file_extension}" # Use invite_code as filename base
-    output_file_path_abs = os.path.join(output_dir_for_task, output_filename)
-
-    # The source_path and target_path in task_details are already absolute paths
-    cmd = [
-        venv_python_executable,
-        run_py_script_path,
-        '-s', task_details['source_path'], # This is absolute path
-        '-t', task_details['target_path'], # This is absolute path
-        '-o', output_file_path_abs
-    ]
-
-    options = task_details.get('options', {})
-    frame_processors = []
-    if options.get('frame_processor_face_swapper'):
-        frame_processors.append('face_swapper')
-    if options.get('frame_processor_face_enhancer'):
-        frame_processors.append('face_enhancer')
-    if frame_processors:
-        cmd.extend(['--frame-processor'] + frame_processors)
-
-    if options.get('keep_fps'): cmd.append('--keep-fps')
-    if options.get('keep_audio'): cmd.append('--keep-audio') # Only relevant for video
-    if options.get('keep_frames'): cmd.append('--keep-frames')
-    if options.get('many_faces'): cmd.append('--many-faces')
-    if options.get('map_faces'): cmd.append('--map-faces') # Not in provided list, but common
-    if options.get('mouth_mask'): cmd.append('--mouth-mask') # Not in provided list, but common
-
-    execution_providers = []
-    if options.get('execution_provider_cuda'):
-        execution_providers.append('cuda')
-    if options.get('execution_provider_cpu'): # Assuming CPU is a fallback or specific choice
-        execution_providers.append('cpu') # DeepFace usually defaults to CPU if CUDA not available/specified
-
-    if execution_providers:
-         cmd.extend(['--execution-provider'] + execution_providers)
-    else: # Default to CPU if nothing is selected by user, or let run.py decide
-        cmd.extend(['--execution-provider', 'cpu'])
-
-
-    print(f"Executing command: {' '.join(cmd)}")
-    print(f"[{datetime.now()}] Executing command for task {task_id}: {' '.join(cmd)}")
+    file_extension = '.mp4' if task.task_type == 'video' else '.jpg'
+    # Named after the task, so a retry or a second task of the same invite never overwrites another output
+    return os.path.join(BASE_OUTPUT_DIR, task.invite_code, f"{task.task_id}{file_extension}")
+
+
+def batch_output_dir(task):
+    # Batch outputs get their own folder so items never collide with single-task outputs
+    return os.path.join(BASE_OUTPUT_DIR, task.invite_code, f"batch_{task.task_id}")
+
+
+def batch_item_output_path(task, index):
+    return os.path.join(batch_output_dir(task), f"item_{index + 1:03d}.jpg")
+
+
+def _created_time(task):
+    created_time_str = task.created_at or datetime.min.isoformat()
     try:
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True, cwd=deep_live_cam_base_path, timeout=1800) # Timeout 30 mins
+        # Ensure created_at is a datetime object for proper comparison if needed,
+        # though ISO format strings generally sort correctly too.
+        return datetime.fromisoformat(created_time_str)
+    except ValueError:
+        return datetime.min # Fallback for malformed dates
+
+
+# --- Scheduling Policies ---
+# A policy is a sort key over queued tasks, the smallest key runs next. Keys get the
+# task, the current time (an aware datetime) and average_task_durations() output;
+# scheduler_sim.py replays workloads through the same functions.
+# "scheduling_policy" in config.json selects the live one.
+SCHEDULING_POLICIES = {}
+DEFAULT_SCHEDULING_POLICY = 'priority'
+PRIORITY_AGING_SECONDS = 60 # priority_aging: each minute waited is worth one priority point
+EDF_DEFAULT_DEADLINE_SECONDS = 24 * 3600 # edf: tasks without a deadline are due this long after submission
+
+
+def scheduling_policy(name):
+    """Registers the decorated sort key as scheduling policy `name`."""
+    def register(sort_key):
+        SCHEDULING_POLICIES[name] = sort_key
+        return sort_key
+    return register
+
+
+def _created_timestamp(task):
+    created = _created_time(task)
+    if created == datetime.min:
+        return 0.0
+    return (created if created.tzinfo else created.replace(tzinfo=timezone.utc)).timestamp()
+
+
+@scheduling_policy('priority')
+def queue_sort_key(task, now=None, averages=None):
+    """
+    Sort order of queued tasks:
+    1. By 'priority': Lower explicit priority number means higher importance.
+    2. By 'task_type': 'video' tasks come before 'image' tasks.
+    3. By 'created_at': Older tasks of the same type and explicit priority come first (FIFO).
+    """
+    task_type_priority = 0 if task.task_type == 'video' else 1
+    return (task.priority, task_type_priority, _created_timestamp(task))
+
+
+@scheduling_policy('fifo')
+def fifo_sort_key(task, now=None, averages=None):
+    """Strictly by arrival, priorities are ignored."""
+    return (_created_timestamp(task),)
+
+
+@scheduling_policy('shortest_first')
+def shortest_first_sort_key(task, now=None, averages=None):
+    """Shortest estimated run time first (see estimate_task_seconds), then by arrival."""
+    return (estimate_task_seconds(task, averages or DEFAULT_TASK_SECONDS), _created_timestamp(task))
+
+
+@scheduling_policy('priority_aging')
+def priority_aging_sort_key(task, now=None, averages=None):
+    """Like 'priority', but every PRIORITY_AGING_SECONDS of waiting lowers the priority number by one."""
+    waited = max((now.timestamp() - _created_timestamp(task)), 0.0) if now else 0.0
+    task_type_priority = 0 if task.task_type == 'video' else 1
+    return (task.priority - waited / PRIORITY_AGING_SECONDS, task_type_priority, _created_timestamp(task))
+
+
+@scheduling_policy('edf')
+def edf_sort_key(task, now=None, averages=None):
+    """
+    Earliest deadline first, by latest start time: the deadline minus the estimated
+    run time, so a long video due at noon goes ahead of an image due a minute later.
+    Tasks without a deadline are due EDF_DEFAULT_DEADLINE_SECONDS after submission,
+    which keeps them from starving behind a stream of SLA tasks.
+    """
+    created = _created_timestamp(task)
+    deadline = deadline_timestamp(task)
+    if deadline is None:
+        deadline = created + EDF_DEFAULT_DEADLINE_SECONDS
+    return (deadline - estimate_task_seconds(task, averages or DEFAULT_TASK_SECONDS), task.priority, created)
+
+
+def configured_policy(app_config=None):
+    """Name of the live scheduling policy, falling back to the default for unknown names."""
+    name = (app_config if app_config is not None else load_config()).get('scheduling_policy', DEFAULT_SCHEDULING_POLICY)
+    if name not in SCHEDULING_POLICIES:
+        print(f"WARNING: Unknown scheduling_policy {name!r}, using {DEFAULT_SCHEDULING_POLICY!r}.")
+        return DEFAULT_SCHEDULING_POLICY
+    return name
+
+
+def pick_next_task(queued_tasks, policy=None, now=None, averages=None):
+    """
+    Chooses the task to run next from the queued ones with scheduling policy `policy`
+    (default: the configured one). Used by the local worker, render nodes and the simulator.
+    """
+    if not queued_tasks:
+        return None
+    sort_key = SCHEDULING_POLICIES[policy or configured_policy()]
+    now = now or datetime.now(timezone.utc)
+    return min(queued_tasks, key=lambda task: sort_key(task, now, averages))
+
+
+def _elapsed_run_seconds(task):
+    try:
+        return max((datetime.now() - datetime.fromisoformat(task.started_at)).total_seconds(), 0.0)
+    except (TypeError, ValueError): # Not started, or an aware timestamp from elsewhere
+        return 0.0
+
+
+def project_finish_times(tasks, policy=None, averages=None, now=None):
+    """
+    Projected finish (unix time) of every unfinished task in `tasks`: running ones
+    finish once their estimated run time is up, waiting ones are handed in `policy`
+    order to the earliest free worker. Assumes as many workers as there are
+    running tasks right now (at least one). Returns {task_id: timestamp}.
+    """
+    now = now or datetime.now(timezone.utc)
+    averages = averages or average_task_durations(tasks)
+    waiting = [t for t in tasks if t.status in ('ingesting', 'queued')]
+
+    finish_times = {}
+    for task in tasks:
+        if task.status == 'processing':
+            remaining = max(estimate_task_seconds(task, averages) - _elapsed_run_seconds(task), 0.0)
+            finish_times[task.task_id] = now.timestamp() + remaining
+    workers = list(finish_times.values()) or [now.timestamp()] # When each worker is free next
+    heapq.heapify(workers)
+    sort_key = SCHEDULING_POLICIES[policy or configured_policy()]
+    for task in sorted(waiting, key=lambda t: sort_key(t, now, averages)):
+        finish = heapq.heappop(workers) + estimate_task_seconds(task, averages)
+        finish_times[task.task_id] = finish
+        heapq.heappush(workers, finish)
+    return finish_times
+
+
+def deadline_risks(tasks, policy=None, averages=None, now=None):
+    """
+    {task_id: 'overdue' | 'at_risk'} for unfinished tasks whose deadline has passed
+    or lies before their projected finish (see project_finish_times).
+    """
+    now = now or datetime.now(timezone.utc)
+    finish_times = project_finish_times(tasks, policy, averages, now)
+    risks = {}
+    for task in tasks:
+        deadline = deadline_timestamp(task)
+        if deadline is None or task.task_id not in finish_times:
+            continue
+        if deadline < now.timestamp():
+            risks[task.task_id] = 'overdue'
+        elif deadline < finish_times[task.task_id]:
+            risks[task.task_id] = 'at_risk'
+    return risks
+
+
+def _is_cancelled(task_id):
+    task = get_task_by_id(task_id) # Cached, cheap enough to ask on every poll
+    return task is None or task.status == 'cancelled' # Deleted counts as cancelled too
+
+
+def _publish_preview(task_id, sampler):
+    """Takes new preview frames of a rendering video and shows them, and the progress, on the task."""
+    if sampler.sample():
+        # Progress only: group-committed without waiting
+        update_task(task_id, {"preview_frames": sampler.preview_count,
+                              "progress": f"~{int(sampler.processed_fraction * 100)}% of frames swapped"}, wait=False)
+
+
+def process_task(task_details, app_config):
+    """
+    Processes a single task: activates venv and runs the run.py script.
+    task_details: The Task to process (see models.py).
+    app_config: A dictionary with application configuration (e.g., path to Deep-Live-Cam).
+    The render runs in the task's scratch workspace (see workspace.py); the output is
+    promoted to task_output_path() only once run.py has finished.
+    """
+    if task_details.task_type == 'batch':
+        return process_batch_task(task_details, app_config)
+
+    task_id = task_details.task_id
+    print(f"[{datetime.now()}] Processing task: {task_id}") # Already 'processing', set by claim_next_task
+
+    renderer = resolve_renderer(task_id, app_config)
+    if not renderer:
+        return
+
+    output_file_path_abs = task_output_path(task_details)
+    workspace = None
+    sampler = None
+    try:
+        workspace = TaskWorkspace.from_config(task_id, app_config)
+        # Deep-Live-Cam writes its frames next to the target, so the target goes into the workspace too
+        target_in_workspace = workspace.link_input(task_details.target_path, os.path.basename(task_details.target_path))
+        scratch_output = workspace.file('output' + os.path.splitext(output_file_path_abs)[1])
+        cmd = renderer.build_command(task_details.source_path, target_in_workspace, scratch_output, task_details.options)
+        if task_details.task_type == 'video':
+            sampler = PreviewSampler.for_target(task_id, target_in_workspace) # Previews from the frames being swapped
+
+        print(f"[{datetime.now()}] Executing command for task {task_id}: {' '.join(cmd)}")
+        process = run_monitored(cmd, renderer.base_path, workspace, RENDER_TIMEOUT_SECONDS,
+                                is_cancelled=lambda: _is_cancelled(task_id),
+                                on_poll=lambda elapsed, ws: _publish_preview(task_id, sampler) if sampler else None,
+                                on_event=lambda name: record_event(task_id, name))
+        if not os.path.isfile(scratch_output):
+            finish_local_task(task_id, {"status": "failed", "error_message": "Renderer exited without writing an output.",
+                                  "stdout": process.stdout, "stderr": process.stderr, "completed_at": datetime.now().isoformat()})
+            return
+        workspace.promote(scratch_output, output_file_path_abs)
+        if not finish_local_task(task_id, {"status": "completed", "output_path": output_file_path_abs, "completed_at": datetime.now().isoformat(), "stdout": process.stdout, "stderr": process.stderr}):
+            _discard_outputs([output_file_path_abs]) # Cancelled while the output was promoted
+            return
+        record_event(task_id, 'output_finalized')
         print(f"[{datetime.now()}] Task {task_id} completed successfully.")
-        # print(f"Output for {task_id}: {process.stdout}") # Can be very verbose
         if process.stderr:
              print(f"[{datetime.now()}] Stderr for {task_id}: {process.stderr}")
-        update_task(task_id, {"status": "completed", "output_path": output_file_path_abs, "completed_at": datetime.now().isoformat(), "stdout": process.stdout, "stderr": process.stderr})
     except subprocess.CalledProcessError as e:
         error_message = f"Return code: {e.returncode}"
         print(f"[{datetime.now()}] Error processing task {task_id}: {error_message}")
         print(f"Stdout for {task_id} (on error): {e.stdout}")
         print(f"Stderr for {task_id} (on error): {e.stderr}")
-        update_task(task_id, {"status": "failed", "error_message": error_message, "stdout": e.stdout, "stderr": e.stderr, "completed_at": datetime.now().isoformat()})
+        finish_local_task(task_id, {"status": "failed", "error_message": error_message, "stdout": e.stdout, "stderr": e.stderr, "completed_at": datetime.now().isoformat()})
     except subprocess.TimeoutExpired as e:
         error_message = "Processing timed out."
         print(f"[{datetime.now()}] Task {task_id} timed out.")
         print(f"Stdout for {task_id} (on timeout): {e.stdout}")
         print(f"Stderr for {task_id} (on timeout): {e.stderr}")
-        update_task(task_id, {"status": "failed", "error_message": error_message, "stdout": e.stdout if e.stdout else "", "stderr": e.stderr if e.stderr else "", "completed_at": datetime.now().isoformat()})
+        finish_local_task(task_id, {"status": "failed", "error_message": error_message, "stdout": e.stdout if e.stdout else "", "stderr": e.stderr if e.stderr else "", "completed_at": datetime.now().isoformat()})
+    except QuotaExceeded as e:
+        print(f"[{datetime.now()}] Task {task_id} stopped: {e}")
+        finish_local_task(task_id, {"status": "failed", "error_message": str(e), "completed_at": datetime.now().isoformat()})
+    except TaskCancelled:
+        print(f"[{datetime.now()}] Task {task_id} was cancelled, render stopped.") # Status already set by whoever cancelled
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}"
         print(f"[{datetime.now()}] Unexpected error processing task {task_id}: {error_message}")
-        update_task(task_id, {"status": "failed", "error_message": error_message, "completed_at": datetime.now().isoformat()})
+        finish_local_task(task_id, {"status": "failed", "error_message": error_message, "completed_at": datetime.now().isoformat()})
+    finally:
+        if workspace is not None:
+            workspace.cleanup() # Frames, partial outputs and logs, whatever the outcome
+        if sampler is not None:
+            remove_previews(task_id) # The output (or the error) takes their place
+            if sampler.preview_count or sampler.processed_fraction:
+                update_task(task_id, {"preview_frames": None, "progress": None}, wait=False)
+
+
+def process_batch_task(task_details, app_config):
+    """
+    Processes a batch task: one source image applied to every item in task_details.items.
+    The renderer is resolved once and the items run back to back in a tight loop, each with
+    its own status and output. Items that already completed (e.g. on a retry) are skipped.
+    All items share the task's workspace, which is emptied after each of them.
+    """
+    task_id = task_details.task_id
+    items = task_details.items or []
+    print(f"[{datetime.now()}] Processing batch task: {task_id} ({len(items)} targets)")
+
+    renderer = resolve_renderer(task_id, app_config)
+    if not renderer:
+        return
+
+    options = task_details.options
+    promoted = [] # Outputs written by this run, discarded if the task was cancelled meanwhile
+    try:
+        workspace = TaskWorkspace.from_config(task_id, app_config)
+    except OSError as e:
+        finish_local_task(task_id, {"status": "failed", "error_message": f"Could not create scratch workspace: {e}",
+                                    "completed_at": datetime.now().isoformat()})
+        return
+
+    with workspace:
+        for index, item in enumerate(items):
+            if item.get('status') == 'completed':
+                continue
+            output_file_path_abs = batch_item_output_path(task_details, index)
+            item['status'] = 'processing'
+            # Progress only: group-committed without waiting. Copies, the queued update must not change under us
+            update_task(task_id, {"items": [dict(i) for i in items]}, wait=False)
+            try:
+                workspace.clear()
+                target_in_workspace = workspace.link_input(item['target_path'], f"target_{index + 1:03d}_{os.path.basename(item['target_path'])}")
+                scratch_output = workspace.file(os.path.basename(output_file_path_abs))
+                cmd = renderer.build_command(task_details.source_path, target_in_workspace, scratch_output, options)
+                run_monitored(cmd, renderer.base_path, workspace, RENDER_TIMEOUT_SECONDS,
+                              is_cancelled=lambda: _is_cancelled(task_id),
+                              on_event=lambda name: record_event(task_id, name, item=index + 1))
+                workspace.promote(scratch_output, output_file_path_abs)
+                promoted.append(output_file_path_abs)
+                record_event(task_id, 'output_finalized', item=index + 1)
+                item.update({"status": "completed", "output_path": output_file_path_abs, "error_message": None})
+            except subprocess.CalledProcessError as e:
+                print(f"[{datetime.now()}] Batch task {task_id} item {index + 1} failed. Stderr: {e.stderr}")
+                item.update({"status": "failed", "error_message": f"Return code: {e.returncode}"})
+            except subprocess.TimeoutExpired:
+                print(f"[{datetime.now()}] Batch task {task_id} item {index + 1} timed out.")
+                item.update({"status": "failed", "error_message": "Processing timed out."})
+            except QuotaExceeded as e:
+                print(f"[{datetime.now()}] Batch task {task_id} item {index + 1} stopped: {e}")
+                item.update({"status": "failed", "error_message": str(e)})
+            except TaskCancelled:
+                print(f"[{datetime.now()}] Batch task {task_id} was cancelled, render stopped.")
+                return
+            except Exception as e:
+                print(f"[{datetime.now()}] Unexpected error in batch task {task_id} item {index + 1}: {e}")
+                item.update({"status": "failed", "error_message": f"An unexpected error occurred: {str(e)}"})
+            update_task(task_id, {"items": [dict(i) for i in items]}, wait=False)
+
+    updates = batch_final_updates(task_details, items)
+    if not finish_local_task(task_id, updates):
+        _discard_outputs(promoted)
+        return
+    completed_count = sum(1 for item in items if item.get('status') == 'completed')
+    print(f"[{datetime.now()}] Batch task {task_id} finished: {completed_count}/{len(items)} targets completed.")
+
+
+def batch_final_updates(task, items):
+    """The task updates that close a batch once every item has run (locally or on a render node)."""
+    failed_count = sum(1 for item in items if item.get('status') != 'completed')
+    updates = {"completed_at": datetime.now().isoformat(), "items": items, "lease_expires_at": None, "progress": None}
+    if failed_count == len(items):
+        updates.update({"status": "failed", "error_message": "All targets in the batch failed."})
+    else:
+        # Partial success still counts as completed; the failed items carry their own errors.
+        updates.update({"status": "completed", "output_path": batch_output_dir(task),
+                        "error_message": f"{failed_count} of {len(items)} targets failed." if failed_count else None})
+    return updates
 
 
 def queue_worker():
@@ -123,40 +456,37 @@ def queue_worker():
     """
     print(f"[{datetime.now()}] Queue worker started.")
     app_config = load_config() # Load main app configuration
+    sweep_workspaces(app_config.get('scratch_dir')) # Nothing runs yet, anything left over is from a crash
+    sweep_previews()
 
     while True:
-        all_tasks = load_tasks()
-        queued_tasks = [task for task in all_tasks if task.get('status') == 'queued']
+        # Re-read every round so config changes apply without a restart (cached, see file_helpers._CachedFile)
+        new_config = load_config()
+        if new_config.get('deep_live_cam_path') != app_config.get('deep_live_cam_path'):
+            print(f"[{datetime.now()}] Deep-Live-Cam path changed to {new_config.get('deep_live_cam_path')}")
+            renderer_status(new_config.get('deep_live_cam_path'), refresh=True)
+        app_config = new_config
 
-        if not queued_tasks:
+        tasks = load_tasks()
+        if not any(task.status == 'queued' for task in tasks):
             time.sleep(10) # Wait longer if no tasks
             continue
 
-        # Sort tasks:
-        # 1. By 'task_type': 'video' tasks come before 'image' tasks.
-        #    (Achieved by assigning lower sort key to 'video')
-        # 2. By 'priority': Lower explicit priority number means higher importance.
-        # 3. By 'created_at': Older tasks of the same type and explicit priority come first (FIFO).
-        def sort_key(task):
-            task_type_priority = 0 if task.get('task_type') == 'video' else 1
-            explicit_priority = task.get('priority', 99) # Default if not set
-            created_time_str = task.get('created_at', datetime.min.isoformat())
-            try:
-                # Ensure created_at is a datetime object for proper comparison if needed,
-                # though ISO format strings generally sort correctly too.
-                # For simplicity, string comparison of ISO dates is usually fine.
-                created_time = datetime.fromisoformat(created_time_str)
-            except ValueError:
-                created_time = datetime.min # Fallback for malformed dates
-
-            # New sort order: Explicit Priority, then Task Type, then Creation Time
-            return (explicit_priority, task_type_priority, created_time)
-
-        queued_tasks.sort(key=sort_key)
+        # Without a usable install don't claim anything: the tasks would only fail. They stay
+        # queued for render nodes, or until the install is fixed (rechecked, see renderers.py)
+        _, renderer_error = renderer_status(app_config.get('deep_live_cam_path'))
+        if renderer_error:
+            time.sleep(10)
+            continue
 
-        task_to_process = queued_tasks[0] # Get the highest priority task
+        # Claimed atomically, render nodes pulling over the worker API can't take the same task
+        averages = average_task_durations(tasks)
+        policy = configured_policy(app_config)
+        task_to_process = claim_next_task(LOCAL_WORKER_ID, lambda queued: pick_next_task(queued, policy, averages=averages))
+        if task_to_process is None:
+            continue # Taken by a render node meanwhile
 
-        print(f"[{datetime.now()}] Selected task to process: {task_to_process['task_id']} (Priority: {task_to_process.get('priority')}, Type: {task_to_process.get('task_type')})")
+        print(f"[{datetime.now()}] Selected task to process: {task_to_process.task_id} (Priority: {task_to_process.priority}, Type: {task_to_process.task_type})")
         process_task(task_to_process, app_config)
 
         time.sleep(2) # Small delay before checking queue again
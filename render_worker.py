@@ -0,0 +1,291 @@
+"""
+Standalone render node.
+
+Pulls tasks from the web node over the worker API (worker_api.py), renders them
+with a local Deep-Live-Cam install using the same renderer registry and command
+builder as the in-process worker (renderers.py) and sends the outputs back:
+
+    python render_worker.py --server http://web-node:5000 --token SECRET --deep-live-cam /opt/Deep-Live-Cam
+
+The token is the one configured for this node under "worker_tokens" in the web
+node's config.json (it can also be given as RENDER_WORKER_TOKEN). Any number of
+nodes can run at once, on one machine or many; a task is only ever leased to one.
+Set "run_local_worker": false on the web node to leave all rendering to the nodes.
+
+Only the standard library is needed. With --stub-renderer no Deep-Live-Cam is
+needed either: this script then runs itself in place of run.py, and when invoked
+with run.py's arguments (-s SOURCE -t TARGET -o OUTPUT ...) it copies the target
+to the output after --stub-seconds. That exercises the whole protocol, e.g. with
+several local nodes against a development server.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from renderers import RendererInstall, get_renderer, RendererError
+from workspace import TaskWorkspace, QuotaExceeded, run_monitored, DEFAULT_SCRATCH_QUOTA_MB
+
+RENDER_TIMEOUT_SECONDS = 1800 # Same limit as the in-process worker
+HTTP_TIMEOUT_SECONDS = 60
+COPY_CHUNK_SIZE = 1024 * 1024
+LOG_TAIL_BYTES = 64 * 1024 # stdout/stderr sent back per task, like the web node keeps them
+
+
+class LeaseLost(Exception):
+    """The web node no longer has the task leased to us (expired, deleted or retried)."""
+
+
+class WorkerClient:
+    """Thin client for the worker API."""
+
+    def __init__(self, server, token):
+        self.server = server.rstrip('/') + '/'
+        self.token = token
+        self.pending_events = [] # Render timeline, sent along with the next progress/complete/fail
+
+    def note_event(self, event, item=None):
+        self.pending_events.append((event, time.monotonic(), item))
+
+    def _take_events(self):
+        now = time.monotonic()
+        events = [{"event": event, "age": round(now - at, 3), "item": item} for event, at, item in self.pending_events]
+        self.pending_events = []
+        return events
+
+    def _open(self, method, path, body=None, headers=None):
+        url = urllib.parse.urljoin(self.server, path.lstrip('/'))
+        request = urllib.request.Request(url, data=body, method=method, headers=dict(headers or {}))
+        request.add_header('Authorization', f'Bearer {self.token}')
+        try:
+            return urllib.request.urlopen(request, timeout=HTTP_TIMEOUT_SECONDS)
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise LeaseLost(path) from None
+            raise
+
+    def _json(self, method, path, payload=None):
+        body = json.dumps(payload or {}).encode('utf-8')
+        with self._open(method, path, body, {'Content-Type': 'application/json'}) as response:
+            data = response.read()
+            return json.loads(data) if data else None
+
+    def claim(self, task_types=None):
+        return self._json('POST', '/api/worker/claim', {"task_types": task_types} if task_types else {})
+
+    def download(self, url, dest_path):
+        with self._open('GET', url) as response, open(dest_path, 'wb') as f:
+            shutil.copyfileobj(response, f, COPY_CHUNK_SIZE)
+
+    def upload_output(self, task_id, file_path, item=None):
+        path = f'/api/worker/tasks/{task_id}/output' + (f'?item={item}' if item else '')
+        with open(file_path, 'rb') as f: # urllib streams file bodies, the output is never read into memory
+            headers = {'Content-Type': 'application/octet-stream', 'Content-Length': str(os.path.getsize(file_path))}
+            with self._open('PUT', path, f, headers) as response:
+                response.read()
+
+    def progress(self, task_id, progress=None, items=None):
+        return self._json('POST', f'/api/worker/tasks/{task_id}/progress',
+                          {"progress": progress, "items": items, "events": self._take_events()})
+
+    def complete(self, task_id, stdout='', stderr='', items=None):
+        return self._json('POST', f'/api/worker/tasks/{task_id}/complete',
+                          {"stdout": stdout, "stderr": stderr, "items": items, "events": self._take_events()})
+
+    def fail(self, task_id, error_message, stdout='', stderr=''):
+        return self._json('POST', f'/api/worker/tasks/{task_id}/fail',
+                          {"error_message": error_message, "stdout": stdout, "stderr": stderr, "events": self._take_events()})
+
+
+def _log(message):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def _safe_name(filename):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(filename or '')) or 'file'
+
+
+def _tail(file_path, limit=LOG_TAIL_BYTES):
+    try:
+        with open(file_path, 'rb') as f:
+            f.seek(max(os.path.getsize(file_path) - limit, 0))
+            return f.read().decode('utf-8', errors='replace')
+    except OSError:
+        return ''
+
+
+def _last_line(text):
+    lines = [line.strip() for line in re.split(r'[\r\n]+', text) if line.strip()]
+    return lines[-1] if lines else None
+
+
+class Renderer:
+    """Runs one render with the install's command line in the task's workspace, renewing the lease while it runs."""
+
+    def __init__(self, args):
+        if args.stub_renderer:
+            script = os.path.abspath(__file__)
+            self.install = RendererInstall(os.path.dirname(script), sys.executable, script)
+        else:
+            try: # Validated once, before any task is claimed
+                self.install = get_renderer(os.path.abspath(args.deep_live_cam), args.python)
+            except RendererError as e:
+                sys.exit(f"Deep-Live-Cam install not usable: {e}")
+
+    def run(self, client, task_id, workspace, source, target, output, options, heartbeat, items=None, item=None):
+        """
+        Returns (error_message, stdout, stderr), error_message None on success.
+        Raises LeaseLost (the render is stopped first) when the web node took the task back.
+        """
+        cmd = self.install.build_command(source, target, output, options)
+        last_beat = [time.monotonic()]
+
+        def renew_lease(elapsed, workspace):
+            if time.monotonic() - last_beat[0] >= heartbeat:
+                last_beat[0] = time.monotonic()
+                status_line = _last_line(_tail(workspace.file('stderr.log'), 4096)) or \
+                    _last_line(_tail(workspace.file('stdout.log'), 4096))
+                client.progress(task_id, f"{int(elapsed)}s: {status_line or 'rendering'}", items) # Renews the lease
+
+        try:
+            process = run_monitored(cmd, self.install.base_path, workspace, RENDER_TIMEOUT_SECONDS, on_poll=renew_lease,
+                                    on_event=lambda name: client.note_event(name, item))
+        except subprocess.CalledProcessError as e:
+            return f"Return code: {e.returncode}", e.stdout, e.stderr
+        except subprocess.TimeoutExpired as e:
+            return "Processing timed out.", e.output or '', e.stderr or ''
+        except QuotaExceeded as e:
+            return str(e), '', ''
+        if not os.path.isfile(output):
+            return "Renderer exited without writing an output.", process.stdout, process.stderr
+        return None, process.stdout, process.stderr
+
+
+def process_claimed_task(client, renderer, task, args):
+    task_id = task['task_id']
+    heartbeat = max(task.get('lease_seconds', 120) / 3.0, 1.0)
+    # Inputs, Deep-Live-Cam's frames and the output all stay inside the task's workspace
+    workspace = TaskWorkspace(task_id, args.work_dir, args.scratch_quota_mb)
+    client.pending_events = [] # Leftovers of a task we dropped
+    _log(f"Claimed task {task_id} ({task.get('task_type')})")
+    try:
+        source = workspace.file('source_' + _safe_name(task['source']['filename']))
+        client.download(task['source']['url'], source)
+
+        if task.get('task_type') == 'batch':
+            items = [{"status": item.get('status')} for item in task['items']]
+            for position, item in enumerate(task['items']):
+                if item.get('status') == 'completed':
+                    continue # Done on an earlier attempt
+                items[position] = {"status": "processing"}
+                target = workspace.file(f"target_{item['index']:03d}_" + _safe_name(item['target']['filename']))
+                output = workspace.file(_safe_name(item['output_filename']))
+                client.download(item['target']['url'], target)
+                error, _, stderr = renderer.run(client, task_id, workspace, source, target, output,
+                                                task.get('options') or {}, heartbeat, items, item['index'])
+                if error is None:
+                    client.upload_output(task_id, output, item['index'])
+                    items[position] = {"status": "completed"}
+                else:
+                    items[position] = {"status": "failed", "error_message": error}
+                    _log(f"Task {task_id} item {item['index']} failed: {error} {_last_line(stderr) or ''}")
+                for leftover in (target, output): # Keep the workspace to one item's worth of data
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+                shutil.rmtree(workspace.file('temp'), ignore_errors=True)
+                client.progress(task_id, f"{position + 1}/{len(items)} targets done", items)
+            result = client.complete(task_id, items=items)
+        else:
+            target = workspace.file('target_' + _safe_name(task['target']['filename']))
+            output = workspace.file(_safe_name(task['output_filename']))
+            client.download(task['target']['url'], target)
+            error, stdout, stderr = renderer.run(client, task_id, workspace, source, target, output,
+                                                 task.get('options') or {}, heartbeat)
+            if error is not None:
+                result = client.fail(task_id, error, stdout[-LOG_TAIL_BYTES:], stderr[-LOG_TAIL_BYTES:])
+            else:
+                client.upload_output(task_id, output)
+                result = client.complete(task_id, stdout[-LOG_TAIL_BYTES:], stderr[-LOG_TAIL_BYTES:])
+        _log(f"Task {task_id}: {result.get('status') if result else 'done'}")
+    except LeaseLost:
+        _log(f"Lost the lease on task {task_id} (expired or cancelled), dropping it.")
+    except (urllib.error.URLError, OSError) as e:
+        _log(f"Task {task_id} aborted: {e}") # The lease runs out and the web node requeues the task
+    finally:
+        workspace.cleanup()
+
+
+def worker_loop(args):
+    client = WorkerClient(args.server, args.token)
+    renderer = Renderer(args)
+    task_types = [t.strip() for t in args.task_types.split(',') if t.strip()] if args.task_types else None
+    _log(f"Render node polling {args.server}")
+    while True:
+        try:
+            task = client.claim(task_types)
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                sys.exit("The web node rejected the worker token.")
+            _log(f"Claim failed: HTTP {e.code}")
+            task = None
+        except (urllib.error.URLError, OSError) as e:
+            _log(f"Web node unreachable: {e}")
+            task = None
+        if task:
+            process_claimed_task(client, renderer, task, args)
+            continue
+        if args.once:
+            return
+        time.sleep(args.poll_interval)
+
+
+def stub_render(argv):
+    """Stands in for Deep-Live-Cam's run.py, see the module docstring."""
+    parser = argparse.ArgumentParser(prog='stub run.py')
+    parser.add_argument('-s', required=True)
+    parser.add_argument('-t', required=True)
+    parser.add_argument('-o', required=True)
+    known, _ = parser.parse_known_args(argv) # Ignore the frame processor / execution provider flags
+    time.sleep(float(os.environ.get('STUB_RENDER_SECONDS', '0')))
+    shutil.copyfile(known.t, known.o)
+    print(f"stub render: {known.t} -> {known.o}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['-s']: # build_command() always starts with -s, we're standing in for run.py
+        return stub_render(argv)
+
+    parser = argparse.ArgumentParser(description="Render node for the face swap site.")
+    parser.add_argument('--server', required=True, help="Base URL of the web node, e.g. http://10.0.0.5:5000")
+    parser.add_argument('--token', default=os.environ.get('RENDER_WORKER_TOKEN'), help="Worker token (or RENDER_WORKER_TOKEN)")
+    parser.add_argument('--deep-live-cam', help="Path of the local Deep-Live-Cam install")
+    parser.add_argument('--python', help="Interpreter to run run.py with (default: the install's venv)")
+    parser.add_argument('--task-types', help="Only claim these task types, comma separated (image,video,batch)")
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'render_worker'),
+                        help="Scratch directory for task workspaces (a tmpfs path works well)")
+    parser.add_argument('--scratch-quota-mb', type=float, default=DEFAULT_SCRATCH_QUOTA_MB,
+                        help="Disk space one task may use in its workspace, 0 for no limit")
+    parser.add_argument('--poll-interval', type=float, default=5.0, help="Seconds between claims when the queue is empty")
+    parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+    parser.add_argument('--stub-renderer', action='store_true', help="Copy target to output instead of running Deep-Live-Cam")
+    parser.add_argument('--stub-seconds', type=float, default=0.0, help="How long a stub render takes")
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("--token or RENDER_WORKER_TOKEN is required")
+    if not args.stub_renderer and not args.deep_live_cam:
+        parser.error("--deep-live-cam is required unless --stub-renderer is given")
+    os.environ['STUB_RENDER_SECONDS'] = str(args.stub_seconds) # Inherited by the stub render processes
+    worker_loop(args)
+
+
+if __name__ == '__main__':
+    main()
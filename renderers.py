@@ -0,0 +1,256 @@
+"""
+Deep-Live-Cam command line helpers and the renderer registry.
+
+Kept free of any app or data-file imports, so the standalone render worker
+(render_worker.py) can use exactly the same command builder as the local queue
+worker without pulling in the web node's store.
+
+get_renderer() validates a Deep-Live-Cam install once (folder, run.py, a venv
+interpreter that actually starts) and caches the result per install: the
+interpreter path, the run.py flags declared in the install's source and the
+option map compiled for them. Tasks then only build their command line from
+the cached RendererInstall. The web node checks its install at startup, when
+deep_live_cam_path changes and from /health/renderer; a broken install is
+looked at again after FAILED_RECHECK_SECONDS, so fixing it needs no restart.
+Request handlers ask with wait=False and never start the interpreter
+themselves: a due check runs in a background thread and they get the last
+known result meanwhile.
+"""
+import os
+import re
+import subprocess
+import time
+from threading import Lock, Thread
+
+# Task option -> run.py flag, and the value it adds (None: an on/off switch). Options
+# sharing a flag are collected into one argument, in this order, e.g.
+# --frame-processor face_swapper face_enhancer
+OPTION_FLAGS = (
+    ('frame_processor_face_swapper', '--frame-processor', 'face_swapper'),
+    ('frame_processor_face_enhancer', '--frame-processor', 'face_enhancer'),
+    ('keep_fps', '--keep-fps', None),
+    ('keep_audio', '--keep-audio', None), # Only relevant for video
+    ('keep_frames', '--keep-frames', None),
+    ('many_faces', '--many-faces', None),
+    ('map_faces', '--map-faces', None),
+    ('mouth_mask', '--mouth-mask', None),
+    ('execution_provider_cuda', '--execution-provider', 'cuda'),
+    ('execution_provider_cpu', '--execution-provider', 'cpu'),
+)
+DEFAULT_FLAG_VALUES = {'--execution-provider': ['cpu']} # Used when no option picks a value, rather than letting run.py decide
+
+# Where Deep-Live-Cam declares its argparse options
+FLAG_SOURCE_FILES = ('run.py', os.path.join('modules', 'core.py'))
+_ADD_ARGUMENT_RE = re.compile(r"add_argument\(([^)]*)")
+_FLAG_RE = re.compile(r"""['"](--[a-z0-9][a-z0-9-]*)['"]""")
+
+PROBE_TIMEOUT_SECONDS = 15
+FAILED_RECHECK_SECONDS = 30
+
+
+class RendererError(Exception):
+    """A Deep-Live-Cam install that can't be used; the message says why."""
+
+
+def venv_python_for(deep_live_cam_base_path):
+    """Path of the Deep-Live-Cam venv interpreter, Windows or POSIX layout, or None if there is none."""
+    for candidate in (os.path.join(deep_live_cam_base_path, "venv", "Scripts", "python.exe"),
+                      os.path.join(deep_live_cam_base_path, "venv", "bin", "python")):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def compile_option_map(supported_flags=None):
+    """
+    OPTION_FLAGS grouped by flag, in order: ((flag, ((option, value), ...)), ...).
+    Flags missing from `supported_flags` are left out; None keeps them all.
+    """
+    groups = {}
+    for option, flag, value in OPTION_FLAGS:
+        if supported_flags is None or flag in supported_flags:
+            groups.setdefault(flag, []).append((option, value))
+    return tuple((flag, tuple(entries)) for flag, entries in groups.items())
+
+
+_ALL_FLAGS = compile_option_map()
+
+
+def _option_arguments(option_map, options):
+    arguments = []
+    for flag, entries in option_map:
+        chosen = [value for option, value in entries if options.get(option)]
+        if entries[0][1] is None: # On/off switch
+            if chosen:
+                arguments.append(flag)
+            continue
+        chosen = chosen or DEFAULT_FLAG_VALUES.get(flag)
+        if chosen:
+            arguments.append(flag)
+            arguments.extend(chosen)
+    return arguments
+
+
+def _base_command(python, run_py, source_path, target_path, output_path):
+    return [python, run_py, '-s', source_path, '-t', target_path, '-o', output_path] # Absolute paths
+
+
+def build_command(venv_python_executable, run_py_script_path, source_path, target_path, output_path, options):
+    """Builds the run.py command line for one source/target pair, passing every known flag."""
+    return _base_command(venv_python_executable, run_py_script_path, source_path, target_path, output_path) + \
+        _option_arguments(_ALL_FLAGS, options or {})
+
+
+def scan_supported_flags(deep_live_cam_base_path):
+    """
+    The run.py flags declared in the install's source (FLAG_SOURCE_FILES), or None
+    if none were found, e.g. for an unusual layout; then every flag is passed.
+    """
+    flags = set()
+    for name in FLAG_SOURCE_FILES:
+        try:
+            with open(os.path.join(deep_live_cam_base_path, name), 'r', encoding='utf-8', errors='replace') as f:
+                source = f.read()
+        except OSError:
+            continue
+        for arguments in _ADD_ARGUMENT_RE.findall(source):
+            flags.update(_FLAG_RE.findall(arguments))
+    return flags or None
+
+
+class RendererInstall:
+    """A validated Deep-Live-Cam install, see inspect_renderer()."""
+
+    def __init__(self, base_path, python, run_py, supported_flags=None, python_version=None):
+        self.base_path = base_path
+        self.python = python
+        self.run_py = run_py
+        self.supported_flags = supported_flags
+        self.python_version = python_version
+        self.option_map = compile_option_map(supported_flags)
+        # Options the install can't take, they are dropped from its commands
+        self.unsupported_options = [option for option, flag, _ in OPTION_FLAGS
+                                    if supported_flags is not None and flag not in supported_flags]
+        self.checked_at = time.time()
+
+    def build_command(self, source_path, target_path, output_path, options):
+        """The run.py command line for one source/target pair."""
+        return _base_command(self.python, self.run_py, source_path, target_path, output_path) + \
+            _option_arguments(self.option_map, options or {})
+
+    def describe(self):
+        return {
+            "deep_live_cam_path": self.base_path,
+            "python": self.python,
+            "python_version": self.python_version,
+            "supported_flags": sorted(self.supported_flags) if self.supported_flags is not None else None,
+            "unsupported_options": self.unsupported_options,
+            "checked_at": self.checked_at,
+        }
+
+
+def inspect_renderer(deep_live_cam_base_path, python=None):
+    """
+    Validates the install at `deep_live_cam_base_path` (with interpreter `python`,
+    default: its venv) and returns a RendererInstall. Raises RendererError.
+    """
+    if not deep_live_cam_base_path:
+        raise RendererError("Deep-Live-Cam path not configured.")
+    if not os.path.isdir(deep_live_cam_base_path):
+        raise RendererError(f"Deep-Live-Cam folder not found at {deep_live_cam_base_path}")
+    run_py = os.path.join(deep_live_cam_base_path, "run.py")
+    if not os.path.isfile(run_py):
+        raise RendererError(f"run.py not found at {run_py}")
+    python = python or venv_python_for(deep_live_cam_base_path)
+    if not python:
+        raise RendererError(f"Venv Python not found under {deep_live_cam_base_path} "
+                            f"(looked for venv/Scripts/python.exe and venv/bin/python)")
+    try:
+        probe = subprocess.run([python, '--version'], capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise RendererError(f"Venv Python at {python} does not start: {e}")
+    if probe.returncode != 0:
+        raise RendererError(f"Venv Python at {python} exited with code {probe.returncode}: {probe.stderr.strip()[:200]}")
+    version = (probe.stdout.strip() or probe.stderr.strip()) or None
+    return RendererInstall(deep_live_cam_base_path, python, run_py, scan_supported_flags(deep_live_cam_base_path), version)
+
+
+# (base path, python) -> (RendererInstall or None, error message or None, checked at)
+_renderers = {}
+_probe_locks = {} # (base path, python) -> Lock held while that install is probed
+_background_checks = set() # Installs a background thread is checking
+_renderers_lock = Lock() # Guards the three above, never held during a probe
+
+
+def _check_due(cached, refresh):
+    return cached is None or refresh or (cached[1] is not None and time.time() - cached[2] >= FAILED_RECHECK_SECONDS)
+
+
+def _check_renderer(key, refresh):
+    """Probes the install `key`, one thread per install at a time, and returns its new cache entry."""
+    requested_at = time.time()
+    with _renderers_lock:
+        probe_lock = _probe_locks.setdefault(key, Lock())
+    with probe_lock:
+        with _renderers_lock:
+            cached = _renderers.get(key)
+        if cached is not None and (cached[2] >= requested_at or not _check_due(cached, refresh)):
+            return cached # Another thread checked it while we waited
+        try:
+            install, error = inspect_renderer(*key), None
+        except RendererError as e:
+            install, error = None, str(e)
+        if cached is None or refresh or error != cached[1]: # Log changes, not every recheck
+            if error:
+                print(f"Renderer check failed: {error}")
+            else:
+                print(f"Renderer ready: {install.python} ({install.python_version}), run.py at {install.run_py}")
+                if install.unsupported_options:
+                    print(f"WARNING: This Deep-Live-Cam install doesn't take the options {', '.join(install.unsupported_options)}, they are ignored.")
+        checked = (install, error, time.time())
+        with _renderers_lock:
+            _renderers[key] = checked
+    return checked
+
+
+def _check_in_background(key, refresh):
+    with _renderers_lock:
+        if key in _background_checks:
+            return
+        _background_checks.add(key)
+
+    def check():
+        try:
+            _check_renderer(key, refresh)
+        finally:
+            with _renderers_lock:
+                _background_checks.discard(key)
+
+    Thread(target=check, daemon=True).start()
+
+
+def renderer_status(deep_live_cam_base_path, python=None, refresh=False, wait=True):
+    """
+    (RendererInstall, None) for a usable install, (None, error message) otherwise.
+    Results are cached per install: a usable one is not checked again unless
+    `refresh` is given, a broken one once FAILED_RECHECK_SECONDS have passed.
+    With wait=False a due check runs in a background thread and the last known
+    result is returned, (None, None) if the install hasn't been checked yet.
+    """
+    key = (deep_live_cam_base_path, python)
+    with _renderers_lock:
+        cached = _renderers.get(key)
+    if _check_due(cached, refresh):
+        if wait:
+            cached = _check_renderer(key, refresh)
+        else:
+            _check_in_background(key, refresh)
+    return (cached[0], cached[1]) if cached else (None, None)
+
+
+def get_renderer(deep_live_cam_base_path, python=None, refresh=False):
+    """The cached RendererInstall for an install (see renderer_status). Raises RendererError."""
+    install, error = renderer_status(deep_live_cam_base_path, python, refresh)
+    if error:
+        raise RendererError(error)
+    return install
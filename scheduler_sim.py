@@ -0,0 +1,315 @@
+"""
+Offline scheduler simulator.
+
+Replays a workload through the scheduling policies in queue_manager.py
+(SCHEDULING_POLICIES, the same functions the workers use) at a given number of
+workers and reports, per task class, wait-time percentiles, throughput and
+worker utilization. Nothing is rendered and the store is only read.
+
+Workloads:
+
+- history (default): the tasks in data/tasks.json (or --tasks-file). Arrival is
+  when a task was queued, its run time the observed started_at -> completed_at;
+  tasks that never ran get estimate_task_seconds().
+- synthetic: Poisson arrivals at --rate per hour and class over --hours, run
+  times drawn from exponential distributions around --mean-seconds (default:
+  the averages learned from the history). --sla gives every task of a class a
+  deadline that many seconds after its arrival, for the 'edf' policy.
+
+History tasks keep their deadline (see deadlines.py). When any task has one the
+report adds how many deadlines were missed.
+
+Examples:
+
+    python scheduler_sim.py --workers 1 2 3
+    python scheduler_sim.py --policy all --priority video=20,image=10
+    python scheduler_sim.py --synthetic --hours 8 --rate video=4,image=60,batch=2 --workers 2 --policy priority fifo
+    python scheduler_sim.py --synthetic --sla video=3600,image=900 --policy priority edf
+
+--priority overrides the per-class priorities render_page assigns
+(DEFAULT_TASK_PRIORITIES), which is how a priority change is tried out.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+from datetime import datetime, timezone
+
+from models import Task, loads, document_records
+from deadlines import deadline_timestamp
+from queue_manager import (DEFAULT_TASK_PRIORITIES, DEFAULT_TASK_SECONDS, DEFAULT_SCHEDULING_POLICY, SCHEDULING_POLICIES,
+                           average_task_durations, estimate_task_seconds, pick_next_task, _run_seconds)
+
+TASKS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tasks.json')
+TASK_CLASSES = ('video', 'image', 'batch')
+MAX_SYNTHETIC_BATCH_SIZE = 10
+SYNTHETIC_START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class SimJob:
+    """One task in the simulation. `task` is what the policy sees."""
+    __slots__ = ('task', 'task_class', 'arrival', 'duration', 'start', 'end')
+
+    def __init__(self, task, task_class, arrival, duration):
+        self.task = task
+        self.task_class = task_class
+        self.arrival = arrival # Unix time
+        self.duration = duration
+        self.start = None
+        self.end = None
+
+
+def _timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _sim_task(task_id, task_class, priority, arrival, item_count=0, deadline=None):
+    task = Task(task_id, task_type=task_class, status='queued', priority=priority,
+                created_at=datetime.fromtimestamp(arrival, timezone.utc).isoformat(),
+                deadline=datetime.fromtimestamp(deadline, timezone.utc).isoformat() if deadline is not None else None)
+    if task_class == 'batch':
+        task.items = [{"status": "queued"} for _ in range(max(item_count, 1))]
+    return task
+
+
+def load_tasks_file(file_path=TASKS_FILE):
+    """Tasks from a tasks.json (any schema version), read without touching the live store's locks."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [Task.from_dict(record) for record in document_records(loads(f.read()), 'tasks')]
+
+
+def _parse_class_values(text, value_type=float):
+    """'video=10,image=20' -> {'video': 10.0, 'image': 20.0}"""
+    values = {}
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        if name.strip() not in TASK_CLASSES:
+            raise argparse.ArgumentTypeError(f"Unknown task class {name.strip()!r}, expected one of {', '.join(TASK_CLASSES)}")
+        values[name.strip()] = value_type(value)
+    return values
+
+
+def history_workload(tasks, priorities=None, since=None):
+    """
+    SimJobs for every task in `tasks` that reached the queue (optionally only those
+    queued at or after unix time `since`). `priorities` overrides per class.
+    """
+    priorities = priorities or {}
+    averages = average_task_durations(tasks)
+    jobs = []
+    for task in tasks:
+        arrival = _timestamp(task.queued_at) or _timestamp(task.created_at)
+        if arrival is None or (since is not None and arrival < since):
+            continue
+        if not task.queued_at and not task.started_at:
+            continue # Never made it into the queue (e.g. failed its ingest)
+        task_class = task.task_type if task.task_type in TASK_CLASSES else 'image'
+        duration = _run_seconds(task)
+        if duration is None or duration < 0:
+            duration = estimate_task_seconds(task, averages) # Still waiting, or never finished
+        priority = priorities.get(task_class, task.priority if task.priority is not None else DEFAULT_TASK_PRIORITIES[task_class])
+        sim_task = _sim_task(task.task_id, task_class, priority, arrival, len(task.items or []), deadline_timestamp(task))
+        jobs.append(SimJob(sim_task, task_class, arrival, duration))
+    return jobs, averages
+
+
+def synthetic_workload(hours, rates, mean_seconds, priorities=None, seed=None, sla_seconds=None):
+    """
+    SimJobs with Poisson arrivals: `rates` is tasks per hour by class, run times are
+    exponential around `mean_seconds` by media kind ('image', 'video'); a batch
+    has 1..MAX_SYNTHETIC_BATCH_SIZE image targets. Classes in `sla_seconds` get
+    a deadline that long after arrival.
+    """
+    sla_seconds = sla_seconds or {}
+    rng = random.Random(seed)
+    priorities = {**DEFAULT_TASK_PRIORITIES, **(priorities or {})}
+    start = SYNTHETIC_START.timestamp()
+    jobs = []
+    for task_class, per_hour in rates.items():
+        if per_hour <= 0:
+            continue
+        t = start
+        while True:
+            t += rng.expovariate(per_hour / 3600.0)
+            if t >= start + hours * 3600:
+                break
+            item_count = rng.randint(1, MAX_SYNTHETIC_BATCH_SIZE) if task_class == 'batch' else 0
+            if task_class == 'batch':
+                duration = sum(rng.expovariate(1.0 / mean_seconds['image']) for _ in range(item_count))
+            else:
+                duration = rng.expovariate(1.0 / mean_seconds[task_class])
+            deadline = t + sla_seconds[task_class] if task_class in sla_seconds else None
+            sim_task = _sim_task(f"sim-{task_class}-{len(jobs)}", task_class, priorities[task_class], t, item_count, deadline)
+            jobs.append(SimJob(sim_task, task_class, t, duration))
+    return jobs
+
+
+def simulate(jobs, workers, policy, averages=None):
+    """
+    Runs `jobs` on `workers` identical workers, choosing with scheduling policy
+    `policy` whenever a worker is free. Sets start/end on every job (overwriting
+    those of an earlier run) and returns the jobs in arrival order.
+    """
+    pending = sorted(jobs, key=lambda job: job.arrival)
+    by_id = {job.task.task_id: job for job in pending}
+    queue = []
+    running = [] # Heap of (end, seq, job)
+    free = workers
+    next_arrival = 0
+    now = pending[0].arrival if pending else 0
+    seq = 0
+    while next_arrival < len(pending) or queue or running:
+        # Hand out free workers first, then jump to the next arrival or completion
+        while free and queue:
+            chosen = by_id[pick_next_task(queue, policy, now=datetime.fromtimestamp(now, timezone.utc),
+                                          averages=averages).task_id]
+            queue.remove(chosen.task)
+            chosen.start, chosen.end = now, now + chosen.duration
+            heapq.heappush(running, (chosen.end, seq, chosen))
+            seq += 1
+            free -= 1
+        upcoming = []
+        if next_arrival < len(pending):
+            upcoming.append(pending[next_arrival].arrival)
+        if running:
+            upcoming.append(running[0][0])
+        if not upcoming:
+            break
+        now = max(now, min(upcoming))
+        while running and running[0][0] <= now:
+            heapq.heappop(running)
+            free += 1
+        while next_arrival < len(pending) and pending[next_arrival].arrival <= now:
+            queue.append(pending[next_arrival].task)
+            next_arrival += 1
+    return pending
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def summarize(jobs, workers):
+    """
+    Per class (and 'all'): count, wait percentiles, turnaround p50, throughput per
+    hour, utilization and, for tasks with a deadline, how many were due and missed.
+    """
+    done = [job for job in jobs if job.end is not None]
+    if not done:
+        return {}
+    span = max(job.end for job in done) - min(job.arrival for job in done)
+    span = max(span, 1e-9)
+    summary = {}
+    for task_class in TASK_CLASSES + ('all',):
+        selected = [job for job in done if task_class == 'all' or job.task_class == task_class]
+        if not selected:
+            continue
+        waits = sorted(job.start - job.arrival for job in selected)
+        turnarounds = sorted(job.end - job.arrival for job in selected)
+        deadlines = [(job.end, deadline_timestamp(job.task)) for job in selected if job.task.deadline]
+        summary[task_class] = {
+            "tasks": len(selected),
+            "wait_p50": _percentile(waits, 0.50),
+            "wait_p90": _percentile(waits, 0.90),
+            "wait_p99": _percentile(waits, 0.99),
+            "wait_max": waits[-1],
+            "turnaround_p50": _percentile(turnarounds, 0.50),
+            "throughput_per_hour": len(selected) / span * 3600,
+            "utilization": sum(job.duration for job in selected) / (workers * span),
+            "deadlines": len(deadlines),
+            "deadlines_missed": sum(1 for end, deadline in deadlines if end > deadline),
+        }
+    return {"span_seconds": span, "classes": summary}
+
+
+def _fmt_seconds(value):
+    if value is None:
+        return '-'
+    if value < 120:
+        return f"{value:.1f}s"
+    if value < 7200:
+        return f"{int(value // 60)}m{int(value % 60):02d}s"
+    return f"{value / 3600:.1f}h"
+
+
+def print_report(policy, workers, result):
+    print(f"\npolicy={policy} workers={workers} span={_fmt_seconds(result['span_seconds'])}")
+    with_deadlines = result['classes']['all']['deadlines'] > 0
+    header = ('class', 'tasks', 'wait p50', 'p90', 'p99', 'max', 'turnaround p50', 'per hour', 'util')
+    print("{:<6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>15} {:>9} {:>6}".format(*header) + (" {:>11}".format('missed') if with_deadlines else ''))
+    for task_class, stats in result['classes'].items():
+        missed = f"{stats['deadlines_missed']}/{stats['deadlines']}" if stats['deadlines'] else '-'
+        print("{:<6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>15} {:>9.1f} {:>5.0f}%".format(
+            task_class, stats['tasks'], _fmt_seconds(stats['wait_p50']), _fmt_seconds(stats['wait_p90']),
+            _fmt_seconds(stats['wait_p99']), _fmt_seconds(stats['wait_max']), _fmt_seconds(stats['turnaround_p50']),
+            stats['throughput_per_hour'], stats['utilization'] * 100) + (" {:>11}".format(missed) if with_deadlines else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay task workloads through the scheduling policies offline.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="Worker counts to simulate (default: 1)")
+    parser.add_argument('--policy', nargs='+', default=[DEFAULT_SCHEDULING_POLICY],
+                        help=f"Policies to compare, or 'all' ({', '.join(SCHEDULING_POLICIES)})")
+    parser.add_argument('--priority', type=lambda text: _parse_class_values(text, int), default={},
+                        help="Per-class priority overrides, e.g. video=10,image=20,batch=20")
+    parser.add_argument('--tasks-file', default=TASKS_FILE, help="History to replay (default: data/tasks.json)")
+    parser.add_argument('--since', help="Only replay tasks queued at or after this ISO date")
+    parser.add_argument('--synthetic', action='store_true', help="Generate a workload instead of replaying history")
+    parser.add_argument('--hours', type=float, default=8.0, help="Synthetic: length of the arrival window")
+    parser.add_argument('--rate', type=_parse_class_values, default={'video': 2, 'image': 30, 'batch': 1},
+                        help="Synthetic: arrivals per hour by class (default: video=2,image=30,batch=1)")
+    parser.add_argument('--mean-seconds', type=_parse_class_values, default={},
+                        help="Synthetic: mean run time by media kind, e.g. video=300,image=20 (default: from history)")
+    parser.add_argument('--sla', type=_parse_class_values, default={},
+                        help="Synthetic: deadline in seconds after arrival by class, e.g. video=3600,image=900")
+    parser.add_argument('--seed', type=int, default=None, help="Synthetic: random seed for a repeatable workload")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    policies = list(SCHEDULING_POLICIES) if args.policy == ['all'] else args.policy
+    unknown = [name for name in policies if name not in SCHEDULING_POLICIES]
+    if unknown:
+        parser.error(f"Unknown policy {', '.join(unknown)}, choose from {', '.join(SCHEDULING_POLICIES)} or all")
+    if any(count < 1 for count in args.workers):
+        parser.error("--workers must be at least 1")
+
+    try:
+        history = load_tasks_file(args.tasks_file)
+    except (OSError, ValueError) as e:
+        if not args.synthetic:
+            parser.error(f"Could not read {args.tasks_file}: {e}")
+        history = []
+
+    if args.synthetic:
+        averages = {**average_task_durations(history), **{k: v for k, v in args.mean_seconds.items() if k in DEFAULT_TASK_SECONDS}}
+        jobs = synthetic_workload(args.hours, args.rate, averages, args.priority, args.seed, args.sla)
+    else:
+        since = _timestamp(args.since) if args.since else None
+        if args.since and since is None:
+            parser.error(f"--since {args.since!r} is not an ISO date")
+        jobs, averages = history_workload(history, args.priority, since)
+    if not jobs:
+        parser.exit(1, "No tasks to simulate.\n")
+
+    results = []
+    for policy in policies:
+        for workers in args.workers:
+            result = summarize(simulate(jobs, workers, policy, averages), workers) # Same workload every run
+            results.append({"policy": policy, "workers": workers, **result})
+            if not args.json:
+                print_report(policy, workers, result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Shared fixtures. The app keeps its modules at the top level of the repository
+and its data files under data/; every test gets its own data directory instead.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_helpers
+import ingest
+import previews
+import queue_manager
+import tracing
+import workspace
+
+# Stands in for Deep-Live-Cam's run.py: copies the target to the output. A target
+# whose name contains "broken" makes it exit with an error instead.
+FAKE_RUN_PY = """import shutil, sys
+args = sys.argv
+target, output = args[args.index('-t') + 1], args[args.index('-o') + 1]
+if 'broken' in target:
+    sys.exit('cannot render ' + target)
+shutil.copyfile(target, output)
+"""
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Points the JSON store, the event log, uploads, outputs and scratch space at a fresh temp directory."""
+    data = tmp_path / 'data'
+    (data / 'task_details').mkdir(parents=True)
+    paths = {
+        'DATA_DIR': data,
+        'CONFIG_FILE': data / 'config.json',
+        'INVITES_FILE': data / 'invites.json',
+        'TASKS_FILE': data / 'tasks.json',
+        'TASK_DETAILS_DIR': data / 'task_details',
+    }
+    for name, path in paths.items():
+        monkeypatch.setattr(file_helpers, name, str(path))
+    for cache, name in ((file_helpers._config_cache, 'CONFIG_FILE'), (file_helpers._invite_cache, 'INVITES_FILE'),
+                        (file_helpers._task_cache, 'TASKS_FILE')):
+        monkeypatch.setattr(cache, 'file_path', str(paths[name]))
+        monkeypatch.setattr(cache, '_key', None)
+    monkeypatch.setattr(tracing, 'EVENTS_FILE', str(data / 'task_events.jsonl'))
+    spool_dir = tmp_path / 'uploads' / '.ingest'
+    spool_dir.mkdir(parents=True)
+    monkeypatch.setattr(ingest, 'INGEST_DIR', str(spool_dir))
+    monkeypatch.setattr(queue_manager, 'BASE_OUTPUT_DIR', str(tmp_path / 'outputs'))
+    monkeypatch.setattr(workspace, 'DEFAULT_SCRATCH_DIR', str(tmp_path / 'scratch'))
+    monkeypatch.setattr(previews, 'PREVIEWS_DIR', str(tmp_path / 'previews'))
+    config = file_helpers.load_config()
+    config.update({'secret_key': 'test', 'run_local_worker': False})
+    file_helpers.save_config(config)
+    yield data
+    file_helpers.flush_task_updates() # Nothing queued may land in the next test's files
+
+
+@pytest.fixture
+def app(data_dir, tmp_path):
+    """The Flask app, imported once the store points at the temp directory."""
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True, UPLOADS_DIR=str(tmp_path / 'uploads'), OUTPUTS_DIR=str(tmp_path / 'outputs'))
+    return flask_app
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+    return client
+
+
+@pytest.fixture
+def fake_install(tmp_path):
+    """A Deep-Live-Cam folder with FAKE_RUN_PY, its venv interpreter being the one running the tests."""
+    base = tmp_path / 'Deep-Live-Cam'
+    (base / 'venv' / 'bin').mkdir(parents=True)
+    (base / 'run.py').write_text(FAKE_RUN_PY)
+    os.symlink(sys.executable, base / 'venv' / 'bin' / 'python')
+    return str(base)
+
+
+@pytest.fixture
+def local_worker_config(fake_install):
+    """Config for the in-process worker, rendering with fake_install."""
+    config = file_helpers.load_config()
+    config.update({'run_local_worker': True, 'deep_live_cam_path': fake_install})
+    file_helpers.save_config(config)
+    return config
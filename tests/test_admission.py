@@ -0,0 +1,125 @@
+import io
+import os
+from collections import namedtuple
+
+import pytest
+
+import admission
+import file_helpers as fh
+import ingest
+import metrics
+import user_routes
+from models import Invite, Task
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+
+@pytest.fixture(autouse=True)
+def plenty_of_disk(monkeypatch):
+    monkeypatch.setattr(admission.shutil, 'disk_usage', lambda path: DiskUsage(0, 0, 100 * 1024 ** 3))
+
+
+def set_limits(**limits):
+    config = fh.load_config()
+    config['admission'] = limits
+    fh.save_config(config)
+
+
+def tasks(count, task_type='image', status='queued', priority=20):
+    return [Task(f'{task_type}-{status}-{i}', task_type=task_type, status=status, priority=priority,
+                 created_at='2026-01-01T00:00:00') for i in range(count)]
+
+
+def check(invite_type='image', content_length=1000):
+    return admission.check_admission(invite_type, content_length, '/')
+
+
+def test_limits_override_defaults_key_by_key():
+    limits = admission.admission_limits({'admission': {'max_queued_tasks': {'video': 5}, 'min_free_disk_mb': 0}})
+    assert limits['max_queued_tasks'] == {'image': 200, 'video': 5, 'batch': 20}
+    assert limits['min_free_disk_mb'] == 0
+    assert limits['max_backlog_seconds'] == admission.DEFAULT_ADMISSION_LIMITS['max_backlog_seconds']
+
+
+def test_accepts_when_there_is_room():
+    fh.save_tasks(tasks(3))
+    assert check().accepted
+
+
+def test_queue_full_is_per_class():
+    set_limits(max_queued_tasks={'image': 3, 'video': 3})
+    fh.save_tasks(tasks(3, 'image', status='ingesting') + tasks(1, 'video'))
+    decision = check('image')
+    assert (decision.accepted, decision.reason) == (False, 'queue_full')
+    assert admission.MIN_RETRY_AFTER <= decision.retry_after <= admission.MAX_RETRY_AFTER
+    assert check('video').accepted
+
+
+def test_backlog_counts_running_and_more_urgent_work():
+    set_limits(max_queued_tasks=None, max_backlog_seconds={'image': 600})
+    # Videos go first (priority 10) and take ~300s each by default
+    fh.save_tasks(tasks(2, 'video', priority=10) + tasks(1, 'video', status='processing', priority=10))
+    decision = check('image')
+    assert (decision.accepted, decision.reason) == (False, 'backlog_too_long')
+    assert decision.retry_after == 300 # 900s of backlog, 600s allowed
+
+
+def test_backlog_ignores_less_urgent_work():
+    set_limits(max_queued_tasks=None, max_backlog_seconds={'video': 600})
+    fh.save_tasks(tasks(50, 'image', priority=20))
+    assert check('video').accepted
+
+
+def test_refuses_uploads_that_would_fill_the_disk(monkeypatch):
+    set_limits(min_free_disk_mb=100)
+    monkeypatch.setattr(admission.shutil, 'disk_usage', lambda path: DiskUsage(0, 0, 150 * 1024 * 1024))
+    assert check(content_length=10 * 1024 * 1024).accepted
+    decision = check(content_length=60 * 1024 * 1024)
+    assert (decision.accepted, decision.reason) == (False, 'disk_full')
+
+
+@pytest.fixture
+def submit(app, monkeypatch):
+    monkeypatch.setattr(user_routes, 'enqueue_ingest', lambda task_id, entries: None)
+    fh.save_invites([Invite('abc', 'image')])
+
+    def submit_files():
+        client = app.test_client()
+        client.post('/', data={'invite_code': 'abc'})
+        return client.post('/render/abc', content_type='multipart/form-data',
+                           data={'source_image': (io.BytesIO(PNG), 's.png'), 'target_media': (io.BytesIO(PNG), 't.png')})
+    return submit_files
+
+
+def test_rejected_submission_gets_503_and_keeps_the_invite(submit):
+    set_limits(max_queued_tasks={'image': 1})
+    fh.save_tasks(tasks(1))
+    rejected = metrics.get_counter('admission_rejections_total', invite_type='image', reason='queue_full')
+    response = submit()
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= admission.MIN_RETRY_AFTER
+    assert not fh.get_invite_by_code('abc').used
+    assert os.listdir(ingest.INGEST_DIR) == [] # The body was never spooled
+    assert metrics.get_counter('admission_rejections_total', invite_type='image', reason='queue_full') == rejected + 1
+
+
+def test_admitted_submission_is_counted_once_its_task_exists(submit):
+    accepted = metrics.get_counter('admission_accepted_total', invite_type='image')
+    assert submit().status_code == 302
+    assert len(fh.load_tasks()) == 1
+    assert metrics.get_counter('admission_accepted_total', invite_type='image') == accepted + 1
+
+
+def test_submission_losing_the_invite_is_not_counted(submit, monkeypatch):
+    create_task = user_routes.create_task_for_invite
+
+    def spent_meanwhile(new_task, invite_code):
+        fh.update_invite_status(invite_code, True) # A second tab submitted first
+        return create_task(new_task, invite_code)
+
+    monkeypatch.setattr(user_routes, 'create_task_for_invite', spent_meanwhile)
+    accepted = metrics.get_counter('admission_accepted_total', invite_type='image')
+    assert submit().status_code == 302
+    assert fh.load_tasks() == []
+    assert metrics.get_counter('admission_accepted_total', invite_type='image') == accepted
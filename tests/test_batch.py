@@ -0,0 +1,106 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import file_helpers as fh
+import queue_manager as qm
+import user_routes
+from models import Invite, Task
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+
+
+def batch_task(tmp_path, names, **fields):
+    uploads = tmp_path / 'uploads' / 'inv'
+    uploads.mkdir(parents=True, exist_ok=True)
+    for name in ['source.png'] + names:
+        (uploads / name).write_bytes(PNG + name.encode())
+    items = [{"target_path": str(uploads / name), "status": "queued"} for name in names]
+    fields.setdefault('status', 'queued')
+    return Task('b', invite_code='inv', task_type='batch', source_path=str(uploads / 'source.png'), items=items,
+                created_at='2026-01-01T00:00:00', **fields)
+
+
+def test_batch_submission_has_one_item_per_target(app, monkeypatch):
+    monkeypatch.setattr(user_routes, 'enqueue_ingest', lambda task_id, entries: None)
+    fh.save_invites([Invite('abc', 'batch')])
+    client = app.test_client()
+    client.post('/', data={'invite_code': 'abc'})
+    client.post('/render/abc', content_type='multipart/form-data', data={
+        'source_image': (io.BytesIO(PNG), 's.png'),
+        'target_media': [(io.BytesIO(PNG), f't{i}.png') for i in range(3)]})
+    [task] = fh.load_tasks()
+    assert (task.task_type, task.target_path) == ('batch', None)
+    assert [item['status'] for item in task.items] == ['queued'] * 3
+    assert [entry['role'] for entry in task.ingest] == ['source', 'target 1', 'target 2', 'target 3']
+
+
+def test_local_worker_runs_every_item(tmp_path, local_worker_config):
+    fh.save_tasks([batch_task(tmp_path, ['one.png', 'broken.png', 'three.png'])])
+    task = fh.claim_next_task(qm.LOCAL_WORKER_ID, lambda queued: queued[0])
+    qm.process_task(task, local_worker_config)
+
+    task = fh.get_task_by_id('b')
+    assert task.status == 'completed' # Partly, the failed item carries its own error
+    assert task.error_message == "1 of 3 targets failed."
+    assert [item['status'] for item in task.items] == ['completed', 'failed', 'completed']
+    assert open(task.items[2]['output_path'], 'rb').read() == PNG + b'three.png'
+    assert task.output_path == qm.batch_output_dir(task)
+
+
+def test_retry_only_reruns_unfinished_items(tmp_path, local_worker_config):
+    task = batch_task(tmp_path, ['one.png', 'two.png'])
+    task.status = 'completed'
+    task.items[0].update({"status": "completed", "output_path": "kept.jpg"})
+    task.items[1].update({"status": "failed", "error_message": "boom"})
+    fh.save_tasks([task])
+    assert fh.retry_task('b')
+    assert [item['status'] for item in fh.get_task_by_id('b').items] == ['completed', 'queued']
+
+    qm.process_task(fh.claim_next_task(qm.LOCAL_WORKER_ID, lambda queued: queued[0]), local_worker_config)
+    items = fh.get_task_by_id('b').items
+    assert items[0]['output_path'] == 'kept.jpg' # Not rendered again
+    assert items[1]['status'] == 'completed'
+
+
+@pytest.mark.parametrize('statuses, status, message', [
+    (['completed', 'completed'], 'completed', None),
+    (['completed', 'failed'], 'completed', "1 of 2 targets failed."),
+    (['failed', 'failed'], 'failed', "All targets in the batch failed."),
+])
+def test_batch_final_updates(tmp_path, statuses, status, message):
+    task = batch_task(tmp_path, ['one.png', 'two.png'])
+    items = [{"status": s} for s in statuses]
+    updates = qm.batch_final_updates(task, items)
+    assert (updates['status'], updates['error_message']) == (status, message)
+
+
+def test_stream_zip_round_trips(tmp_path):
+    files = []
+    for name, data in (('one.jpg', b'a' * 5000), ('two.jpg', b'b' * 10)):
+        path = tmp_path / name
+        path.write_bytes(data)
+        files.append((str(path), name))
+    chunks = list(user_routes.stream_zip(files, chunk_size=1024))
+    assert len(chunks) > 2 # Streamed, not built in one piece
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.namelist() == ['one.jpg', 'two.jpg']
+        assert archive.read('one.jpg') == b'a' * 5000
+        assert archive.read('two.jpg') == b'b' * 10
+
+
+def test_archive_download_has_completed_outputs_only(tmp_path, app):
+    task = batch_task(tmp_path, ['one.png', 'two.png'], status='completed')
+    output = tmp_path / 'item_001.jpg'
+    output.write_bytes(b'result')
+    task.items[0].update({"status": "completed", "output_path": str(output)})
+    task.items[1].update({"status": "failed"})
+    fh.save_tasks([task])
+
+    response = app.test_client().get('/download/b.zip')
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['item_001.jpg']
+    assert app.test_client().get('/download/missing.zip').status_code == 404
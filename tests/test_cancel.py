@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import file_helpers as fh
+import queue_manager as qm
+import workspace
+from models import Task
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+
+
+@pytest.fixture
+def claimed_task(tmp_path, local_worker_config):
+    """An image task claimed by the local worker, its files in place."""
+    target = tmp_path / 'target.png'
+    target.write_bytes(PNG)
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='queued', source_path=str(target),
+                        target_path=str(target), created_at='2026-01-01T00:00:00')])
+    return fh.claim_next_task(qm.LOCAL_WORKER_ID, lambda queued: queued[0])
+
+
+def render(task):
+    qm.process_task(task, fh.load_config())
+    return fh.get_task_by_id(task.task_id)
+
+
+def test_render_completes(claimed_task):
+    task = render(claimed_task)
+    assert task.status == 'completed'
+    assert open(task.output_path, 'rb').read() == PNG
+
+
+def test_cancel_of_a_short_render_is_noticed(claimed_task, monkeypatch):
+    record_event = qm.record_event
+
+    def cancel_once_spawned(task_id, event, **fields):
+        if event == 'process_spawned':
+            fh.cancel_task(task_id, "Cancelled by the user.") # Before the first poll
+        record_event(task_id, event, **fields)
+
+    monkeypatch.setattr(qm, 'record_event', cancel_once_spawned)
+    task = render(claimed_task)
+    assert (task.status, task.error_message, task.output_path) == ('cancelled', "Cancelled by the user.", None)
+    assert not os.path.exists(qm.task_output_path(task))
+
+
+def test_cancel_while_the_output_is_promoted(claimed_task, monkeypatch):
+    promote = workspace.TaskWorkspace.promote
+
+    def promote_then_cancel(self, scratch_path, final_path):
+        promoted = promote(self, scratch_path, final_path)
+        fh.cancel_task('a', "Cancelled by the user.")
+        return promoted
+
+    monkeypatch.setattr(workspace.TaskWorkspace, 'promote', promote_then_cancel)
+    task = render(claimed_task)
+    assert (task.status, task.output_path) == ('cancelled', None)
+    assert not os.path.exists(qm.task_output_path(task)) # Discarded, not left behind
+
+
+def test_finishing_a_cancelled_task_is_refused(claimed_task):
+    fh.cancel_task('a', "Cancelled by the user.")
+    assert not qm.finish_local_task('a', {"status": "failed", "error_message": "Return code: 1"})
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message) == ('cancelled', "Cancelled by the user.")
+
+
+def test_user_can_cancel_a_task(app):
+    fh.save_tasks([Task('a', invite_code='inv', task_type='video', status='processing', lease_owner='node-a')])
+    client = app.test_client()
+    response = client.post('/status/a/cancel')
+    assert response.status_code == 302
+    assert fh.get_task_by_id('a').status == 'cancelled'
+    assert client.post('/status/zz/cancel').status_code == 404
@@ -0,0 +1,130 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import deadlines
+import file_helpers as fh
+import metrics
+import queue_manager as qm
+import user_routes
+from models import Invite, Task
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def invite(sla=None, due_by=None):
+    return Invite('abc', 'image', sla=sla, due_by=due_by)
+
+
+def test_deadline_from_sla_class():
+    assert deadlines.task_deadline(invite(sla='express'), NOW) == (NOW + timedelta(hours=1)).isoformat()
+    assert deadlines.task_deadline(invite(), NOW) is None
+
+
+def test_earlier_of_due_by_and_sla_wins():
+    soon = (NOW + timedelta(minutes=20)).isoformat()
+    assert deadlines.task_deadline(invite(sla='express', due_by=soon), NOW) == soon
+    late = (NOW + timedelta(days=2)).isoformat()
+    assert deadlines.task_deadline(invite(sla='standard', due_by=late), NOW) == (NOW + timedelta(days=1)).isoformat()
+
+
+def test_unknown_sla_class_is_ignored():
+    assert deadlines.task_deadline(invite(sla='gold'), NOW) is None
+
+
+def test_sla_classes_from_config():
+    classes = deadlines.sla_classes({'sla_classes': {'express': 1800, 'event': '7200', 'broken': 'soon'}})
+    assert classes == {'express': 1800, 'standard': 24 * 3600, 'event': 7200}
+    assert deadlines.task_deadline(invite(sla='event'), NOW, {'sla_classes': {'event': 7200}}) == \
+        (NOW + timedelta(hours=2)).isoformat()
+
+
+def test_deadline_outcome():
+    task = Task('a', deadline=NOW.isoformat())
+    assert deadlines.deadline_outcome(task, 'completed', NOW - timedelta(seconds=1)) is True
+    assert deadlines.deadline_outcome(task, 'completed', NOW + timedelta(seconds=1)) is False
+    assert deadlines.deadline_outcome(task, 'failed', NOW - timedelta(hours=1)) is False # A failure misses it
+    assert deadlines.deadline_outcome(Task('b'), 'completed', NOW) is None
+
+
+@pytest.mark.parametrize('deadline, status, met', [
+    ('2099-01-01T00:00:00+00:00', 'completed', True),
+    ('2020-01-01T00:00:00+00:00', 'completed', False),
+    ('2099-01-01T00:00:00+00:00', 'failed', False),
+])
+def test_finishing_a_task_settles_its_deadline(deadline, status, met):
+    fh.save_tasks([Task('a', invite_code='inv', task_type='video', status='processing', deadline=deadline)])
+    outcome = 'met' if met else 'missed'
+    counted = metrics.get_counter('task_deadlines_total', task_type='video', outcome=outcome)
+    fh.update_task('a', {"status": status})
+    assert fh.get_task_by_id('a').deadline_met is met
+    assert metrics.get_counter('task_deadlines_total', task_type='video', outcome=outcome) == counted + 1
+
+
+def test_task_without_deadline_is_not_counted():
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='processing')])
+    fh.update_task('a', {"status": "completed"})
+    assert fh.get_task_by_id('a').deadline_met is None
+
+
+def queued(task_id, task_type='image', minutes_ago=0, **fields):
+    return Task(task_id, task_type=task_type, status='queued', priority=10,
+                created_at=(NOW - timedelta(minutes=minutes_ago)).isoformat(), **fields)
+
+
+def due_in(minutes):
+    return (NOW + timedelta(minutes=minutes)).isoformat()
+
+
+def test_projected_finish_follows_the_policy():
+    tasks = [queued('video', 'video', 2), queued('image', 'image', 1)]
+    averages = {'video': 300, 'image': 20}
+    now = NOW.timestamp()
+    assert qm.project_finish_times(tasks, 'fifo', averages, NOW) == {'video': now + 300, 'image': now + 320}
+    assert qm.project_finish_times(tasks, 'shortest_first', averages, NOW) == {'image': now + 20, 'video': now + 320}
+
+
+def test_deadline_risks():
+    tasks = [queued('late', 'video', 3, deadline=due_in(-1)),
+             queued('tight', 'video', 2, deadline=due_in(6)), # Waits for the first video
+             queued('fine', 'image', 1, deadline=due_in(60)),
+             queued('none', 'image', 1),
+             Task('done', task_type='image', status='completed', deadline=due_in(-10))]
+    assert qm.deadline_risks(tasks, 'fifo', {'video': 300, 'image': 20}, NOW) == {'late': 'overdue', 'tight': 'at_risk'}
+
+
+def test_admin_creates_invites_with_a_deadline(admin_client):
+    admin_client.post('/admin/invites', data={'invite_type': 'image', 'count': '2', 'sla': 'express',
+                                              'due_by': '2099-03-01T18:00'})
+    invites = fh.load_invites()
+    assert [(i.sla, i.due_by) for i in invites] == [('express', '2099-03-01T18:00:00+00:00')] * 2
+
+    response = admin_client.post('/admin/invites', data={'invite_type': 'image', 'count': '1', 'sla': 'gold'},
+                                 follow_redirects=True)
+    assert b'Invalid SLA class' in response.data
+    response = admin_client.post('/admin/invites', data={'invite_type': 'image', 'count': '1', 'due_by': '2020-01-01T00:00'},
+                                 follow_redirects=True)
+    assert b'must be in the future' in response.data
+    assert len(fh.load_invites()) == 2
+
+
+def test_admin_queue_flags_tasks_at_risk(admin_client):
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='queued', created_at=NOW.isoformat(),
+                        deadline='2020-01-01T00:00:00+00:00')])
+    response = admin_client.get('/admin/queue')
+    assert response.status_code == 200
+    assert b'deadline-overdue' in response.data
+
+
+def test_submission_gets_the_invite_deadline(app, monkeypatch):
+    monkeypatch.setattr(user_routes, 'enqueue_ingest', lambda task_id, entries: None)
+    fh.save_invites([Invite('abc', 'image', sla='express')])
+    client = app.test_client()
+    client.post('/', data={'invite_code': 'abc'})
+    png = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+    client.post('/render/abc', content_type='multipart/form-data',
+                data={'source_image': (io.BytesIO(png), 's.png'), 'target_media': (io.BytesIO(png), 't.png')})
+    [task] = fh.load_tasks()
+    remaining = deadlines.deadline_timestamp(task) - datetime.now(timezone.utc).timestamp()
+    assert 3500 < remaining <= 3600
@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+import file_helpers as fh
+import ingest
+from models import Task
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'0' * 32
+
+
+@pytest.fixture
+def ingesting_task(tmp_path):
+    """A task reserved by render_page, with its two uploads still in the spool directory."""
+    entries = []
+    for role in ('source', 'target'):
+        spool = os.path.join(ingest.INGEST_DIR, f'{ingest.SPOOL_PREFIX}{role}.part')
+        with open(spool, 'wb') as f:
+            f.write(PNG)
+        entries.append({"spool": spool, "dest": str(tmp_path / 'uploads' / 'inv' / f'{role}.png'),
+                        "role": role, "kinds": ["image"]})
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='ingesting',
+                        created_at='2026-01-01T00:00:00', ingest=entries)])
+    return entries
+
+
+def _files_left(entries):
+    return [path for entry in entries for path in (entry['spool'], entry['dest']) if os.path.exists(path)]
+
+
+def test_ingest_moves_uploads_and_queues_task(ingesting_task):
+    assert ingest.ingest_task('a', ingesting_task)
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.ingest) == ('queued', None)
+    assert task.queued_at
+    assert _files_left(ingesting_task) == [entry['dest'] for entry in ingesting_task]
+
+
+def test_ingest_fails_task_with_wrong_media(ingesting_task):
+    with open(ingesting_task[1]['spool'], 'wb') as f:
+        f.write(b'not an image at all')
+    assert not ingest.ingest_task('a', ingesting_task)
+    task = fh.get_task_by_id('a')
+    assert task.status == 'failed'
+    assert 'target' in task.error_message
+    assert _files_left(ingesting_task) == []
+
+
+def test_cancel_during_ingest_sticks(ingesting_task, monkeypatch):
+    sniff = ingest.sniff_media_kind
+
+    def cancel_then_sniff(path):
+        fh.cancel_task('a', "Cancelled by the user.")
+        return sniff(path)
+
+    monkeypatch.setattr(ingest, 'sniff_media_kind', cancel_then_sniff)
+    assert not ingest.ingest_task('a', ingesting_task)
+
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message) == ('cancelled', "Cancelled by the user.")
+    assert _files_left(ingesting_task) == [] # Moved, then discarded
+    assert not fh.retry_task('a') # Nothing left to render
+    assert fh.get_task_by_id('a').status == 'cancelled'
+
+
+def test_failed_ingest_does_not_overwrite_cancel(ingesting_task, monkeypatch):
+    def cancel_and_reject(path):
+        fh.cancel_task('a', "Cancelled by the user.")
+        return None
+
+    monkeypatch.setattr(ingest, 'sniff_media_kind', cancel_and_reject)
+    assert not ingest.ingest_task('a', ingesting_task)
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message) == ('cancelled', "Cancelled by the user.")
+    assert _files_left(ingesting_task) == []
+
+
+def test_admin_retry_explains_cancelled_ingest(ingesting_task, admin_client):
+    fh.cancel_task('a')
+    response = admin_client.post('/admin/queue', data={'task_id': 'a', 'action': 'retry_task'}, follow_redirects=True)
+    assert b'cancelled before its uploads were stored' in response.data
+    assert fh.get_task_by_id('a').status == 'cancelled'
+
+
+def test_ingest_fails_task_with_empty_upload(ingesting_task):
+    open(ingesting_task[0]['spool'], 'wb').close()
+    assert not ingest.ingest_task('a', ingesting_task)
+    assert fh.get_task_by_id('a').error_message == "Uploaded source file is empty."
+
+
+def test_ingest_fails_task_whose_upload_is_gone(ingesting_task):
+    os.remove(ingesting_task[0]['spool'])
+    assert not ingest.ingest_task('a', ingesting_task)
+    assert fh.get_task_by_id('a').error_message == "Uploaded source file was lost before processing."
+
+
+def test_resumed_ingest_accepts_files_already_moved(ingesting_task):
+    # A restart after the first rename: that file is at its destination already
+    first = ingesting_task[0]
+    os.makedirs(os.path.dirname(first['dest']), exist_ok=True)
+    os.replace(first['spool'], first['dest'])
+    assert ingest.ingest_task('a', ingesting_task)
+    assert fh.get_task_by_id('a').status == 'queued'
+
+
+def test_ingest_of_already_ingested_task_is_a_no_op(ingesting_task):
+    assert ingest.ingest_task('a', ingesting_task)
+    assert not ingest.ingest_task('a', ingesting_task)
+    assert fh.get_task_by_id('a').status == 'queued'
+
+
+def test_sweep_keeps_spools_of_pending_ingests(ingesting_task, monkeypatch):
+    orphan = os.path.join(ingest.INGEST_DIR, ingest.SPOOL_PREFIX + 'orphan.part')
+    open(orphan, 'wb').close()
+    for path in (orphan, ingesting_task[0]['spool']):
+        os.utime(path, (0, 0)) # Older than STALE_SPOOL_SECONDS
+    ingest._sweep_stale_spools()
+    assert not os.path.exists(orphan)
+    assert os.path.exists(ingesting_task[0]['spool'])
+
+
+@pytest.mark.parametrize('head, kind', [
+    (b'\xff\xd8\xff\xe0' + b'0' * 12, 'image'),
+    (PNG, 'image'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image'),
+    (b'\x00\x00\x00\x18ftypmp42' + b'0' * 4, 'video'),
+    (b'\x1a\x45\xdf\xa3' + b'0' * 12, 'video'),
+    (b'GIF89a' + b'0' * 10, None),
+])
+def test_sniff_media_kind(tmp_path, head, kind):
+    path = tmp_path / 'upload'
+    path.write_bytes(head)
+    assert ingest.sniff_media_kind(str(path)) == kind
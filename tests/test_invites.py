@@ -0,0 +1,72 @@
+import csv
+import io
+
+import file_helpers as fh
+from models import Invite
+
+
+def test_create_invites_stores_unique_codes_in_one_go():
+    fh.save_invites([Invite('existing', 'image')])
+    codes = fh.create_invites('video', 50, label='launch')
+    assert len(set(codes)) == 50
+    invites = {invite.code: invite for invite in fh.load_invites()}
+    assert len(invites) == 51
+    assert all(invites[code].type == 'video' and invites[code].label == 'launch' and not invites[code].used
+               for code in codes)
+    assert invites['existing'].label is None
+
+
+def test_lookup_returns_copies():
+    fh.save_invites([Invite('abc', 'image')])
+    fh.get_invite_by_code('abc').used = True
+    assert not fh.get_invite_by_code('abc').used
+    assert fh.get_invite_by_code('missing') is None
+
+
+def test_admin_bulk_generate(admin_client):
+    admin_client.post('/admin/invites', data={'invite_type': 'batch', 'count': '25', 'label': 'fair'})
+    invites = fh.load_invites()
+    assert len(invites) == 25
+    assert {(invite.type, invite.label) for invite in invites} == {('batch', 'fair')}
+
+
+def test_admin_bulk_generate_rejects_bad_input(admin_client):
+    for data in ({'invite_type': 'image', 'count': '0'}, {'invite_type': 'image', 'count': '100000'},
+                 {'invite_type': 'gif', 'count': '1'}):
+        admin_client.post('/admin/invites', data=data)
+    assert fh.load_invites() == []
+
+
+def _export(admin_client, query=''):
+    response = admin_client.get('/admin/invites/export.csv' + query)
+    assert response.mimetype == 'text/csv'
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_csv_export_lists_the_filtered_invites(admin_client):
+    fh.save_invites([Invite('a1', 'image', False, '2026-01-01T00:00:00', 'fair'),
+                     Invite('a2', 'image', True, '2026-01-02T00:00:00', 'fair'),
+                     Invite('b1', 'video', False, '2026-01-03T00:00:00')])
+
+    rows = _export(admin_client)
+    assert [row['code'] for row in rows] == ['b1', 'a2', 'a1'] # Newest first
+    assert rows[1] == {'code': 'a2', 'type': 'image', 'used': 'yes', 'label': 'fair', 'sla': '', 'due_by': '',
+                       'created_at': '2026-01-02T00:00:00'}
+
+    assert [row['code'] for row in _export(admin_client, '?label=fair&status=unused')] == ['a1']
+    assert [row['code'] for row in _export(admin_client, '?type=video')] == ['b1']
+    assert [row['code'] for row in _export(admin_client, '?q=A2')] == ['a2']
+
+
+def test_csv_export_streams_large_lists(admin_client):
+    fh.create_invites('image', 3000)
+    response = admin_client.get('/admin/invites/export.csv')
+    assert response.is_streamed
+    assert len(response.get_data(as_text=True).splitlines()) == 3001
+
+
+def test_invite_page_is_paginated(admin_client):
+    fh.create_invites('image', 60, label='page')
+    page = admin_client.get('/admin/invites?per_page=25&page=3').get_data(as_text=True)
+    codes = {invite.code for invite in fh.load_invites()}
+    assert sum(1 for code in codes if code in page) == 10
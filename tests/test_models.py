@@ -0,0 +1,89 @@
+import json
+import os
+
+import file_helpers as fh
+import models
+from models import Invite, Task
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_v1(path, records):
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=4) # Version 1: a bare, indented list
+
+
+def test_task_record_is_compact_and_keeps_unknown_fields():
+    task = Task('a', status='queued', output_path=None, stdout='log', custom='kept')
+    record = task.to_record()
+    assert record == {'task_id': 'a', 'status': 'queued', 'priority': 99, 'custom': 'kept'}
+    assert Task.from_dict(record).extra == {'custom': 'kept'}
+
+
+def test_documents_carry_the_schema_version():
+    fh.save_tasks([Task('a', status='queued', options={'keep_fps': True})])
+    document = read_json(fh.TASKS_FILE)
+    assert document['schema_version'] == models.SCHEMA_VERSION
+    assert document['tasks'] == [{'task_id': 'a', 'status': 'queued', 'priority': 99}]
+    assert read_json(os.path.join(fh.TASK_DETAILS_DIR, 'a.json')) == {'options': {'keep_fps': True}}
+
+
+def test_version_1_files_are_read_and_rewritten():
+    write_v1(fh.TASKS_FILE, [{'task_id': 'a', 'status': 'queued', 'priority': 10, 'stdout': 'old log',
+                              'options': {'many_faces': True}}])
+    write_v1(fh.INVITES_FILE, [{'code': 'abc', 'type': 'video', 'used': False}])
+
+    [task] = fh.load_tasks()
+    assert (task.status, task.priority, task.stdout, task.options) == ('queued', 10, 'old log', {'many_faces': True})
+    assert fh.get_invite_by_code('abc').type == 'video'
+
+    fh.save_tasks(fh.load_tasks())
+    fh.save_invites(fh.load_invites())
+    assert read_json(fh.TASKS_FILE) == {'schema_version': models.SCHEMA_VERSION,
+                                        'tasks': [{'task_id': 'a', 'status': 'queued', 'priority': 10}]}
+    assert read_json(fh.INVITES_FILE)['invites'] == [{'code': 'abc', 'type': 'video', 'used': False}]
+    assert fh.get_task_by_id('a').stdout == 'old log'
+
+
+def test_version_1_heavy_fields_move_out_on_first_update():
+    write_v1(fh.TASKS_FILE, [{'task_id': 'a', 'status': 'processing', 'stdout': 'old', 'options': {'keep_fps': True}}])
+    fh.update_task('a', {'status': 'failed', 'stderr': 'boom'})
+    assert read_json(fh.TASKS_FILE)['tasks'] == [{'task_id': 'a', 'status': 'failed'}]
+    task = fh.get_task_by_id('a')
+    assert (task.stdout, task.stderr, task.options) == ('old', 'boom', {'keep_fps': True})
+
+
+def test_version_1_task_retried_loses_its_old_logs():
+    write_v1(fh.TASKS_FILE, [{'task_id': 'a', 'status': 'failed', 'stdout': 'old', 'options': {'keep_fps': True}}])
+    assert fh.retry_task('a')
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.stdout, task.options) == ('queued', None, {'keep_fps': True})
+
+
+def test_heavy_fields_are_only_read_when_used(monkeypatch):
+    fh.save_tasks([Task(f't{i}', status='queued', options={'keep_fps': True}) for i in range(5)])
+    reads = []
+    load_details = fh.load_task_details
+    monkeypatch.setattr(fh, 'load_task_details', lambda task_id: reads.append(task_id) or load_details(task_id))
+    tasks = fh.load_tasks()
+    assert [task.status for task in tasks] == ['queued'] * 5
+    assert reads == []
+    assert tasks[2].options == {'keep_fps': True}
+    assert reads == ['t2']
+
+
+def test_stdlib_json_fallback(monkeypatch):
+    monkeypatch.setattr(models, 'orjson', None)
+    text = models.dumps({'a': [1, None]})
+    assert text == '{"a":[1,null]}'
+    assert models.loads(text) == {'a': [1, None]}
+
+
+def test_invite_round_trip():
+    invite = Invite('abc', 'batch', True, '2026-01-01T00:00:00', 'fair', 'express', None, note='x')
+    assert Invite.from_dict(invite.to_record()).to_record() == {
+        'code': 'abc', 'type': 'batch', 'used': True, 'created_at': '2026-01-01T00:00:00', 'label': 'fair',
+        'sla': 'express', 'note': 'x'}
@@ -0,0 +1,87 @@
+import os
+import time
+
+import previews
+
+FRAME = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+
+
+def extracted_frames(tmp_path, count):
+    """Frames as Deep-Live-Cam leaves them after extracting video.mp4 in a workspace."""
+    frames_dir = tmp_path / 'temp' / 'video'
+    frames_dir.mkdir(parents=True)
+    extracted = time.time() - 60
+    for index in range(1, count + 1):
+        path = frames_dir / f'{index:04d}.png'
+        path.write_bytes(FRAME)
+        os.utime(path, (extracted, extracted))
+    return frames_dir
+
+
+def swap(frames_dir, count):
+    """Rewrites the first `count` frames, as the face swapper does."""
+    for index in range(1, count + 1):
+        os.utime(frames_dir / f'{index:04d}.png')
+
+
+def test_sampler_follows_the_deep_live_cam_layout(tmp_path):
+    sampler = previews.PreviewSampler.for_target('a', str(tmp_path / 'video.mp4'))
+    assert sampler.frames_dir == str(tmp_path / 'temp' / 'video')
+
+
+def test_progress_and_previews_of_processed_frames(tmp_path, monkeypatch):
+    monkeypatch.setattr(previews, 'Image', None) # The stand-in frames are copied as they are
+    frames_dir = extracted_frames(tmp_path, 100)
+    sampler = previews.PreviewSampler('a', str(frames_dir), max_frames=4, interval=0)
+    assert not sampler.sample() # First look, extraction may still be running
+    assert not sampler.sample() # Frame count stable, nothing swapped yet
+    assert sampler.processed_fraction == 0
+
+    swap(frames_dir, 40)
+    assert sampler.sample()
+    assert sampler.processed_fraction == 0.4
+    assert sampler.preview_count == 2 # Frames 12 and 37 of the slots 12, 37, 62, 87
+    assert previews.list_previews('a') == ['frame_000012.png', 'frame_000037.png']
+
+    assert not sampler.sample() # Nothing new
+    swap(frames_dir, 100)
+    assert sampler.sample()
+    assert (sampler.processed_fraction, sampler.preview_count) == (1.0, 4)
+    assert len(previews.list_previews('a')) == 4
+
+
+def test_sampler_waits_for_its_interval(tmp_path):
+    frames_dir = extracted_frames(tmp_path, 10)
+    sampler = previews.PreviewSampler('a', str(frames_dir), interval=3600)
+    sampler.sample()
+    assert sampler._frame_count == 10
+    swap(frames_dir, 10)
+    assert not sampler.sample()
+    assert sampler.processed_fraction == 0
+
+
+def test_sampler_without_frames(tmp_path):
+    sampler = previews.PreviewSampler('a', str(tmp_path / 'temp' / 'missing'), interval=0)
+    assert not sampler.sample()
+    assert previews.list_previews('a') == []
+
+
+def test_oversized_frames_are_not_copied(tmp_path, monkeypatch):
+    monkeypatch.setattr(previews, 'Image', None)
+    monkeypatch.setattr(previews, 'PREVIEW_MAX_FRAME_BYTES', 10)
+    frames_dir = extracted_frames(tmp_path, 4)
+    sampler = previews.PreviewSampler('a', str(frames_dir), max_frames=4, interval=0)
+    sampler.sample()
+    sampler.sample()
+    swap(frames_dir, 4)
+    assert sampler.sample() # Progress moved all the same
+    assert (sampler.processed_fraction, sampler.preview_count) == (1.0, 0)
+
+
+def test_sweep_and_remove(tmp_path):
+    for task_id in ('a', 'b'):
+        os.makedirs(previews.preview_dir(task_id))
+    previews.sweep_previews(keep={'a'})
+    assert os.listdir(previews.PREVIEWS_DIR) == ['a']
+    previews.remove_previews('a')
+    assert os.listdir(previews.PREVIEWS_DIR) == []
@@ -0,0 +1,71 @@
+import json
+import os
+
+import file_helpers as fh
+import metrics
+from models import Invite, Task
+
+
+def misses():
+    return metrics.get_counter('store_cache_misses_total', file='tasks.json')
+
+
+def hits():
+    return metrics.get_counter('store_cache_hits_total', file='tasks.json')
+
+
+def test_unchanged_file_is_not_parsed_again():
+    fh.save_tasks([Task('a', invite_code='i', status='queued')])
+    fh.load_tasks()
+    before_misses, before_hits = misses(), hits()
+    for _ in range(5):
+        fh.load_tasks()
+        fh.get_task_by_id('a')
+    assert misses() == before_misses
+    assert hits() == before_hits + 10
+
+
+def test_own_writes_invalidate():
+    fh.save_tasks([Task('a', invite_code='i', status='queued')])
+    assert fh.get_task_by_id('a').status == 'queued'
+    fh.update_task('a', {"status": "processing"})
+    assert fh.get_task_by_id('a').status == 'processing'
+    fh.save_tasks([])
+    assert fh.load_tasks() == []
+
+
+def test_writes_from_another_process_invalidate():
+    fh.save_tasks([Task('a', invite_code='i', status='queued')])
+    assert fh.get_task_by_id('a').status == 'queued'
+    # Another process writes through its own temp file and rename, which changes the stat stamp
+    tmp_path = fh.TASKS_FILE + '.other'
+    with open(tmp_path, 'w') as f:
+        json.dump({"schema_version": 2, "tasks": [{"task_id": "a", "invite_code": "i", "status": "failed"},
+                                                  {"task_id": "b", "invite_code": "i", "status": "queued"}]}, f)
+    os.replace(tmp_path, fh.TASKS_FILE)
+    assert fh.get_task_by_id('a').status == 'failed'
+    assert [task.task_id for task in fh.load_tasks()] == ['a', 'b']
+
+
+def test_handed_out_values_are_copies():
+    fh.save_tasks([Task('a', invite_code='i', status='queued', options={'many_faces': True})])
+    fh.save_invites([Invite('i', 'image', False, '2026-01-01T00:00:00')])
+    fh.save_config(dict(fh.load_config(), scratch_quota_mb=10))
+
+    task = fh.get_task_by_id('a')
+    task.status = 'failed'
+    fh.load_tasks()[0].priority = 1
+    fh.get_invite_by_code('i').used = True
+    fh.load_config()['scratch_quota_mb'] = 0
+
+    assert fh.get_task_by_id('a').status == 'queued'
+    assert fh.load_tasks()[0].priority == 99
+    assert fh.get_invite_by_code('i').used is False
+    assert fh.load_config()['scratch_quota_mb'] == 10
+
+
+def test_missing_file_is_never_served_from_cache():
+    fh.save_tasks([Task('a', invite_code='i', status='queued')])
+    fh.load_tasks()
+    os.remove(fh.TASKS_FILE)
+    assert fh.load_tasks() == []
@@ -0,0 +1,148 @@
+import os
+import time
+from collections import namedtuple
+
+import pytest
+
+import admission
+import file_helpers as fh
+import renderers
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+DECLARED_ARGUMENTS = """import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-s', '--source', dest='source_path')
+parser.add_argument('--frame-processor', dest='frame_processor', nargs='+')
+parser.add_argument('--keep-fps', action='store_true')
+"""
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(monkeypatch):
+    monkeypatch.setattr(renderers, '_renderers', {})
+    monkeypatch.setattr(renderers, '_probe_locks', {})
+    monkeypatch.setattr(renderers, '_background_checks', set())
+
+
+def wait_for_check(base):
+    for _ in range(100):
+        result = renderers.renderer_status(base, wait=False)
+        if result != (None, None):
+            return result
+        time.sleep(0.05)
+    raise AssertionError("background check did not finish")
+
+
+def test_build_command_passes_every_known_flag():
+    options = {'frame_processor_face_swapper': True, 'frame_processor_face_enhancer': True, 'many_faces': True,
+               'keep_fps': False}
+    assert renderers.build_command('py', 'run.py', 's.png', 't.mp4', 'o.mp4', options) == [
+        'py', 'run.py', '-s', 's.png', '-t', 't.mp4', '-o', 'o.mp4',
+        '--frame-processor', 'face_swapper', 'face_enhancer', '--many-faces', '--execution-provider', 'cpu']
+    assert renderers.build_command('py', 'run.py', 's', 't', 'o', {'execution_provider_cuda': True})[-2:] == \
+        ['--execution-provider', 'cuda']
+
+
+@pytest.mark.parametrize('layout', [('venv', 'Scripts', 'python.exe'), ('venv', 'bin', 'python')])
+def test_venv_python_for_both_layouts(tmp_path, layout):
+    python = tmp_path.joinpath(*layout)
+    python.parent.mkdir(parents=True)
+    python.write_text('')
+    assert renderers.venv_python_for(str(tmp_path)) == str(python)
+
+
+def test_venv_python_missing(tmp_path):
+    assert renderers.venv_python_for(str(tmp_path)) is None
+
+
+def test_inspect_usable_install(fake_install):
+    install = renderers.inspect_renderer(fake_install)
+    assert install.python == os.path.join(fake_install, 'venv', 'bin', 'python')
+    assert install.python_version.startswith('Python 3')
+    assert install.supported_flags is None # FAKE_RUN_PY declares nothing, every flag is passed
+
+
+@pytest.mark.parametrize('breakage, error', [
+    ('unset', "path not configured"),
+    ('folder', "folder not found"),
+    ('run.py', "run.py not found"),
+    ('venv', "Venv Python not found"),
+    ('interpreter', "exited with code"),
+])
+def test_inspect_broken_installs(fake_install, tmp_path, breakage, error):
+    base = fake_install
+    if breakage == 'unset':
+        base = ''
+    elif breakage == 'folder':
+        base = str(tmp_path / 'missing')
+    elif breakage == 'run.py':
+        os.remove(os.path.join(fake_install, 'run.py'))
+    elif breakage == 'venv':
+        os.remove(os.path.join(fake_install, 'venv', 'bin', 'python'))
+    else:
+        python = os.path.join(fake_install, 'venv', 'bin', 'python')
+        os.remove(python)
+        with open(python, 'w') as f:
+            f.write('#!/bin/sh\nexit 3\n')
+        os.chmod(python, 0o755)
+    with pytest.raises(renderers.RendererError, match=error):
+        renderers.inspect_renderer(base)
+
+
+def test_options_the_install_lacks_are_dropped(fake_install):
+    os.makedirs(os.path.join(fake_install, 'modules'))
+    with open(os.path.join(fake_install, 'modules', 'core.py'), 'w') as f:
+        f.write(DECLARED_ARGUMENTS)
+    install = renderers.inspect_renderer(fake_install)
+    assert install.supported_flags == {'--source', '--frame-processor', '--keep-fps'}
+    assert 'many_faces' in install.unsupported_options
+    command = install.build_command('s', 't', 'o', {'frame_processor_face_swapper': True, 'many_faces': True,
+                                                    'keep_fps': True, 'execution_provider_cuda': True})
+    assert command[8:] == ['--frame-processor', 'face_swapper', '--keep-fps'] # No --execution-provider either
+
+
+def test_usable_install_is_cached_until_refreshed(fake_install):
+    install = renderers.get_renderer(fake_install)
+    os.remove(os.path.join(fake_install, 'run.py'))
+    assert renderers.get_renderer(fake_install) is install # Not probed again
+    with pytest.raises(renderers.RendererError, match="run.py not found"):
+        renderers.get_renderer(fake_install, refresh=True)
+
+
+def test_broken_install_is_checked_again_later(fake_install, monkeypatch):
+    run_py = os.path.join(fake_install, 'run.py')
+    os.rename(run_py, run_py + '.off')
+    assert renderers.renderer_status(fake_install)[1].startswith("run.py not found")
+    os.rename(run_py + '.off', run_py) # Fixed
+    assert renderers.renderer_status(fake_install)[1] is not None # Still the cached failure
+    monkeypatch.setattr(renderers, 'FAILED_RECHECK_SECONDS', 0)
+    install, error = renderers.renderer_status(fake_install)
+    assert (install.run_py, error) == (run_py, None)
+
+
+def test_requests_never_wait_for_the_probe(fake_install):
+    assert renderers.renderer_status(fake_install, wait=False) == (None, None)
+    install, error = wait_for_check(fake_install)
+    assert (install.base_path, error) == (fake_install, None)
+
+
+def test_health_endpoint(app, local_worker_config):
+    client = app.test_client()
+    response = client.get('/health/renderer')
+    assert (response.status_code, response.json['error']) == (503, "Renderer check in progress.")
+    wait_for_check(local_worker_config['deep_live_cam_path'])
+    response = client.get('/health/renderer')
+    assert response.status_code == 200
+    assert response.json['python'] == os.path.join(local_worker_config['deep_live_cam_path'], 'venv', 'bin', 'python')
+
+
+def test_broken_renderer_closes_admission(monkeypatch, tmp_path):
+    monkeypatch.setattr(admission.shutil, 'disk_usage', lambda path: DiskUsage(0, 0, 100 * 1024 ** 3))
+    config = fh.load_config()
+    config.update({'run_local_worker': True, 'deep_live_cam_path': str(tmp_path / 'missing')})
+    renderers.renderer_status(config['deep_live_cam_path'])
+    decision = admission.check_admission('image', 1000, str(tmp_path), config)
+    assert (decision.accepted, decision.reason) == (False, 'renderer_unavailable')
+    config['worker_tokens'] = {'node-a': 'token'} # Render nodes can still take the work
+    assert admission.check_admission('image', 1000, str(tmp_path), config).accepted
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import scheduler_sim as sim
+
+START = sim.SYNTHETIC_START.timestamp()
+
+
+def job(task_id, task_class, arrival, duration, priority=10, deadline=None):
+    arrival = START + arrival
+    deadline = arrival + deadline if deadline is not None else None
+    return sim.SimJob(sim._sim_task(task_id, task_class, priority, arrival, deadline=deadline), task_class, arrival, duration)
+
+
+def waits(jobs):
+    return {j.task.task_id: j.start - j.arrival for j in jobs}
+
+
+def test_fifo_makes_the_image_wait_behind_both_videos():
+    jobs = [job('v1', 'video', 0, 300), job('v2', 'video', 1, 300), job('img', 'image', 2, 20)]
+    assert waits(sim.simulate(jobs, 1, 'fifo')) == {'v1': 0, 'v2': 299, 'img': 598}
+    assert waits(sim.simulate(jobs, 1, 'shortest_first')) == {'v1': 0, 'v2': 319, 'img': 298}
+
+
+def test_more_workers_remove_the_wait():
+    jobs = [job('a', 'image', 0, 100), job('b', 'image', 0, 100)]
+    one = sim.summarize(sim.simulate(jobs, 1, 'fifo'), 1)
+    assert one['span_seconds'] == 200
+    assert one['classes']['image']['wait_max'] == 100
+    assert one['classes']['image']['utilization'] == pytest.approx(1.0)
+    assert one['classes']['image']['throughput_per_hour'] == pytest.approx(36)
+
+    two = sim.summarize(sim.simulate(jobs, 2, 'fifo'), 2)
+    assert two['span_seconds'] == 100
+    assert two['classes']['all']['wait_max'] == 0
+    assert two['classes']['all']['utilization'] == pytest.approx(1.0)
+
+
+def test_summary_per_class_and_missed_deadlines():
+    jobs = [job('v', 'video', 0, 300, deadline=200), job('img', 'image', 0, 20, deadline=600)]
+    summary = sim.summarize(sim.simulate(jobs, 1, 'fifo'), 1)['classes']
+    assert sorted(summary) == ['all', 'image', 'video']
+    assert (summary['video']['deadlines'], summary['video']['deadlines_missed']) == (1, 1)
+    assert (summary['all']['deadlines'], summary['all']['deadlines_missed']) == (2, 1)
+
+
+def test_nothing_to_summarize():
+    assert sim.summarize([], 1) == {}
+
+
+def test_synthetic_workload_is_repeatable():
+    def workload(seed):
+        jobs = sim.synthetic_workload(2, {'video': 3, 'image': 30, 'batch': 2}, {'video': 300, 'image': 20}, seed=seed,
+                                      sla_seconds={'image': 900})
+        return [(j.task.task_id, j.arrival, j.duration, j.task.deadline) for j in jobs]
+
+    assert workload(7) == workload(7)
+    assert workload(7) != workload(8)
+    jobs = sim.synthetic_workload(2, {'image': 30, 'batch': 2}, {'image': 20}, seed=7, sla_seconds={'image': 900})
+    assert all(j.task.deadline for j in jobs if j.task_class == 'image')
+    assert all(1 <= len(j.task.items) <= sim.MAX_SYNTHETIC_BATCH_SIZE for j in jobs if j.task_class == 'batch')
+
+
+def test_command_line_report(tmp_path, capsys):
+    sim.main(['--synthetic', '--seed', '1', '--hours', '1', '--rate', 'image=20', '--policy', 'fifo', 'priority',
+              '--workers', '1', '2', '--tasks-file', str(tmp_path / 'missing.json'), '--json'])
+    results = json.loads(capsys.readouterr().out)
+    assert [(r['policy'], r['workers']) for r in results] == [('fifo', 1), ('fifo', 2), ('priority', 1), ('priority', 2)]
+    assert len({r['classes']['image']['tasks'] for r in results}) == 1 # Same workload every run
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import queue_manager as qm
+from models import Task
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def queued(task_id, minutes_ago, **fields):
+    fields.setdefault('task_type', 'image')
+    created = (NOW - timedelta(minutes=minutes_ago)).isoformat()
+    return Task(task_id, status='queued', created_at=created, **fields)
+
+
+def pick(tasks, policy):
+    return qm.pick_next_task(tasks, policy=policy, now=NOW).task_id
+
+
+def test_priority_policy():
+    tasks = [queued('old-low', 30, priority=20), queued('new-high', 1, priority=5)]
+    assert pick(tasks, 'priority') == 'new-high'
+    # Same priority: video first, then the older task
+    tasks = [queued('image', 30, priority=10), queued('video', 1, priority=10, task_type='video')]
+    assert pick(tasks, 'priority') == 'video'
+    assert pick([queued('newer', 1, priority=10), queued('older', 2, priority=10)], 'priority') == 'older'
+
+
+def test_fifo_ignores_priority():
+    tasks = [queued('old-low', 30, priority=20), queued('new-high', 1, priority=5)]
+    assert pick(tasks, 'fifo') == 'old-low'
+
+
+def test_shortest_first():
+    tasks = [queued('video', 30, task_type='video'), queued('image', 1)]
+    assert pick(tasks, 'shortest_first') == 'image'
+
+
+def test_priority_aging_lets_waiting_tasks_through():
+    waited_long = queued('waited', 30, priority=20) # 30 minutes are worth 30 points
+    assert pick([waited_long, queued('fresh', 0, priority=5)], 'priority_aging') == 'waited'
+    assert pick([queued('waited', 5, priority=20), queued('fresh', 0, priority=5)], 'priority_aging') == 'fresh'
+
+
+def test_edf_runs_the_most_urgent_task_first():
+    tasks = [queued('no-deadline', 60, priority=1),
+             queued('due-later', 1, deadline=(NOW + timedelta(hours=2)).isoformat()),
+             queued('due-soon', 0, deadline=(NOW + timedelta(minutes=30)).isoformat())]
+    assert pick(tasks, 'edf') == 'due-soon'
+
+
+def test_edf_starts_long_tasks_early():
+    # The video is due later but needs longer than the gap between the two deadlines
+    tasks = [queued('image', 1, deadline=(NOW + timedelta(minutes=10)).isoformat()),
+             queued('video', 1, task_type='video', deadline=(NOW + timedelta(minutes=12)).isoformat())]
+    assert pick(tasks, 'edf') == 'video'
+
+
+def test_unknown_policy_falls_back_to_default():
+    assert qm.configured_policy({'scheduling_policy': 'nope'}) == qm.DEFAULT_SCHEDULING_POLICY
+    assert qm.configured_policy({'scheduling_policy': 'edf'}) == 'edf'
+
+
+def test_no_queued_tasks():
+    assert qm.pick_next_task([], policy='priority') is None
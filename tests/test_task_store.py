@@ -0,0 +1,240 @@
+import os
+import threading
+
+import pytest
+
+import admin_routes
+import file_helpers as fh
+import metrics
+from models import Task
+
+
+def make_task(task_id, **fields):
+    fields.setdefault('status', 'queued')
+    fields.setdefault('task_type', 'image')
+    fields.setdefault('created_at', '2026-01-01T00:00:00')
+    return Task(task_id, invite_code='inv-' + task_id, **fields)
+
+
+def test_grouped_updates_all_land():
+    fh.save_tasks([make_task(f't{i}') for i in range(20)])
+    threads = [threading.Thread(target=fh.update_task, args=(f't{i}', {"priority": i})) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(task.priority for task in fh.load_tasks()) == list(range(20))
+
+
+def test_queued_updates_are_visible_before_they_are_written():
+    fh.save_tasks([make_task('a')])
+    fh.update_task('a', {"progress": "50%"}, wait=False)
+    assert fh.get_task_by_id('a').progress == "50%"
+    fh.flush_task_updates()
+    assert fh.get_task_by_id('a').progress == "50%"
+
+
+def test_update_of_unknown_task_reports_it():
+    fh.save_tasks([make_task('a')])
+    assert fh.update_task('missing', {"priority": 1}) is False
+    assert fh.update_task('a', {"priority": 1}) is True
+
+
+def test_none_removes_a_field():
+    fh.save_tasks([make_task('a', progress="50%")])
+    fh.update_task('a', {"progress": None})
+    assert 'progress' not in fh.load_json_with_lock(fh.TASKS_FILE)['tasks'][0]
+
+
+def test_aborted_transaction_leaves_files_untouched():
+    fh.save_tasks([make_task('a')])
+    before = open(fh.TASKS_FILE).read()
+    with fh.json_transaction(fh.TASKS_FILE) as documents:
+        documents[0] = {"tasks": []}
+        raise fh.AbortTransaction()
+    assert open(fh.TASKS_FILE).read() == before
+
+
+def test_failed_write_keeps_the_old_file(monkeypatch):
+    fh.save_tasks([make_task('a')])
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(fh.os, 'replace', fail)
+        with pytest.raises(OSError):
+            with fh.json_transaction(fh.TASKS_FILE) as documents:
+                documents[0] = {"tasks": []}
+    assert [task.task_id for task in fh.load_tasks()] == ['a']
+    assert [name for name in os.listdir(fh.DATA_DIR) if name.endswith('.tmp')] == []
+
+
+def test_readers_share_the_lock_and_writers_wait_for_them():
+    fh.save_tasks([make_task('a')])
+    writer_done = threading.Event()
+
+    def write():
+        fh.update_task('a', {"priority": 1})
+        writer_done.set()
+
+    with fh._locked(fh.TASKS_FILE, shared=True):
+        with fh._locked(fh.TASKS_FILE, shared=True): # A second reader gets in right away
+            pass
+        writer = threading.Thread(target=write)
+        writer.start()
+        assert not writer_done.wait(0.3) # Held up by the reader
+    writer.join(5)
+    assert writer_done.is_set()
+    assert fh.get_task_by_id('a').priority == 1
+
+
+def test_lock_waits_are_counted():
+    taken = metrics.get_counter('store_lock_acquisitions_total', file='tasks.json', mode='exclusive')
+    fh.save_tasks([make_task('a')])
+    assert metrics.get_counter('store_lock_acquisitions_total', file='tasks.json', mode='exclusive') == taken + 1
+    shared = metrics.get_counter('store_lock_acquisitions_total', file='task_details', mode='shared')
+    with fh._locked(fh._task_details_path('a'), shared=True):
+        pass
+    # One label for every task's details file
+    assert metrics.get_counter('store_lock_acquisitions_total', file='task_details', mode='shared') == shared + 1
+
+
+def test_cancel_only_touches_unfinished_tasks():
+    fh.save_tasks([make_task('a'), make_task('b', status='completed')])
+    assert fh.cancel_task('a', "Stop.")
+    assert not fh.cancel_task('b')
+    assert not fh.cancel_task('missing')
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message) == ('cancelled', "Stop.")
+
+
+def test_retry_requeues_failed_task_and_clears_its_run():
+    fh.save_tasks([make_task('a', status='failed', error_message='boom', stdout='out', output_path='/tmp/x.jpg',
+                             completed_at='2026-01-01T00:01:00', lease_owner='node-a')])
+    assert fh.retry_task('a')
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message, task.output_path, task.completed_at, task.lease_owner) == \
+        ('queued', None, None, None, None)
+    assert task.stdout is None
+
+
+def test_retry_refuses_running_tasks():
+    fh.save_tasks([make_task('a', status='processing')])
+    assert not fh.retry_task('a')
+    assert fh.get_task_by_id('a').status == 'processing'
+
+
+def test_delete_removes_task_and_details():
+    fh.save_tasks([make_task('a', stdout='out'), make_task('b')])
+    removed = fh.delete_task('a')
+    assert removed.task_id == 'a'
+    assert [task.task_id for task in fh.load_tasks()] == ['b']
+    assert fh.load_task_details('a') == {}
+    assert fh.delete_task('a') is None
+
+
+def test_admin_priority_change_keeps_a_concurrent_claim(admin_client, monkeypatch):
+    fh.save_tasks([make_task('a', priority=20)])
+    look_up = admin_routes.get_task_by_id
+
+    def look_up_then_claim(task_id):
+        task = look_up(task_id) # The admin action has seen the task queued...
+        fh.claim_next_task('node-x', lambda queued: queued[0], lease_seconds=60) # ...when a node claims it
+        return task
+
+    monkeypatch.setattr(admin_routes, 'get_task_by_id', look_up_then_claim)
+    response = admin_client.post('/admin/queue', data={'task_id': 'a', 'action': 'update_priority', 'priority': '5'})
+
+    assert response.status_code == 302
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.lease_owner, task.priority) == ('processing', 'node-x', 5)
+
+
+def test_admin_retry_and_delete_leave_other_tasks_alone(admin_client):
+    fh.save_tasks([make_task('a', status='failed', error_message='boom'), make_task('b'), make_task('c')])
+    admin_client.post('/admin/queue', data={'task_id': 'a', 'action': 'retry_task'})
+    fh.claim_next_task('node-x', lambda queued: next(t for t in queued if t.task_id == 'b'))
+    admin_client.post('/admin/queue', data={'task_id': 'c', 'action': 'delete_task'})
+
+    tasks = {task.task_id: task for task in fh.load_tasks()}
+    assert sorted(tasks) == ['a', 'b']
+    assert tasks['a'].status == 'queued'
+    assert (tasks['b'].status, tasks['b'].lease_owner) == ('processing', 'node-x')
+
+
+def test_admin_delete_removes_the_task_files(admin_client, tmp_path):
+    files = {}
+    for name in ('source', 'target', 'output'):
+        files[name] = tmp_path / f'{name}.png'
+        files[name].write_bytes(b'x')
+    fh.save_tasks([make_task('a', status='completed', source_path=str(files['source']),
+                             target_path=str(files['target']), output_path=str(files['output']))])
+    admin_client.post('/admin/queue', data={'task_id': 'a', 'action': 'delete_task'})
+    assert not any(path.exists() for path in files.values())
+
+
+def test_admin_action_on_unknown_task(admin_client):
+    response = admin_client.post('/admin/queue', data={'task_id': 'zz', 'action': 'delete_task'}, follow_redirects=True)
+    assert b'not found' in response.data
+
+
+def test_claim_sets_a_lease_and_skips_claimed_tasks():
+    fh.save_tasks([make_task('a', priority=1), make_task('b', priority=2)])
+    first = fh.claim_next_task('node-a', lambda queued: min(queued, key=lambda t: t.priority), lease_seconds=60)
+    second = fh.claim_next_task('node-b', lambda queued: min(queued, key=lambda t: t.priority), lease_seconds=60)
+    assert (first.task_id, second.task_id) == ('a', 'b')
+    assert fh.get_task_by_id('a').lease_owner == 'node-a'
+    assert fh.get_task_by_id('a').lease_expires_at
+    assert fh.claim_next_task('node-c', lambda queued: queued[0]) is None
+
+
+def test_expired_lease_is_requeued_and_claimed_again():
+    fh.save_tasks([make_task('a')])
+    fh.claim_next_task('node-a', lambda queued: queued[0], lease_seconds=60)
+    fh.update_task('a', {"lease_expires_at": "2020-01-01T00:00:00+00:00"})
+    claimed = fh.claim_next_task('node-b', lambda queued: queued[0], lease_seconds=60)
+    assert claimed.task_id == 'a'
+    assert fh.get_task_by_id('a').lease_owner == 'node-b'
+
+
+def test_leased_update_is_refused_after_a_takeover():
+    fh.save_tasks([make_task('a', status='processing', lease_owner='node-b',
+                             lease_expires_at='2099-01-01T00:00:00+00:00')])
+    assert not fh.update_leased_task('a', 'node-a', {"status": "failed", "stdout": "late", "error_message": "late"})
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message) == ('processing', None)
+    assert fh.load_task_details('a') == {}
+
+    assert fh.update_leased_task('a', 'node-b', {"status": "completed", "stdout": "done", "lease_expires_at": None})
+    assert fh.get_task_by_id('a').status == 'completed'
+    assert fh.load_task_details('a') == {"stdout": "done"}
+
+
+def test_leased_update_is_refused_once_the_lease_expired():
+    fh.save_tasks([make_task('a', status='processing', lease_owner='node-a',
+                             lease_expires_at='2020-01-01T00:00:00+00:00')])
+    assert not fh.update_leased_task('a', 'node-a', {"status": "completed"})
+
+
+def test_renewal_is_refused_after_a_cancel():
+    fh.save_tasks([make_task('a')])
+    fh.claim_next_task('node-a', lambda queued: queued[0], lease_seconds=60)
+    renewed = fh.renew_task_lease('a', 'node-a', 60, {"progress": "10%"})
+    assert (renewed.status, renewed.progress) == ('processing', "10%")
+
+    fh.cancel_task('a')
+    assert fh.renew_task_lease('a', 'node-a', 60, {"progress": "20%"}) is None
+    task = fh.get_task_by_id('a')
+    assert task.status == 'cancelled'
+    assert task.progress != "20%"
+
+
+def test_action_runs_only_while_the_lease_is_held():
+    fh.save_tasks([make_task('a', status='processing', lease_owner='node-a',
+                             lease_expires_at='2099-01-01T00:00:00+00:00')])
+    calls = []
+    assert fh.run_if_leased('a', 'node-a', lambda: calls.append('a'))
+    assert not fh.run_if_leased('a', 'node-b', lambda: calls.append('b'))
+    fh.cancel_task('a')
+    assert not fh.run_if_leased('a', 'node-a', lambda: calls.append('late'))
+    assert calls == ['a']
@@ -0,0 +1,82 @@
+import pytest
+
+import tracing
+
+
+def events(*pairs):
+    return [{"task_id": "a", "event": event, "at": at} for event, at in pairs]
+
+
+def record(task_id, *pairs):
+    for event, at in pairs:
+        tracing.record_event(task_id, event, at=at)
+
+
+def test_stage_durations_of_a_single_render():
+    durations = tracing.stage_durations(events(
+        ('request_started', 0), ('upload_received', 2), ('files_saved', 2.5), ('queued', 2.5), ('claimed', 12.5),
+        ('process_spawned', 13), ('first_progress', 18), ('process_exited', 48), ('output_finalized', 49),
+        ('completed', 49)))
+    assert durations == {'upload': 2, 'ingest': 0.5, 'queue_wait': 10, 'spawn': 0.5, 'model_load': 5,
+                         'render': 30, 'finalize': 1}
+
+
+def test_repeated_stages_are_summed():
+    # Two batch items: each spawns, loads the model and renders again
+    durations = tracing.stage_durations(events(
+        ('queued', 0), ('claimed', 1),
+        ('process_spawned', 2), ('first_progress', 4), ('process_exited', 10), ('output_finalized', 11),
+        ('process_spawned', 12), ('first_progress', 15), ('process_exited', 20), ('output_finalized', 20.5)))
+    assert durations['spawn'] == 2
+    assert durations['model_load'] == 5
+    assert durations['render'] == 11
+    assert durations['finalize'] == pytest.approx(1.5)
+
+
+def test_render_without_output_has_no_render_stage():
+    durations = tracing.stage_durations(events(('claimed', 0), ('process_spawned', 1), ('process_exited', 3)))
+    assert durations == {'spawn': 1, 'model_load': 2}
+
+
+def test_timelines_newest_first_with_outcome():
+    record('old', ('queued', 100), ('claimed', 101), ('completed', 110))
+    record('new', ('queued', 200), ('claimed', 205))
+    timelines = tracing.task_timelines()
+    assert [t['task_id'] for t in timelines] == ['new', 'old']
+    assert (timelines[0]['outcome'], timelines[0]['total']) == (None, None) # Still running
+    assert (timelines[1]['outcome'], timelines[1]['total']) == ('completed', 10)
+    assert [t['task_id'] for t in tracing.task_timelines(task_id='old')] == ['old']
+    assert tracing.task_timelines(limit=1)[0]['task_id'] == 'new'
+
+
+def test_torn_lines_are_skipped():
+    record('a', ('queued', 1), ('claimed', 3))
+    with open(tracing.EVENTS_FILE, 'a') as f:
+        f.write('{"task_id": "a", "ev') # Crashed mid-write
+    assert [e['event'] for e in tracing.read_events()] == ['queued', 'claimed']
+
+
+def test_log_is_rotated_and_both_halves_are_read(monkeypatch):
+    monkeypatch.setattr(tracing, 'MAX_EVENT_LOG_BYTES', 200)
+    for at in range(10):
+        tracing.record_event('a', 'queued', at=at)
+    assert [e['at'] for e in tracing.read_events()] == list(range(10))
+
+
+def test_histograms():
+    timelines = [{"stages": {"render": seconds}, "total": seconds + 1} for seconds in (0.2, 3, 4, 4000)]
+    histograms = tracing.stage_histograms(timelines)
+    render = histograms['render']
+    assert (render['count'], render['p50'], render['max']) == (4, 4, 4000)
+    assert dict(render['buckets'])[0.5] == 1
+    assert dict(render['buckets'])[5] == 2
+    assert dict(render['buckets'])[None] == 1
+    assert 'upload' not in histograms
+    assert histograms['total']['count'] == 4
+
+
+def test_admin_trace_page(admin_client):
+    record('a', ('queued', 100), ('claimed', 102), ('completed', 110))
+    response = admin_client.get('/admin/trace')
+    assert response.status_code == 200
+    assert b'queue_wait' in response.data
@@ -0,0 +1,48 @@
+import io
+import os
+
+import pytest
+
+import file_helpers as fh
+import ingest
+import user_routes
+from models import Invite
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+
+
+@pytest.fixture
+def submit(app, monkeypatch):
+    """Submits uploads with invite 'abc' (created by the test); the ingest thread is left out."""
+    enqueued = []
+    monkeypatch.setattr(user_routes, 'enqueue_ingest', lambda task_id, entries: enqueued.append((task_id, entries)))
+
+    def submit_files(**files):
+        client = app.test_client()
+        client.post('/', data={'invite_code': 'abc'})
+        data = {key: [(io.BytesIO(PNG), name) for name in names] if isinstance(names, list) else (io.BytesIO(PNG), names)
+                for key, names in files.items()}
+        response = client.post('/render/abc', content_type='multipart/form-data', data=data)
+        return response, enqueued
+    return submit_files
+
+
+def test_submission_reserves_an_ingesting_task(submit):
+    fh.save_invites([Invite('abc', 'image')])
+    response, enqueued = submit(source_image='s.png', target_media='t.png')
+    assert response.status_code == 302
+    [task] = fh.load_tasks()
+    assert task.status == 'ingesting'
+    assert fh.get_invite_by_code('abc').used
+    [(task_id, entries)] = enqueued
+    assert task_id == task.task_id
+    assert [entry['role'] for entry in entries] == ['source', 'target']
+    assert all(os.path.exists(entry['spool']) for entry in entries) # Kept for the ingest thread
+
+
+def test_submission_without_files_is_refused(submit):
+    fh.save_invites([Invite('abc', 'image')])
+    response, enqueued = submit(source_image='s.png')
+    assert fh.load_tasks() == [] and enqueued == []
+    assert not fh.get_invite_by_code('abc').used
+    assert os.listdir(ingest.INGEST_DIR) == [] # The spooled source was dropped with the request
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+import file_helpers as fh
+import worker_api
+from models import Task
+
+TOKENS = {'node-a': 'token-a', 'node-b': 'token-b'}
+
+
+@pytest.fixture
+def worker_client(app):
+    config = fh.load_config()
+    config['worker_tokens'] = TOKENS
+    fh.save_config(config)
+    return app.test_client()
+
+
+def headers(worker):
+    return {'Authorization': 'Bearer ' + TOKENS[worker]}
+
+
+def post(client, path, worker, json=None):
+    return client.post('/api/worker' + path, json=json or {}, headers=headers(worker))
+
+
+def leased_task(owner):
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='processing', lease_owner=owner,
+                        lease_expires_at='2099-01-01T00:00:00+00:00', created_at='2026-01-01T00:00:00')])
+
+
+def lose_lease_after_check(monkeypatch):
+    check_lease = worker_api._leased_task
+
+    def check_then_lose_lease(task_id):
+        task = check_lease(task_id) # Still ours here...
+        fh.update_task(task_id, {"lease_owner": "node-b"}) # ...then the lease expires and node-b claims it
+        return task
+
+    monkeypatch.setattr(worker_api, '_leased_task', check_then_lose_lease)
+
+
+def test_unknown_token_is_rejected(worker_client):
+    response = worker_client.post('/api/worker/claim', json={}, headers={'Authorization': 'Bearer nope'})
+    assert response.status_code == 401
+
+
+def test_claim_upload_and_complete(worker_client, tmp_path):
+    source, target = tmp_path / 'source.png', tmp_path / 'target.png'
+    source.write_bytes(b'source')
+    target.write_bytes(b'target')
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='queued', source_path=str(source),
+                        target_path=str(target), created_at='2026-01-01T00:00:00')])
+
+    claimed = post(worker_client, '/claim', 'node-a')
+    assert claimed.status_code == 200
+    assert claimed.json['task_id'] == 'a'
+    assert post(worker_client, '/claim', 'node-b').status_code == 204
+
+    download = worker_client.get(claimed.json['target']['url'], headers=headers('node-a'))
+    assert download.data == b'target'
+    assert post(worker_client, '/tasks/a/progress', 'node-a', {"progress": "50%"}).status_code == 200
+    assert fh.get_task_by_id('a').progress == "50%"
+
+    upload = worker_client.put('/api/worker/tasks/a/output', data=b'rendered', headers=headers('node-a'))
+    assert upload.status_code == 200
+    completed = post(worker_client, '/tasks/a/complete', 'node-a', {"stdout": "ok"})
+    assert completed.json == {"status": "completed"}
+
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.stdout) == ('completed', 'ok')
+    assert open(task.output_path, 'rb').read() == b'rendered'
+
+
+def test_complete_without_output_is_rejected(worker_client):
+    leased_task('node-a')
+    assert post(worker_client, '/tasks/a/complete', 'node-a').status_code == 400
+    assert fh.get_task_by_id('a').status == 'processing'
+
+
+def test_owner_can_fail_its_task(worker_client):
+    leased_task('node-a')
+    response = post(worker_client, '/tasks/a/fail', 'node-a', {"error_message": "boom", "stderr": "trace"})
+    assert response.status_code == 200
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.error_message, task.stderr) == ('failed', 'boom', 'trace')
+
+
+def test_other_node_gets_409(worker_client):
+    leased_task('node-b')
+    assert post(worker_client, '/tasks/a/fail', 'node-a').status_code == 409
+    assert fh.get_task_by_id('a').status == 'processing'
+
+
+def test_cancelled_task_gets_409(worker_client):
+    leased_task('node-a')
+    fh.cancel_task('a')
+    assert post(worker_client, '/tasks/a/progress', 'node-a', {"progress": "90%"}).status_code == 409
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.progress) == ('cancelled', None)
+
+
+def test_takeover_between_check_and_write_is_caught(worker_client, monkeypatch):
+    leased_task('node-a')
+    lose_lease_after_check(monkeypatch)
+    response = post(worker_client, '/tasks/a/fail', 'node-a', {"error_message": "too late"})
+
+    assert response.status_code == 409
+    task = fh.get_task_by_id('a')
+    assert (task.status, task.lease_owner, task.error_message) == ('processing', 'node-b', None)
+
+
+def test_progress_after_takeover_is_refused(worker_client, monkeypatch):
+    leased_task('node-a')
+    lose_lease_after_check(monkeypatch)
+    response = post(worker_client, '/tasks/a/progress', 'node-a', {"progress": "90%"})
+
+    assert response.status_code == 409
+    task = fh.get_task_by_id('a')
+    assert (task.lease_owner, task.progress) == ('node-b', None)
+
+
+def test_upload_after_takeover_leaves_no_output(worker_client, monkeypatch):
+    leased_task('node-a')
+    lose_lease_after_check(monkeypatch)
+    response = worker_client.put('/api/worker/tasks/a/output', data=b'late', headers=headers('node-a'))
+
+    assert response.status_code == 409
+    output_dir = os.path.dirname(worker_api.task_output_path(fh.get_task_by_id('a')))
+    assert os.listdir(output_dir) == [] # Neither the output nor the partial upload
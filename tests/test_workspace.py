@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import file_helpers as fh
+import queue_manager as qm
+import workspace as ws
+from models import Task
+
+# Writes 2 MB into the workspace, then takes its time
+WRITE_AND_WAIT = "open('big.bin', 'wb').write(b'0' * 2 * 1024 * 1024); import time; time.sleep(30)"
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(ws, 'POLL_SECONDS', 0.05)
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_workspaces_live_in_their_own_directory(tmp_path):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path / 'shm'))
+    assert workspace.path == str(tmp_path / 'shm' / ws.WORKSPACES_DIRNAME / 't1')
+    assert os.path.isdir(workspace.path)
+    assert ws.TaskWorkspace('t2').path == os.path.join(ws.DEFAULT_SCRATCH_DIR, 't2')
+
+
+def test_link_input_and_cleanup(tmp_path):
+    source = tmp_path / 'target.png'
+    source.write_bytes(b'target')
+    with ws.TaskWorkspace('t1', str(tmp_path)) as workspace:
+        linked = workspace.link_input(str(source), 'target.png')
+        assert open(linked, 'rb').read() == b'target'
+        assert workspace.usage_bytes() == 0 # Hard link, it costs no scratch space
+    assert not os.path.exists(workspace.path)
+    assert source.exists()
+
+
+def test_quota_stops_the_render(tmp_path):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path), quota_mb=1)
+    started = time.monotonic()
+    with pytest.raises(ws.QuotaExceeded):
+        ws.run_monitored(python(WRITE_AND_WAIT), workspace.path, workspace, timeout=60)
+    assert time.monotonic() - started < 10 # Killed, not waited for
+
+
+def test_cancel_stops_the_render(tmp_path):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path))
+    events = []
+    with pytest.raises(ws.TaskCancelled):
+        ws.run_monitored(python("import time; time.sleep(30)"), workspace.path, workspace, timeout=60,
+                         is_cancelled=lambda: True, on_event=events.append)
+    assert events == ['process_spawned', 'process_exited']
+
+
+def test_failed_render_raises_with_its_output(tmp_path):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path))
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        ws.run_monitored(python("import sys; print('out'); sys.exit('err')"), workspace.path, workspace, timeout=60)
+    assert (raised.value.stdout, raised.value.stderr) == ('out\n', 'err\n')
+
+
+def test_promote_on_the_same_filesystem(tmp_path):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path))
+    scratch = workspace.file('output.jpg')
+    open(scratch, 'wb').write(b'out')
+    final = str(tmp_path / 'outputs' / 'inv' / 't1.jpg')
+    assert workspace.promote(scratch, final) == final
+    assert open(final, 'rb').read() == b'out'
+    assert not os.path.exists(scratch)
+
+
+def test_promote_across_filesystems(tmp_path, monkeypatch):
+    workspace = ws.TaskWorkspace('t1', str(tmp_path))
+    scratch = workspace.file('output.jpg')
+    open(scratch, 'wb').write(b'out')
+    final = tmp_path / 'outputs' / 't1.jpg'
+    replace = os.replace
+    calls = []
+
+    def replace_across_devices(src, dst):
+        calls.append(src)
+        if len(calls) == 1:
+            raise OSError(18, 'Invalid cross-device link')
+        return replace(src, dst)
+
+    monkeypatch.setattr(ws.os, 'replace', replace_across_devices)
+    workspace.promote(scratch, str(final))
+    assert final.read_bytes() == b'out'
+    assert not os.path.exists(scratch)
+    assert os.listdir(final.parent) == ['t1.jpg'] # No .part file left
+
+
+def test_sweep_only_removes_workspaces(tmp_path):
+    scratch = tmp_path / 'shm'
+    ws.TaskWorkspace('old', str(scratch))
+    ws.TaskWorkspace('running', str(scratch))
+    (scratch / 'someone-elses').mkdir()
+    (scratch / 'file.txt').write_text('keep')
+
+    ws.sweep_workspaces(str(scratch), keep={'running'})
+    assert sorted(os.listdir(scratch)) == ['faceswap-workspaces', 'file.txt', 'someone-elses']
+    assert os.listdir(scratch / ws.WORKSPACES_DIRNAME) == ['running']
+    ws.sweep_workspaces(str(tmp_path / 'missing')) # Nothing to sweep
+
+
+def test_local_worker_fails_task_over_quota(tmp_path, local_worker_config):
+    with open(os.path.join(local_worker_config['deep_live_cam_path'], 'run.py'), 'w') as f:
+        # Like Deep-Live-Cam's frames, the big file goes next to the target
+        f.write("import os, sys; os.chdir(os.path.dirname(sys.argv[sys.argv.index('-t') + 1]))\n" + WRITE_AND_WAIT)
+    scratch = tmp_path / 'shm'
+    fh.save_config(dict(local_worker_config, scratch_dir=str(scratch), scratch_quota_mb=1))
+    target = tmp_path / 'target.png'
+    target.write_bytes(b'target')
+    fh.save_tasks([Task('a', invite_code='inv', task_type='image', status='queued', source_path=str(target),
+                        target_path=str(target), created_at='2026-01-01T00:00:00')])
+
+    qm.process_task(fh.claim_next_task(qm.LOCAL_WORKER_ID, lambda queued: queued[0]), fh.load_config())
+    task = fh.get_task_by_id('a')
+    assert task.status == 'failed'
+    assert task.error_message.startswith("Scratch space quota exceeded")
+    assert os.listdir(scratch / ws.WORKSPACES_DIRNAME) == [] # Cleaned up
+    assert not os.path.exists(qm.task_output_path(task))
@@ -0,0 +1,178 @@
+"""
+Per-task stage timeline.
+
+Points in a task's life are appended to EVENTS_FILE as one JSON line each
+({"task_id": ..., "event": ..., "at": <unix time>, ...}); nothing is read or
+locked on the way, so recording stays cheap enough for the render path. The
+events, in the order a task normally goes through them:
+
+    request_started    POST /render arrived, before its body is read
+    upload_received    upload body spooled to disk, task reserved
+    files_saved        ingest moved and checked the uploaded files
+    queued             waiting for a worker (also after a retry or a lost lease)
+    claimed            taken by a worker
+    process_spawned    run.py started (once per batch item)
+    first_progress     run.py wrote its first output, i.e. models are loaded
+    process_exited     run.py finished
+    output_finalized   output moved (or uploaded by a render node) to outputs/
+    completed / failed / cancelled
+
+STAGES turns them into durations (upload, ingest, queue_wait, ...) and
+task_timelines() / stage_histograms() feed the admin trace view. The log is
+rotated to EVENTS_FILE + '.1' at MAX_EVENT_LOG_BYTES and readers only look at
+the last READ_BYTES of it, so neither file size nor the admin page grow without
+bound.
+
+Like workspace.py this module doesn't import the app's store.
+"""
+import json
+import os
+import time
+from threading import Lock
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+EVENTS_FILE = os.path.join(DATA_DIR, 'task_events.jsonl')
+MAX_EVENT_LOG_BYTES = 16 * 1024 * 1024
+READ_BYTES = 4 * 1024 * 1024 # Covers a few thousand recent tasks
+
+FINAL_EVENTS = ('completed', 'failed', 'cancelled')
+
+# (stage, start events, end events). A stage lasts from the latest start event to
+# the next end event and is summed when it repeats (batch items, retries).
+STAGES = (
+    ('upload', ('request_started',), ('upload_received',)),
+    ('ingest', ('upload_received',), ('files_saved',)),
+    ('queue_wait', ('queued',), ('claimed',)),
+    ('spawn', ('claimed', 'process_exited', 'output_finalized'), ('process_spawned',)),
+    ('model_load', ('process_spawned',), ('first_progress', 'process_exited')),
+    ('render', ('first_progress',), ('process_exited', 'output_finalized')),
+    ('finalize', ('process_exited',), ('output_finalized',)),
+)
+STAGE_NAMES = [stage for stage, _, _ in STAGES]
+
+HISTOGRAM_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800) # Upper bounds in seconds, plus +Inf
+
+_write_lock = Lock()
+_write_errors = 0
+
+
+def record_event(task_id, event, at=None, **fields):
+    """Appends one event for `task_id`. Never raises, tracing must not break a render."""
+    global _write_errors
+    entry = {"task_id": task_id, "event": event, "at": round(at if at is not None else time.time(), 3)}
+    entry.update({key: value for key, value in fields.items() if value is not None})
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+    try:
+        with _write_lock:
+            # O_APPEND + a single write: lines from several threads and processes don't interleave
+            fd = os.open(EVENTS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > MAX_EVENT_LOG_BYTES:
+                os.replace(EVENTS_FILE, EVENTS_FILE + '.1')
+    except OSError as e:
+        _write_errors += 1
+        if _write_errors == 1: # Once, not on every event
+            print(f"Could not write task event to {EVENTS_FILE}: {e}")
+
+
+def _read_tail(file_path, limit):
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(size - limit, 0))
+            data = f.read(limit)
+    except OSError:
+        return [], 0
+    lines = data.split(b'\n')
+    if size > limit:
+        lines = lines[1:] # Started mid-line
+    return lines, len(data)
+
+
+def read_events(max_bytes=READ_BYTES):
+    """The most recent events, oldest first, from the last `max_bytes` of the log."""
+    lines, used = _read_tail(EVENTS_FILE, max_bytes)
+    if used < max_bytes:
+        older, _ = _read_tail(EVENTS_FILE + '.1', max_bytes - used)
+        lines = older + lines
+    events = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue # Torn line from a crash
+    return events
+
+
+def stage_durations(events):
+    """{stage: seconds} for one task's events (in time order); stages never seen are left out."""
+    durations = {}
+    for stage, starts, ends in STAGES:
+        started_at = None
+        for event in events:
+            if event['event'] in starts:
+                started_at = event['at']
+            elif event['event'] in ends and started_at is not None:
+                durations[stage] = durations.get(stage, 0.0) + max(event['at'] - started_at, 0.0)
+                started_at = None
+    return durations
+
+
+def task_timelines(limit=100, task_id=None):
+    """
+    Timelines of the `limit` most recently active tasks (or just `task_id`), newest
+    first: dicts with task_id, events, stages ({stage: seconds}), total (first
+    event to the final one, None while running) and outcome.
+    """
+    by_task = {}
+    for event in read_events():
+        if 'task_id' in event and 'event' in event and isinstance(event.get('at'), (int, float)):
+            by_task.setdefault(event['task_id'], []).append(event)
+    if task_id is not None:
+        by_task = {task_id: by_task[task_id]} if task_id in by_task else {}
+
+    timelines = []
+    for tid, events in by_task.items():
+        events.sort(key=lambda e: e['at'])
+        final = next((e for e in reversed(events) if e['event'] in FINAL_EVENTS), None)
+        timelines.append({
+            "task_id": tid,
+            "events": events,
+            "stages": stage_durations(events),
+            "total": final['at'] - events[0]['at'] if final else None,
+            "outcome": final['event'] if final else None,
+            "last_at": events[-1]['at'],
+        })
+    timelines.sort(key=lambda t: t['last_at'], reverse=True)
+    return timelines[:limit]
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def stage_histograms(timelines):
+    """
+    Per stage over `timelines`: count, p50, p95, max and bucket counts
+    ([(upper_bound or None for +Inf, count), ...]).
+    """
+    histograms = {}
+    for stage in STAGE_NAMES + ['total']:
+        values = sorted(t['total'] if stage == 'total' else t['stages'][stage]
+                        for t in timelines if (t['total'] if stage == 'total' else t['stages'].get(stage)) is not None)
+        if not values:
+            continue
+        buckets = []
+        lower = 0
+        for upper in HISTOGRAM_BUCKETS + (None,):
+            buckets.append((upper, sum(1 for v in values if v >= lower and (upper is None or v < upper))))
+            lower = upper
+        histograms[stage] = {"count": len(values), "p50": _percentile(values, 0.5),
+                             "p95": _percentile(values, 0.95), "max": values[-1], "buckets": buckets}
+    return histograms
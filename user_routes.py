@@ -1,7 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, make_response
 import os
+import time
 import uuid
-from file_helpers import get_invite_by_code, load_tasks, save_tasks, update_invite_status # Import necessary helpers
+import metrics
+from file_helpers import load_config, get_invite_by_code, create_task_for_invite # Import necessary helpers
+from ingest import enqueue_ingest
+from tracing import record_event
+from deadlines import task_deadline
+from models import Task
+from admission import check_admission
+from queue_manager import DEFAULT_TASK_PRIORITIES
 
 user_bp = Blueprint('user', __name__)
 
@@ -18,16 +26,16 @@ def enter_invite_code():
 
         invite = get_invite_by_code(code)
 
-        if invite and not invite.get('used'):
+        if invite and not invite.used:
             # Store invite details in session to pass to the render page
             # This is generally safer than passing sensitive info directly in URL if it were more complex
             # For just the code and type, URL is fine, but session is also a good practice.
-            session['current_invite_code'] = invite['code']
-            session['current_invite_type'] = invite['type']
+            session['current_invite_code'] = invite.code
+            session['current_invite_type'] = invite.type
             flash(f'Invite code accepted. You can proceed.', 'success')
             # Redirect to the page that will handle rendering, using the original code in the URL for clarity
-            return redirect(url_for('user.render_page', invite_code=invite['code']))
-        elif invite and invite.get('used'):
+            return redirect(url_for('user.render_page', invite_code=invite.code))
+        elif invite and invite.used:
             flash('This invite code has already been used.', 'danger')
         else:
             flash('Invalid invite code. Please check and try again.', 'danger')
@@ -38,35 +46,13 @@ def enter_invite_code():
     return render_template('user/enter_invite.html')
 
 
-@user_bp.route('/render/<invite_code>', methods=['GET', 'POST'])
-def render_page(invite_code):
-    # Security check: Ensure the user arrived here legitimately via the invite code entry
-    # and that the invite_code in URL matches what's in session.
-    session_invite_code = session.get('current_invite_code')
-    session_invite_type = session.get('current_invite_type')
-
-    if not session_invite_code or session_invite_code != invite_code:
-        flash('Invalid access to render page. Please enter your invite code again.', 'warning')
-        return redirect(url_for('user.enter_invite_code'))
-
-    # At this point, session_invite_code is valid and matches invite_code from URL.
-    # We also have session_invite_type.
-
-    # The actual invite object might be useful for display or further checks, though session type is primary driver
-    # invite = get_invite_by_code(invite_code) # Already validated in previous step, but good for consistency
-    # if not invite or invite.get('used'): # Double check, though previous step should handle 'used'
-    #     flash('This invite code is no longer valid.', 'danger')
-    #     session.pop('current_invite_code', None)
-    #     session.pop('current_invite_type', None)
-    #     return redirect(url_for('user.enter_invite_code'))
-
-
 from werkzeug.utils import secure_filename
 from datetime import datetime, timezone
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'webm', 'mov'}
 ALLOWED_TARGET_EXTENSIONS = ALLOWED_IMAGE_EXTENSIONS.union(ALLOWED_VIDEO_EXTENSIONS)
+MAX_BATCH_TARGETS = 50 # Upper bound on targets in one 'batch' invite submission
 
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
@@ -82,46 +68,56 @@ def render_page(invite_code):
         return redirect(url_for('user.enter_invite_code'))
 
     if request.method == 'POST':
-        source_file = request.files.get('source_image')
-        target_file = request.files.get('target_media')
+        request_started = time.time() # Timeline events, recorded once the task exists
+        # Admission control runs before request.files/form are touched, so a rejected
+        # submission never has its upload body read or spooled to disk.
+        admission = check_admission(session_invite_type, request.content_length, current_app.config['UPLOADS_DIR'])
+        if not admission.accepted:
+            flash(admission.message, 'warning')
+            response = make_response(render_template('user/render_page.html', invite_code=invite_code,
+                                                     invite_type=session_invite_type), 503)
+            response.headers['Retry-After'] = str(admission.retry_after)
+            return response
+
+        source_file = request.files.get('source_image') # Reads (spools) the whole upload body
+        upload_received = time.time()
+        # Batch invites send several files under 'target_media', other invites exactly one
+        target_files = [f for f in request.files.getlist('target_media') if f and f.filename != '']
+        is_batch = session_invite_type == 'batch'
 
         if not source_file or source_file.filename == '':
             flash('Source image is required.', 'danger')
             return redirect(request.url)
-        if not target_file or target_file.filename == '':
+        if not target_files:
             flash('Target media is required.', 'danger')
             return redirect(request.url)
+        if not is_batch:
+            target_files = target_files[:1]
+        elif len(target_files) > MAX_BATCH_TARGETS:
+            flash(f'Too many target images. A batch can contain at most {MAX_BATCH_TARGETS}.', 'danger')
+            return redirect(request.url)
 
         if not allowed_file(source_file.filename, ALLOWED_IMAGE_EXTENSIONS):
             flash('Invalid source image file type. Allowed: png, jpg, jpeg, webp.', 'danger')
             return redirect(request.url)
 
         target_allowed_exts = ALLOWED_TARGET_EXTENSIONS if session_invite_type == 'video' else ALLOWED_IMAGE_EXTENSIONS
-        if not allowed_file(target_file.filename, target_allowed_exts):
-            flash(f'Invalid target file type for a "{session_invite_type}" invite. Allowed: {", ".join(target_allowed_exts)}', 'danger')
-            return redirect(request.url)
+        for target_file in target_files:
+            if not allowed_file(target_file.filename, target_allowed_exts):
+                flash(f'Invalid target file type for a "{session_invite_type}" invite. Allowed: {", ".join(target_allowed_exts)}', 'danger')
+                return redirect(request.url)
 
-        # Create unique folder for uploads based on invite_code
-        # Using a subfolder within uploads/invite_code for original files
+        # Uploads end up in a folder per invite_code. The request only claims the spool files
+        # the upload was streamed into; moving them there is left to the ingest thread.
         upload_folder_for_invite = os.path.join(current_app.config['UPLOADS_DIR'], invite_code)
-        os.makedirs(upload_folder_for_invite, exist_ok=True)
 
         source_filename = f"source_{uuid.uuid4().hex}_{secure_filename(source_file.filename)}"
-        target_filename = f"target_{uuid.uuid4().hex}_{secure_filename(target_file.filename)}"
+        source_path_abs = os.path.join(upload_folder_for_invite, source_filename)
 
-        source_path_rel = os.path.join(invite_code, source_filename) # Relative to UPLOADS_DIR
-        target_path_rel = os.path.join(invite_code, target_filename) # Relative to UPLOADS_DIR
-
-        source_path_abs = os.path.join(current_app.config['UPLOADS_DIR'], source_path_rel)
-        target_path_abs = os.path.join(current_app.config['UPLOADS_DIR'], target_path_rel)
-
-        try:
-            source_file.save(source_path_abs)
-            target_file.save(target_path_abs)
-        except Exception as e:
-            current_app.logger.error(f"Error saving uploaded files for invite {invite_code}: {e}")
-            flash('An error occurred while saving your files. Please try again.', 'danger')
-            return redirect(request.url)
+        target_paths_abs = []
+        for target_file in target_files:
+            target_filename = f"target_{uuid.uuid4().hex}_{secure_filename(target_file.filename)}"
+            target_paths_abs.append(os.path.join(upload_folder_for_invite, target_filename))
 
         options = {
             'frame_processor_face_swapper': request.form.get('fp_face_swapper') == 'on',
@@ -140,50 +136,97 @@ def render_page(invite_code):
 
         # Determine task_type based on target file extension for more accurate priority setting
         # This overrides session_invite_type if e.g. an image is uploaded for a 'video' invite.
-        target_ext = target_filename.rsplit('.', 1)[1].lower()
-        actual_task_type = 'video' if target_ext in ALLOWED_VIDEO_EXTENSIONS else 'image'
+        target_ext = target_paths_abs[0].rsplit('.', 1)[1].lower()
+        target_media_kind = 'video' if target_ext in ALLOWED_VIDEO_EXTENSIONS else 'image'
+        actual_task_type = 'batch' if is_batch else target_media_kind
 
         # Priority: Lower number is higher priority. Videos get higher priority.
-        priority = 10 if actual_task_type == 'video' else 20
-
-        new_task = {
-            "task_id": task_id,
-            "invite_code": invite_code,
-            "source_path": source_path_abs, # Store absolute path for the worker
-            "target_path": target_path_abs, # Store absolute path for the worker
-            "options": options,
-            "status": "queued",
-            "output_path": None,
-            "priority": priority,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "task_type": actual_task_type
-        }
-
-        tasks_data = load_tasks()
-        tasks_data.append(new_task)
-        if not save_tasks(tasks_data):
-            flash('Failed to queue your task. Please try again or contact support.', 'danger')
-            # Consider cleanup of uploaded files here if queueing fails
-            return redirect(request.url)
-
-        if not update_invite_status(invite_code, True):
-            # This is a more critical error, means task is queued but invite status not updated
-            current_app.logger.error(f"CRITICAL: Task {task_id} queued but failed to mark invite {invite_code} as used.")
-            flash('Task queued, but there was an issue finalizing your invite. Please contact support if problems persist.', 'warning')
-            # Don't delete files or task, as it's already in queue. Admin might need to check.
+        priority = DEFAULT_TASK_PRIORITIES[actual_task_type]
+
+        # Invites with an SLA class or due-by time give the task a deadline (see deadlines.py)
+        created_at = datetime.now(timezone.utc)
+        invite = get_invite_by_code(invite_code)
+        deadline = task_deadline(invite, created_at, load_config()) if invite else None
+
+        ingest_entries = [
+            {"spool": request.claim_upload(source_file), "dest": source_path_abs, "role": "source", "kinds": ["image"]},
+        ]
+        for index, (target_file, target_path_abs) in enumerate(zip(target_files, target_paths_abs)):
+            ingest_entries.append({"spool": request.claim_upload(target_file), "dest": target_path_abs,
+                                   "role": f"target {index + 1}" if is_batch else "target", "kinds": [target_media_kind]})
+
+        new_task = Task(
+            task_id,
+            invite_code=invite_code,
+            source_path=source_path_abs, # Store absolute path for the worker
+            target_path=None if is_batch else target_paths_abs[0], # Store absolute path for the worker
+            options=options,
+            status="ingesting", # Becomes 'queued' once the ingest thread has validated the files
+            priority=priority,
+            created_at=created_at.isoformat(),
+            deadline=deadline,
+            task_type=actual_task_type,
+            ingest=ingest_entries # Pending spool -> upload moves, cleared by the ingest thread
+        )
+        if is_batch:
+            # One entry per target, each with its own status and output
+            new_task.items = [{"target_path": path, "status": "queued", "output_path": None, "error_message": None}
+                              for path in target_paths_abs]
+
+        # Reserves the task and spends the invite in one transaction.
+        if not create_task_for_invite(new_task, invite_code):
+            for entry in ingest_entries:
+                try:
+                    os.remove(entry['spool'])
+                except OSError:
+                    pass
+            session.pop('current_invite_code', None)
+            session.pop('current_invite_type', None)
+            flash('Failed to queue your task. The invite code may already have been used.', 'danger')
+            return redirect(url_for('user.enter_invite_code'))
+
+        # Counted here rather than in check_admission: only submissions that became a task
+        metrics.inc_counter('admission_accepted_total', invite_type=session_invite_type)
+        record_event(task_id, 'request_started', at=request_started)
+        record_event(task_id, 'upload_received', at=upload_received, bytes=request.content_length)
+        enqueue_ingest(task_id, ingest_entries)
 
         # Clear the invite from session as it's now used
         session.pop('current_invite_code', None)
         session.pop('current_invite_type', None)
 
-        flash('Your files have been uploaded and the task is now queued!', 'success')
+        flash('Your files have been uploaded and the task will be queued shortly!', 'success')
         return redirect(url_for('user.task_status', task_id=task_id))
 
     return render_template('user/render_page.html', invite_code=invite_code, invite_type=session_invite_type)
 
 
-from file_helpers import get_task_by_id # Import get_task_by_id
-from flask import jsonify, send_from_directory
+from file_helpers import get_task_by_id, cancel_task # Import get_task_by_id
+from previews import list_previews, preview_dir
+from flask import jsonify, send_from_directory, Response, abort
+import io
+import zipfile
+
+
+def _display_path(output_path):
+    """Makes an absolute output path relative to OUTPUTS_DIR for the /outputs_serve/ route."""
+    try:
+        return os.path.relpath(output_path, current_app.config['OUTPUTS_DIR'])
+    except ValueError: # Handle cases where path might be on a different drive (Windows) or not relative
+        return None
+
+
+def _items_for_display(task):
+    """Per-target view of a batch task, without the absolute paths."""
+    items = []
+    for index, item in enumerate(task.items or []):
+        items.append({
+            "index": index + 1,
+            "status": item.get('status'),
+            "error_message": item.get('error_message'),
+            "display_output_path": _display_path(item['output_path']) if item.get('output_path') else None,
+        })
+    return items
 
 @user_bp.route('/status/<task_id>')
 def task_status(task_id):
@@ -193,18 +236,17 @@ def task_status(task_id):
         return redirect(url_for('user.enter_invite_code'))
 
     # Make output_path relative for URL generation if it exists
-    if task.get('output_path'):
+    display_output_path = None
+    if task.output_path:
         # Assuming output_path is stored as absolute. We need to make it relative to OUTPUTS_DIR
         # for constructing a URL that the /outputs_serve/ route can handle.
-        try:
-            # Example: C:\app\outputs\invite123\file.mp4 -> invite123/file.mp4
-            task['display_output_path'] = os.path.relpath(task['output_path'], current_app.config['OUTPUTS_DIR'])
-        except ValueError: # Handle cases where path might be on a different drive (Windows) or not relative
-            task['display_output_path'] = None # Or log an error
-            current_app.logger.error(f"Could not create relative path for task {task_id} output: {task['output_path']}")
+        # Example: C:\app\outputs\invite123\file.mp4 -> invite123/file.mp4
+        display_output_path = _display_path(task.output_path)
+        if display_output_path is None:
+            current_app.logger.error(f"Could not create relative path for task {task_id} output: {task.output_path}")
 
-
-    return render_template('user/task_status.html', task=task)
+    return render_template('user/task_status.html', task=task, display_output_path=display_output_path,
+                           display_items=_items_for_display(task))
 
 @user_bp.route('/api/task_status/<task_id>')
 def api_task_status(task_id):
@@ -212,22 +254,45 @@ def api_task_status(task_id):
     if not task:
         return jsonify({"error": "Task not found", "status": "not_found"}), 404
 
-    # Prepare a serializable version of the task, especially output_path
-    api_task_data = task.copy()
-    if api_task_data.get('output_path'):
-        try:
-            api_task_data['display_output_path'] = os.path.relpath(api_task_data['output_path'], current_app.config['OUTPUTS_DIR'])
-        except ValueError:
-            api_task_data['display_output_path'] = None
-
-    # stdout and stderr can be very large, consider omitting or truncating for API response
-    if 'stdout' in api_task_data:
-        del api_task_data['stdout'] # Or truncate: api_task_data['stdout'] = api_task_data['stdout'][:1000]
-    if 'stderr' in api_task_data:
-        del api_task_data['stderr']
+    # Prepare a serializable version of the task, especially output_path.
+    # Heavy fields (options, stdout, stderr) are left out, so they are never even loaded here.
+    api_task_data = task.to_dict()
+    api_task_data.pop('ingest', None)
+    if task.output_path:
+        api_task_data['display_output_path'] = _display_path(task.output_path)
+    if task.items:
+        api_task_data['items'] = _items_for_display(task)
 
     return jsonify(api_task_data)
 
+@user_bp.route('/api/task_preview/<task_id>')
+def api_task_preview(task_id):
+    """Preview frames of a video that is still rendering, see previews.py."""
+    task = get_task_by_id(task_id)
+    if not task:
+        return jsonify({"error": "Task not found", "status": "not_found"}), 404
+    frames = list_previews(task_id) if task.status == 'processing' else []
+    return jsonify({
+        "status": task.status,
+        "progress": task.progress,
+        "frames": [url_for('user.serve_preview_frame', task_id=task_id, filename=name) for name in frames],
+    })
+
+@user_bp.route('/preview/<task_id>/<filename>')
+def serve_preview_frame(task_id, filename):
+    if not get_task_by_id(task_id): # Also keeps task_id from naming any other directory
+        abort(404)
+    # Frames never change once written, they can be cached
+    return send_from_directory(preview_dir(task_id), filename, max_age=3600)
+
+@user_bp.route('/status/<task_id>/cancel', methods=['POST'])
+def cancel_own_task(task_id):
+    """Lets the user stop a task, e.g. when the preview shows the swap went wrong."""
+    if not get_task_by_id(task_id):
+        abort(404)
+    cancel_task(task_id, "Cancelled by the user.")
+    return redirect(url_for('user.task_status', task_id=task_id))
+
 # Route to serve files from the OUTPUTS_DIR
 # Important: Ensure this is secured if direct file access is a concern.
 # For this project, it's assumed invite codes provide some level of obscurity.
@@ -245,3 +310,64 @@ def serve_output_file(filepath):
         return "Invalid path", 400
 
     return send_from_directory(current_app.config['OUTPUTS_DIR'], filepath)
+
+
+class _ZipChunkBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable sink for zipfile. zipfile falls back to data
+    descriptors for such streams, so the archive can be produced front to back
+    and handed out chunk by chunk without ever holding it in memory.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files, chunk_size=1024 * 1024):
+    """
+    Generator yielding a ZIP archive of `files` ((absolute_path, name_in_archive) pairs).
+    Files are stored without compression, images and videos don't compress anyway.
+    """
+    sink = _ZipChunkBuffer()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for file_path, arcname in files:
+            zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+            with open(file_path, 'rb') as src, archive.open(zinfo, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain() # Central directory, written when the archive is closed
+
+
+@user_bp.route('/download/<task_id>.zip')
+def download_task_archive(task_id):
+    """Streams every finished output of a batch task as one ZIP archive."""
+    task = get_task_by_id(task_id)
+    if not task:
+        abort(404)
+    files = []
+    for item in task.items or []:
+        output_path = item.get('output_path')
+        if item.get('status') == 'completed' and output_path and os.path.isfile(output_path):
+            files.append((output_path, os.path.basename(output_path)))
+    if not files:
+        abort(404)
+
+    headers = {"Content-Disposition": f"attachment; filename=faceswap_{task_id[:8]}.zip"}
+    return Response(stream_zip(files), mimetype='application/zip', headers=headers)
@@ -0,0 +1,302 @@
+"""
+HTTP API for remote render nodes, so rendering can scale out past the web node.
+render_worker.py is the matching client.
+
+Every call needs "Authorization: Bearer <token>". Tokens are configured per node
+in config.json under "worker_tokens" ({"node-name": "token", ...}); the node name
+is recorded as the task's lease_owner. Without any token the API is closed.
+
+    POST /api/worker/claim                            claim the next task: 200 + task, 204 if none
+    GET  /api/worker/tasks/<id>/input/source          download the source image
+    GET  /api/worker/tasks/<id>/input/target[?item=N] download the target (N: 1-based batch item)
+    POST /api/worker/tasks/<id>/progress              renew the lease, report progress / item states
+    PUT  /api/worker/tasks/<id>/output[?item=N]       upload an output file (raw body, streamed)
+    POST /api/worker/tasks/<id>/complete              finish the task once its outputs are uploaded
+    POST /api/worker/tasks/<id>/fail                  give up on the task
+
+/progress, /complete and /fail may also carry "events": [{"event": ..., "age":
+seconds ago, "item": N}, ...], the node's render timeline (see tracing.py). Ages
+rather than timestamps, so the nodes' clocks don't have to agree with ours.
+
+A claim is a lease of "worker_lease_seconds" (default 120) that the node renews
+through /progress. If it stops doing so, the task is put back into the queue by a
+later claim. Calls about a task the node no longer holds (lease expired, task
+deleted or retried by an admin) answer 409 and the node should drop the task.
+"""
+import functools
+import hmac
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from flask import Blueprint, request, jsonify, url_for, send_file, g
+
+import metrics
+from file_helpers import load_config, load_tasks, get_task_by_id, claim_next_task, renew_task_lease, lease_expired, update_leased_task, run_if_leased
+from queue_manager import pick_next_task, average_task_durations, task_output_path, batch_item_output_path, batch_final_updates
+from tracing import record_event
+
+worker_api_bp = Blueprint('worker_api', __name__)
+
+DEFAULT_LEASE_SECONDS = 120
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ITEM_STATUSES = ('queued', 'processing', 'completed', 'failed')
+NODE_EVENTS = ('process_spawned', 'first_progress', 'process_exited') # Timeline events a node may report
+
+metrics.describe('worker_claims_total', 'Tasks claimed over the worker API, by node.')
+metrics.describe('worker_results_total', 'Tasks finished over the worker API, by node and status.')
+
+
+def _lease_seconds():
+    try:
+        return max(int(load_config().get('worker_lease_seconds', DEFAULT_LEASE_SECONDS)), 10)
+    except (TypeError, ValueError):
+        return DEFAULT_LEASE_SECONDS
+
+
+def worker_auth_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):].strip() if header.startswith('Bearer ') else ''
+        worker_id = None
+        for name, expected in (load_config().get('worker_tokens') or {}).items():
+            if token and expected and hmac.compare_digest(token.encode('utf-8'), str(expected).encode('utf-8')):
+                worker_id = name
+        if worker_id is None:
+            return jsonify({"error": "Invalid or missing worker token"}), 401
+        g.worker_id = worker_id
+        return view(**kwargs)
+    return wrapped_view
+
+
+def _leased_task(task_id):
+    """The task if the calling node still holds its lease, else None."""
+    task = get_task_by_id(task_id)
+    if task is None or task.status != 'processing' or task.lease_owner != g.worker_id or lease_expired(task):
+        return None
+    return task
+
+
+def _lease_lost():
+    return jsonify({"error": "Task is not leased to this worker"}), 409
+
+
+def _item_index(task):
+    """Zero-based batch item index from ?item=N, or None for single tasks / bad input."""
+    try:
+        index = int(request.args.get('item', '')) - 1
+    except ValueError:
+        return None
+    return index if 0 <= index < len(task.items or []) else None
+
+
+def _input_ref(task, role, path, item=None):
+    return {"url": url_for('worker_api.download_input', task_id=task.task_id, role=role, item=item),
+            "filename": os.path.basename(path)}
+
+
+def _describe_task(task):
+    description = {
+        "task_id": task.task_id,
+        "task_type": task.task_type,
+        "options": task.options,
+        "lease_expires_at": task.lease_expires_at,
+        "lease_seconds": _lease_seconds(),
+        "source": _input_ref(task, 'source', task.source_path),
+    }
+    if task.task_type == 'batch':
+        description["items"] = [{
+            "index": index + 1,
+            "status": item.get('status'),
+            "target": _input_ref(task, 'target', item['target_path'], index + 1),
+            "output_filename": os.path.basename(batch_item_output_path(task, index)),
+        } for index, item in enumerate(task.items or [])]
+    else:
+        description["target"] = _input_ref(task, 'target', task.target_path)
+        description["output_filename"] = os.path.basename(task_output_path(task))
+    return description
+
+
+def _merge_item_states(task, reported):
+    """Applies the item states reported by a node to the task's items (paths stay server-side)."""
+    items = task.items or []
+    for index, state in enumerate(reported or []):
+        if index < len(items) and isinstance(state, dict) and state.get('status') in ITEM_STATUSES:
+            items[index]['status'] = state['status']
+            items[index]['error_message'] = state.get('error_message')
+    return items
+
+
+def _record_node_events(task_id, reported):
+    now = time.time()
+    for entry in reported or []:
+        if not isinstance(entry, dict) or entry.get('event') not in NODE_EVENTS:
+            continue
+        try:
+            age = min(max(float(entry.get('age', 0)), 0.0), 86400.0)
+        except (TypeError, ValueError):
+            continue
+        item = entry.get('item') if isinstance(entry.get('item'), int) else None
+        record_event(task_id, entry['event'], at=now - age, worker=g.worker_id, item=item)
+
+
+@worker_api_bp.route('/claim', methods=['POST'])
+@worker_auth_required
+def claim_task():
+    payload = request.get_json(silent=True) or {}
+    task_types = payload.get('task_types') # Optional, e.g. ["image", "batch"] for a node without video support
+
+    averages = average_task_durations(load_tasks()) # Outside the claim, the store can't be read under its lock
+
+    def choose(queued_tasks):
+        if task_types:
+            queued_tasks = [task for task in queued_tasks if task.task_type in task_types]
+        return pick_next_task(queued_tasks, averages=averages)
+
+    task = claim_next_task(g.worker_id, choose, lease_seconds=_lease_seconds())
+    if task is None:
+        return '', 204
+    metrics.inc_counter('worker_claims_total', worker=g.worker_id)
+    print(f"Task {task.task_id} claimed by render node {g.worker_id}")
+    return jsonify(_describe_task(task))
+
+
+@worker_api_bp.route('/tasks/<task_id>/input/<role>')
+@worker_auth_required
+def download_input(task_id, role):
+    task = _leased_task(task_id)
+    if task is None:
+        return _lease_lost()
+    if role == 'source':
+        path = task.source_path
+    elif role == 'target' and task.task_type == 'batch':
+        index = _item_index(task)
+        if index is None:
+            return jsonify({"error": "Unknown batch item"}), 404
+        path = task.items[index]['target_path']
+    elif role == 'target':
+        path = task.target_path
+    else:
+        return jsonify({"error": "Unknown input"}), 404
+    if not path or not os.path.isfile(path):
+        return jsonify({"error": "Input file is missing on the server"}), 410
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path)) # Streamed from disk
+
+
+@worker_api_bp.route('/tasks/<task_id>/progress', methods=['POST'])
+@worker_auth_required
+def report_progress(task_id):
+    task = _leased_task(task_id)
+    if task is None:
+        return _lease_lost()
+    payload = request.get_json(silent=True) or {}
+    _record_node_events(task_id, payload.get('events'))
+    updates = {}
+    if payload.get('progress') is not None:
+        updates['progress'] = str(payload['progress'])[:200]
+    if task.task_type == 'batch' and payload.get('items'):
+        updates['items'] = _merge_item_states(task, payload['items'])
+    task = renew_task_lease(task_id, g.worker_id, _lease_seconds(), updates)
+    if task is None:
+        return _lease_lost()
+    return jsonify({"lease_expires_at": task.lease_expires_at})
+
+
+@worker_api_bp.route('/tasks/<task_id>/output', methods=['PUT'])
+@worker_auth_required
+def upload_output(task_id):
+    task = _leased_task(task_id)
+    if task is None:
+        return _lease_lost()
+    item = None
+    if task.task_type == 'batch':
+        index = _item_index(task)
+        if index is None:
+            return jsonify({"error": "Unknown batch item"}), 404
+        final_path = batch_item_output_path(task, index)
+        item = index + 1
+    else:
+        final_path = task_output_path(task)
+
+    # Streamed to a temp file next to the final path and renamed once complete,
+    # so a broken upload never leaves a truncated output behind.
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(final_path), prefix='.upload_', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+        if os.path.getsize(tmp_path) == 0:
+            os.remove(tmp_path)
+            return jsonify({"error": "Empty output"}), 400
+        # Renamed under the lease check: the lease may have been taken over while the body streamed in
+        if not run_if_leased(task_id, g.worker_id, lambda: os.replace(tmp_path, final_path)):
+            os.remove(tmp_path)
+            return _lease_lost()
+        record_event(task_id, 'output_finalized', worker=g.worker_id, item=item)
+    except OSError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"Storing output of task {task_id} from {g.worker_id} failed: {e}")
+        return jsonify({"error": "Could not store output"}), 500
+    return jsonify({"stored": os.path.basename(final_path)})
+
+
+@worker_api_bp.route('/tasks/<task_id>/complete', methods=['POST'])
+@worker_auth_required
+def complete_task(task_id):
+    task = _leased_task(task_id)
+    if task is None:
+        return _lease_lost()
+    payload = request.get_json(silent=True) or {}
+    _record_node_events(task_id, payload.get('events'))
+    logs = {"stdout": payload.get('stdout'), "stderr": payload.get('stderr')}
+
+    if task.task_type == 'batch':
+        items = _merge_item_states(task, payload.get('items'))
+        for index, item in enumerate(items):
+            if item.get('status') != 'completed':
+                item.update({"status": "failed", "error_message": item.get('error_message') or "Not processed by the render node."})
+                continue
+            output_path = batch_item_output_path(task, index)
+            if os.path.isfile(output_path):
+                item['output_path'] = output_path
+            else:
+                item.update({"status": "failed", "error_message": "Output was not uploaded."})
+        updates = {**batch_final_updates(task, items), **logs}
+    else:
+        output_path = task_output_path(task)
+        if not os.path.isfile(output_path):
+            return jsonify({"error": "Upload the output before completing the task"}), 400
+        updates = {"status": "completed", "output_path": output_path, "completed_at": datetime.now().isoformat(),
+                   "lease_expires_at": None, "progress": None, **logs}
+
+    # The lease is checked again with the write, it may have been taken over since _leased_task()
+    if not update_leased_task(task_id, g.worker_id, updates):
+        return _lease_lost()
+    metrics.inc_counter('worker_results_total', worker=g.worker_id, status=updates['status'])
+    print(f"Task {task_id} {updates['status']} on render node {g.worker_id}")
+    return jsonify({"status": updates['status']})
+
+
+@worker_api_bp.route('/tasks/<task_id>/fail', methods=['POST'])
+@worker_auth_required
+def fail_task(task_id):
+    task = _leased_task(task_id)
+    if task is None:
+        return _lease_lost()
+    payload = request.get_json(silent=True) or {}
+    _record_node_events(task_id, payload.get('events'))
+    error_message = str(payload.get('error_message') or 'Render node reported a failure.')[:500]
+    if not update_leased_task(task_id, g.worker_id, {
+            "status": "failed", "error_message": error_message, "completed_at": datetime.now().isoformat(),
+            "stdout": payload.get('stdout'), "stderr": payload.get('stderr'), "lease_expires_at": None, "progress": None}):
+        return _lease_lost()
+    metrics.inc_counter('worker_results_total', worker=g.worker_id, status='failed')
+    print(f"Task {task_id} failed on render node {g.worker_id}: {error_message}")
+    return jsonify({"status": "failed"})
@@ -0,0 +1,223 @@
+"""
+Per-task scratch workspaces for renders.
+
+Every render runs in its own directory, <workspace root>/<task_id>. The target is
+linked into it because Deep-Live-Cam puts its extracted frames next to the
+target (temp/<name>/ beside it, kept there with --keep-frames). The output is
+written there too. So everything a render writes is inside the workspace:
+
+- run_monitored() checks the workspace's size against a quota while run.py runs
+  and stops the render when it is exceeded (or when the task is cancelled);
+- promote() moves a finished output to its final name atomically, readers never
+  see a half-written file;
+- cleanup() removes the lot, whatever the outcome.
+
+"scratch_dir" in config.json can point the workspaces at a faster disk, e.g. a
+tmpfs like /dev/shm; "scratch_quota_mb" sets the quota (0 disables it). The
+workspaces then live in <scratch_dir>/WORKSPACES_DIRNAME, a directory only this
+app writes to, so sweep_workspaces() never touches other files in a shared
+directory like /dev/shm or /tmp.
+Like renderers.py this module doesn't import the app's store, render_worker.py
+uses it as well.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+DEFAULT_SCRATCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scratch') # Ours, used as it is
+WORKSPACES_DIRNAME = 'faceswap-workspaces'
+DEFAULT_SCRATCH_QUOTA_MB = 20 * 1024 # A minute of 1080p video as extracted PNG frames is ~5 GB
+POLL_SECONDS = 2.0
+
+
+def workspace_root(scratch_dir=None):
+    """Directory holding the task workspaces for the configured `scratch_dir`."""
+    return os.path.join(scratch_dir, WORKSPACES_DIRNAME) if scratch_dir else DEFAULT_SCRATCH_DIR
+
+
+class QuotaExceeded(Exception):
+    """The render wrote more to its workspace than the quota allows."""
+
+
+class TaskCancelled(Exception):
+    """The task was cancelled while it was rendering."""
+
+
+def _tree_size(path):
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += _tree_size(entry.path)
+            elif not entry.is_symlink():
+                st = entry.stat(follow_symlinks=False)
+                if st.st_nlink == 1: # Hard-linked inputs share their blocks with uploads/, they cost nothing extra
+                    total += st.st_size
+        except OSError:
+            pass # Removed while we were looking, e.g. frames cleaned up by run.py
+    return total
+
+
+class TaskWorkspace:
+    """Scratch directory of one task, see the module docstring."""
+
+    def __init__(self, task_id, scratch_dir=None, quota_mb=DEFAULT_SCRATCH_QUOTA_MB):
+        self.root = workspace_root(scratch_dir)
+        self.path = os.path.join(self.root, task_id)
+        self.quota_bytes = int(quota_mb * 1024 * 1024) if quota_mb else None
+        shutil.rmtree(self.path, ignore_errors=True) # Leftovers of an interrupted earlier attempt
+        os.makedirs(self.path)
+
+    @classmethod
+    def from_config(cls, task_id, app_config):
+        quota_mb = app_config.get('scratch_quota_mb', DEFAULT_SCRATCH_QUOTA_MB)
+        return cls(task_id, app_config.get('scratch_dir'), quota_mb)
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def link_input(self, source_path, name):
+        """
+        Makes `source_path` available inside the workspace as `name` without copying
+        if possible: hard link, then symlink, then a copy (e.g. onto a tmpfs on Windows).
+        """
+        dest = self.file(name)
+        for make_link in (os.link, os.symlink):
+            try:
+                make_link(source_path, dest)
+                return dest
+            except (OSError, NotImplementedError):
+                pass
+        shutil.copyfile(source_path, dest)
+        return dest
+
+    def clear(self):
+        """Empties the workspace, e.g. between the items of a batch."""
+        self.cleanup()
+        os.makedirs(self.path)
+
+    def usage_bytes(self):
+        return _tree_size(self.path)
+
+    def check_quota(self):
+        if self.quota_bytes is None:
+            return
+        usage = self.usage_bytes()
+        if usage > self.quota_bytes:
+            raise QuotaExceeded(f"Scratch space quota exceeded ({usage // (1024 * 1024)} MB used, "
+                                f"{self.quota_bytes // (1024 * 1024)} MB allowed).")
+
+    def promote(self, scratch_path, final_path):
+        """Moves a finished output to `final_path` atomically, across filesystems too."""
+        final_dir = os.path.dirname(final_path)
+        os.makedirs(final_dir, exist_ok=True)
+        try:
+            os.replace(scratch_path, final_path) # Same filesystem: a plain rename
+            return final_path
+        except OSError:
+            pass
+        # Different filesystem (tmpfs scratch): copy next to the final name first, then rename
+        fd, tmp_path = tempfile.mkstemp(dir=final_dir, prefix='.promote_', suffix='.part')
+        os.close(fd)
+        try:
+            shutil.copyfile(scratch_path, tmp_path)
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.remove(scratch_path)
+        return final_path
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+def _has_output(*file_paths):
+    try:
+        return any(os.path.getsize(path) > 0 for path in file_paths)
+    except OSError:
+        return False
+
+
+def run_monitored(cmd, cwd, workspace, timeout, is_cancelled=None, on_poll=None, on_event=None):
+    """
+    Runs `cmd` like subprocess.run(..., capture_output=True, text=True, check=True),
+    but checks every POLL_SECONDS whether the workspace is over quota, whether
+    is_cancelled() is true, and calls on_poll(elapsed_seconds, workspace). Raises
+    CalledProcessError, TimeoutExpired, QuotaExceeded or TaskCancelled; the process
+    is killed before anything is raised.
+    on_event(name) is told 'process_spawned', 'first_progress' (first output seen,
+    at poll resolution) and 'process_exited', see tracing.py.
+    """
+    on_event = on_event or (lambda name: None)
+    stdout_path, stderr_path = workspace.file('stdout.log'), workspace.file('stderr.log')
+    with open(stdout_path, 'wb') as out, open(stderr_path, 'wb') as err:
+        process = subprocess.Popen(cmd, stdout=out, stderr=err, cwd=cwd)
+        on_event('process_spawned')
+        started = time.monotonic()
+        progressed = False
+        try:
+            while True:
+                try:
+                    process.wait(timeout=POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if not progressed and _has_output(stdout_path, stderr_path):
+                    progressed = True
+                    on_event('first_progress')
+                elapsed = time.monotonic() - started
+                if elapsed > timeout:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                workspace.check_quota()
+                if is_cancelled is not None and is_cancelled():
+                    raise TaskCancelled("Task was cancelled.")
+                if on_poll is not None:
+                    on_poll(elapsed, workspace)
+        except BaseException as e:
+            process.kill()
+            process.wait()
+            on_event('process_exited')
+            if isinstance(e, subprocess.TimeoutExpired):
+                e.output, e.stderr = read_log(stdout_path), read_log(stderr_path)
+            raise
+
+    on_event('process_exited')
+    if is_cancelled is not None and is_cancelled():
+        raise TaskCancelled("Task was cancelled.") # Between two polls, e.g. a render shorter than POLL_SECONDS
+    stdout, stderr = read_log(stdout_path), read_log(stderr_path)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def read_log(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError:
+        return ''
+
+
+def sweep_workspaces(scratch_dir=None, keep=()):
+    """Removes workspaces left behind by a crash or restart, except those of task ids in `keep`."""
+    root = workspace_root(scratch_dir) # Never the configured directory itself, it may be shared
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if name not in keep:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)